@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/6.0/ref/settings/
 """
 
 from pathlib import Path
+from decouple import Csv, config
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -45,6 +46,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'transactions.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -52,6 +54,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'transactions.profiling.RequestProfilerMiddleware',
 ]
 
 ROOT_URLCONF = 'config.urls'
@@ -77,13 +80,96 @@ WSGI_APPLICATION = 'config.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/6.0/ref/settings/#databases
 
+# SQLite write transactions begin IMMEDIATE: a writer waits for the database lock up
+# front instead of failing to upgrade a read lock (see transactions.concurrency)
+SQLITE_WRITE_OPTIONS = {'transaction_mode': 'IMMEDIATE'}
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': SQLITE_WRITE_OPTIONS,
     }
 }
 
+# Transaction sharding: users are spread over TRANSACTION_SHARD_COUNT databases by a
+# stable hash of their id (see transactions.sharding). 0 keeps everything on default.
+# Migrate each shard with `python manage.py migrate --database shard_<n>`.
+TRANSACTION_SHARDS = []
+for shard_index in range(config('TRANSACTION_SHARD_COUNT', default=0, cast=int)):
+    alias = f'shard_{shard_index}'
+    DATABASES[alias] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / f'{alias}.sqlite3',
+        'OPTIONS': SQLITE_WRITE_OPTIONS,
+    }
+    TRANSACTION_SHARDS.append(alias)
+
+# Read replicas: DATABASE_REPLICA_COUNT replicas of every database above, named
+# `<alias>_replica_<n>`. Safe transaction reads go to a replica unless the user wrote
+# within REPLICA_STICKY_SECONDS (tracked in the shared cache, see CACHES). Locally the replicas are SQLite copies refreshed with
+# `python manage.py sync_replicas`.
+DATABASE_REPLICAS = {}
+for primary_alias in list(DATABASES):
+    DATABASE_REPLICAS[primary_alias] = []
+    for replica_index in range(config('DATABASE_REPLICA_COUNT', default=0, cast=int)):
+        alias = f'{primary_alias}_replica_{replica_index}'
+        DATABASES[alias] = {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / f'{alias}.sqlite3',
+            'TEST': {'MIRROR': primary_alias},
+        }
+        DATABASE_REPLICAS[primary_alias].append(alias)
+REPLICA_STICKY_SECONDS = config('REPLICA_STICKY_SECONDS', default=5, cast=int)
+
+DATABASE_ROUTERS = [
+    'transactions.routers.CacheRouter',
+    'transactions.routers.ReplicaRouter',
+    'transactions.routers.TransactionShardRouter',
+]
+
+
+# Cache
+# Replica stickiness and the product catalog's generation must be seen by every server
+# process: Redis at REDIS_URL (pip install redis), else a cache table in a database of
+# its own, CACHE_DATABASE, created with `python manage.py createcachetable --database cache`.
+# Either way cache writes stay off the primaries and their replicas.
+# The throttle buckets (transactions.throttling) have their own cache, which must update
+# them atomically: Redis, shared by every worker, or else each process's memory, so the
+# effective rate is the configured one times the worker processes.
+REDIS_URL = config('REDIS_URL', default='')
+CACHE_DATABASE = 'cache'
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        },
+        'throttle': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+            'KEY_PREFIX': 'throttle',
+        },
+    }
+else:
+    DATABASES[CACHE_DATABASE] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'cache.sqlite3',
+        'OPTIONS': SQLITE_WRITE_OPTIONS,
+    }
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'cache',
+            'OPTIONS': {'MAX_ENTRIES': 100000},
+        },
+        'throttle': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'throttle',
+            'OPTIONS': {'MAX_ENTRIES': 100000},
+        },
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
@@ -123,12 +209,48 @@ STATIC_URL = 'static/'
 
 # REST Framework Configuration
 REST_FRAMEWORK = {
+    # The browsable API is for development only
+    'DEFAULT_RENDERER_CLASSES': (
+        'rest_framework.renderers.JSONRenderer',
+        *(('rest_framework.renderers.BrowsableAPIRenderer',) if DEBUG else ()),
+    ),
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework_simplejwt.authentication.JWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
     ),
+    # Cost-weighted token buckets (transactions.throttling), kept in CACHES['throttle']
+    'DEFAULT_THROTTLE_CLASSES': (
+        'transactions.throttling.UserTokenBucketThrottle',
+        'transactions.throttling.EndpointTokenBucketThrottle',
+    ),
+    # '<tokens>/<period>': bucket size and refill per period; 'user' and 'anon' are
+    # per-client totals, '<basename>.<action>' or a URL name adds a per-endpoint bucket
+    'DEFAULT_THROTTLE_RATES': {
+        'user': '1200/min',
+        'anon': '300/min',
+        'transaction.list': '600/min',
+        'transaction.sales': '600/min',
+        'login': '120/min',
+    },
+    # Tokens per request by endpoint (default 1); full history reads cost the most
+    'THROTTLE_COSTS': {
+        'transaction.list': 10,
+        'transaction.sales': 10,
+        'transaction.purchases': 5,
+        'transaction.changes': 2,
+        'transaction.bulk': 10,
+        'transaction.bulk_destroy': 10,
+        'transaction.create': 2,
+        'transaction.update': 2,
+        'transaction.partial_update': 2,
+        'transaction.destroy': 2,
+        'transaction.preview': 2,
+        'cost.query': 10,
+        'login': 5,
+        'register': 5,
+    },
 }
 
 # JWT Configuration
@@ -145,3 +267,39 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # Custom User Model
 AUTH_USER_MODEL = 'users.User'
+
+# Maximum number of products kept in the in-process catalog cache (products.catalog), and
+# how often each process checks the shared cache for product changes made by another
+PRODUCT_CATALOG_SIZE = 1024
+PRODUCT_CATALOG_CHECK_SECONDS = 1
+
+# Cost engines (transactions.costing), chosen per product, else per user, else the default
+COST_ENGINES = {
+    'wac': 'transactions.costing.WACEngine',
+    'fifo': 'transactions.costing.FIFOEngine',
+}
+DEFAULT_COST_METHOD = config('DEFAULT_COST_METHOD', default='wac')
+
+# Optimistic concurrency for (user, product) history writes (transactions.concurrency):
+# attempts after the first, and the base of the jittered exponential backoff in seconds
+HISTORY_WRITE_RETRIES = 6
+HISTORY_WRITE_BACKOFF = 0.01
+
+# Per-request profiling for staff (transactions.profiling): `X-Profile: pstats|collapsed`
+PROFILE_DIR = config('PROFILE_DIR', default=str(BASE_DIR / 'profiles'))
+PROFILE_MAX_FILES = 50
+PROFILE_MAX_BYTES = 50 * 1024 * 1024
+PROFILE_MAX_AGE_SECONDS = 7 * 24 * 3600
+PROFILE_SAMPLE_INTERVAL = 0.001
+
+# Prometheus metrics at /metrics (transactions.metrics): per-process snapshots are
+# written to METRICS_DIR, which every worker of a deployment must share
+METRICS_DIR = config('METRICS_DIR', default=str(BASE_DIR / 'metrics'))
+METRICS_FLUSH_SECONDS = 5
+# Files of processes silent this long (they flush every METRICS_FLUSH_SECONDS while alive)
+# are folded into one retired total when scraped
+METRICS_RETIRE_SECONDS = 60
+METRICS_ALLOWED_IPS = config('METRICS_ALLOWED_IPS', default='127.0.0.1,::1', cast=Csv())
+
+# Columnar ledger snapshots for analytics (manage.py export_ledger, transactions.snapshots)
+LEDGER_SNAPSHOT_DIR = config('LEDGER_SNAPSHOT_DIR', default=str(BASE_DIR / 'ledger'))
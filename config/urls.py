@@ -14,20 +14,27 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
-from django.contrib import admin
+from django.conf import settings
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from users import views as user_views
-from transactions.views import TransactionViewSet
+from transactions.metrics import metrics_view
+from transactions.views import CostViewSet, TransactionViewSet
 
 # Create router for ViewSets
 router = DefaultRouter()
 router.register(r'transactions', TransactionViewSet, basename='transaction')
+router.register(r'costs', CostViewSet, basename='cost')
 
 urlpatterns = [
-    path('admin/', admin.site.urls),
     path('api/', include(router.urls)),
     path('api/auth/register/', user_views.register, name='register'),
     path('api/auth/login/', user_views.login, name='login'),
     path('api/auth/profile/', user_views.profile, name='profile'),
+    path('metrics', metrics_view, name='metrics'),
 ]
+
+# API-only workers (config.settings_api) run without the admin; skip importing it there
+if 'django.contrib.admin' in settings.INSTALLED_APPS:
+    from django.contrib import admin
+    urlpatterns.insert(0, path('admin/', admin.site.urls))
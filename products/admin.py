@@ -3,7 +3,7 @@ from products.models import Product
 
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
-    list_display = ('name', 'price', 'created_at')
+    list_display = ('name', 'price', 'cost_method', 'created_at')
     list_filter = ('created_at',)
     search_fields = ('name', 'description')
     readonly_fields = ('created_at', 'updated_at')
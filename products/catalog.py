@@ -0,0 +1,111 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import cache
+from products.models import Product
+
+GENERATION_KEY = 'products:catalog-generation'
+
+
+def new_generation():
+    """Tell every process's catalog that a product changed (see ProductCatalog.sync)"""
+    cache.set(GENERATION_KEY, uuid.uuid4().hex, timeout=None)
+
+
+class ProductCatalog:
+    """
+    Bounded in-process LRU cache of products, keyed by id with a name index.
+    The Product post_save/post_delete signals invalidate the entry in the saving
+    process and start a new generation in the shared cache; every catalog checks
+    the generation at most once per `check_interval` seconds and drops all its
+    entries when it moved. Cached instances are shared, so treat them as read-only.
+    """
+
+    def __init__(self, max_size=1024, check_interval=1.0):
+        self.max_size = max_size
+        self.check_interval = check_interval
+        self._by_id = OrderedDict()
+        self._ids_by_name = {}
+        self._lock = threading.Lock()
+        self._generation = None
+        self._checked_at = float('-inf')
+        self.hits = 0
+        self.misses = 0
+
+    def sync(self):
+        """Drop every entry if another process changed a product since the last check"""
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        # Start a generation if the cache lost it, rather than clearing on every check
+        generation = cache.get_or_set(GENERATION_KEY, uuid.uuid4().hex, timeout=None)
+        with self._lock:
+            self._checked_at = now
+            if generation != self._generation:
+                self._by_id.clear()
+                self._ids_by_name.clear()
+                self._generation = generation
+
+    def get(self, pk):
+        """Return the product with this id; raises Product.DoesNotExist like Product.objects.get"""
+        self.sync()
+        with self._lock:
+            product = self._by_id.get(pk)
+            if product is not None:
+                self._by_id.move_to_end(pk)
+                self.hits += 1
+                return product
+            self.misses += 1
+
+        product = Product.objects.get(pk=pk)
+        self.add(product)
+        return product
+
+    def get_by_name(self, name):
+        self.sync()
+        with self._lock:
+            pk = self._ids_by_name.get(name)
+        if pk is not None:
+            return self.get(pk)
+
+        with self._lock:
+            self.misses += 1
+        product = Product.objects.get(name=name)
+        self.add(product)
+        return product
+
+    def contains(self, pk):
+        self.sync()
+        with self._lock:
+            return pk in self._by_id
+
+    def add(self, product):
+        with self._lock:
+            self._discard(product.pk)
+            self._by_id[product.pk] = product
+            self._ids_by_name[product.name] = product.pk
+            while len(self._by_id) > self.max_size:
+                _, evicted = self._by_id.popitem(last=False)
+                self._ids_by_name.pop(evicted.name, None)
+
+    def invalidate(self, pk):
+        with self._lock:
+            self._discard(pk)
+
+    def clear(self):
+        with self._lock:
+            self._by_id.clear()
+            self._ids_by_name.clear()
+
+    def _discard(self, pk):
+        product = self._by_id.pop(pk, None)
+        if product is not None and self._ids_by_name.get(product.name) == pk:
+            del self._ids_by_name[product.name]
+
+
+product_catalog = ProductCatalog(
+    max_size=getattr(settings, 'PRODUCT_CATALOG_SIZE', 1024),
+    check_interval=getattr(settings, 'PRODUCT_CATALOG_CHECK_SECONDS', 1.0),
+)
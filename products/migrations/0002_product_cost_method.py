@@ -0,0 +1,18 @@
+# Generated by Django 6.0.2 on 2026-10-19 16:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='cost_method',
+            field=models.CharField(blank=True, default='', max_length=16),
+        ),
+    ]
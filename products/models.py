@@ -1,11 +1,19 @@
+from django.conf import settings
 from django.db import models
 
 
+def cost_method_choices():
+    """The COST_ENGINES keys, so a method without an engine cannot be saved through a form"""
+    return [(method, method.upper()) for method in settings.COST_ENGINES]
+
+
 class Product(models.Model):
     """Product model for inventory management"""
     name = models.CharField(max_length=255, unique=True)
     description = models.TextField(blank=True, null=True)
     price = models.DecimalField(max_digits=10, decimal_places=2)
+    # Cost engine for this product's histories (a COST_ENGINES key); blank means the user's
+    cost_method = models.CharField(max_length=16, blank=True, default='', choices=cost_method_choices)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -0,0 +1,13 @@
+from django.db import transaction as db_transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from products.catalog import new_generation, product_catalog
+from products.models import Product
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_catalog(sender, instance, **kwargs):
+    product_catalog.invalidate(instance.pk)
+    # Other processes drop their catalogs at their next generation check, once the change is visible
+    db_transaction.on_commit(new_generation, using=kwargs.get('using'))
@@ -0,0 +1,81 @@
+"""
+Compare the cost engines on the same dataset.
+
+Usage:
+    python manage.py generate_dataset --transactions 20000
+    python scripts/benchmark_costing.py [username] [repeats]
+
+Every engine prices the user's full history in one pass, and then the first
+quarter and the first half of it, to show how the time grows. A sample of rows
+is also priced one at a time from scratch (`calculate_cost`) to check the
+single-pass costs and to show what a per-row replay costs.
+"""
+import os
+import sys
+import time
+
+# Set up Django BEFORE any Django imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+
+import django
+django.setup()
+
+from django.conf import settings
+from django.db.models import Count
+from transactions.costing import cost_engine
+from transactions.models import Transaction
+from users.models import User
+
+if len(sys.argv) > 1:
+    user = User.objects.get(username=sys.argv[1])
+else:
+    user = User.objects.annotate(n=Count('transactions')).order_by('-n').first()
+repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+SAMPLE = 20
+
+history = Transaction.objects.for_user(user).order_by('transaction_datetime', 'id')
+rows = list(history.values_list('id', 'transaction_type', 'product_id', 'quantity', 'total_price', 'transaction_datetime'))
+entries = [row[1:] for row in rows]
+product_ids = sorted({entry[1] for entry in entries})
+sample = list(history.order_by('?')[:SAMPLE])
+
+
+def best_of(func, *args):
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        output = func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, output
+
+
+print("=" * 80)
+print(f"COSTING BENCHMARK: {user.username} ({len(entries)} transactions, {len(product_ids)} products)")
+print(f"Engines: {', '.join(settings.COST_ENGINES)}, best of {repeats}")
+print("=" * 80)
+
+failed = False
+for method in settings.COST_ENGINES:
+    engine = cost_engine(method)
+    opening = engine.opening(user.id, product_ids, history.db)
+    print(f"{method}:")
+    for fraction in (4, 2, 1):
+        part = entries[:len(entries) // fraction]
+        elapsed, costs = best_of(engine.costs, part, opening)
+        print(f"  one pass, {len(part):8d} rows: {elapsed * 1000:10.2f} ms  ({elapsed / max(len(part), 1) * 1e6:6.2f} µs/row)")
+
+    by_id = dict(zip((row[0] for row in rows), costs))
+    start = time.perf_counter()
+    # Price through the engine directly so the user's and product's own methods do not interfere
+    reference = {transaction.id: engine.transaction_cost(transaction) for transaction in sample}
+    per_row = (time.perf_counter() - start) / max(len(sample), 1)
+    print(f"  per-row replay:          {per_row * 1000:10.2f} ms/row  (~{per_row * len(entries):.1f} s for the history)")
+    matches = all(by_id[pk] == cost for pk, cost in reference.items())
+    failed = failed or not matches
+    print(f"  {'✅' if matches else '❌'} one-pass costs {'match' if matches else 'differ from'} the per-row replay for {len(sample)} sampled rows")
+    print()
+
+if failed:
+    exit(1)
@@ -0,0 +1,82 @@
+"""
+Compare the DRF serializer read path with the fast row encoder.
+
+Usage:
+    python manage.py generate_dataset --transactions 2000
+    python scripts/benchmark_encoding.py [username] [repeats]
+
+Both paths must produce byte-identical JSON for list, purchases and sales.
+"""
+import os
+import sys
+import time
+
+# Set up Django BEFORE any Django imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+
+import django
+django.setup()
+
+from django.db.models import Count
+from rest_framework.renderers import JSONRenderer
+from transactions.encoders import TransactionRowEncoder
+from transactions.models import Transaction
+from transactions.renderers import FastJSONRenderer, orjson
+from transactions.serializers import TransactionListSerializer
+from users.models import User
+
+if len(sys.argv) > 1:
+    user = User.objects.get(username=sys.argv[1])
+else:
+    user = User.objects.annotate(n=Count('transactions')).order_by('-n').first()
+repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+queryset = Transaction.objects.for_user(user).order_by('transaction_datetime')
+serializer_renderer = JSONRenderer()
+fast_renderer = FastJSONRenderer()
+
+
+def serializer_path(key, transaction_type):
+    rows = queryset if transaction_type is None else queryset.filter(transaction_type=transaction_type)
+    data = TransactionListSerializer(rows, many=True).data
+    return serializer_renderer.render({'count': rows.count(), key: data})
+
+
+def fast_path(key, transaction_type):
+    data = TransactionRowEncoder(user.id).encode(queryset, transaction_type=transaction_type)
+    return fast_renderer.render({'count': len(data), key: data})
+
+
+def best_of(func, *args):
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        output = func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, output
+
+
+print("=" * 80)
+print(f"ENCODING BENCHMARK: {user.username} ({queryset.count()} transactions)")
+print(f"JSON backend: {'orjson' if orjson else 'stdlib json'}, best of {repeats}")
+print("=" * 80)
+
+failed = False
+for key, transaction_type in [('transactions', None), ('purchases', 'purchase'), ('sales', 'sale')]:
+    slow_time, slow_output = best_of(serializer_path, key, transaction_type)
+    fast_time, fast_output = best_of(fast_path, key, transaction_type)
+    rows = max(len(fast_output.split(b'"id":')) - 1, 1)
+    identical = slow_output == fast_output
+    failed = failed or not identical
+
+    print(f"{key}: {rows} rows")
+    print(f"  serializer: {slow_time * 1000:10.2f} ms  ({slow_time / rows * 1e6:8.2f} µs/row)")
+    print(f"  fast path:  {fast_time * 1000:10.2f} ms  ({fast_time / rows * 1e6:8.2f} µs/row)")
+    print(f"  speedup:    {slow_time / fast_time:10.1f}x")
+    print(f"  {'✅ byte-identical output' if identical else '❌ output differs'}")
+    print()
+
+if failed:
+    exit(1)
@@ -8,8 +8,16 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 django.setup()
 
+from django.core.management import call_command
 from transactions.models import Transaction
+from transactions.sharding import shard_aliases
 
-print(f"Transactions before delete: {Transaction.objects.count()}")
-Transaction.objects.all().delete()
-print(f"Transactions after delete: {Transaction.objects.count()}")
+
+def count():
+    return sum(Transaction.objects.using(alias).count() for alias in dict.fromkeys(['default', *shard_aliases()]))
+
+
+print(f"Transactions before delete: {count()}")
+# Chunked raw deletes instead of .delete(), which loads every row into memory first
+call_command('purge_transactions', all=True)
+print(f"Transactions after delete: {count()}")
@@ -0,0 +1,248 @@
+"""
+Concurrent mixed-workload load generator for a running server.
+
+Usage:
+    python manage.py generate_dataset --users 20 --transactions 2000 --products 3
+    python manage.py runserver --noreload   (or gunicorn config.wsgi -w 4)
+    python scripts/load_test.py --users 20 --duration 60 [--mix list=30,create_purchase=20,...]
+
+Each simulated user runs in its own thread, logs in as one of the generate_dataset
+users (`<prefix>_<n>`) and picks operations from the weighted mix until the
+duration is up. Reports throughput, error rate, throttled (429) requests and
+p50/p95/p99 latency per endpoint. Throttled requests are not counted as errors.
+"""
+import argparse
+import json
+import math
+import random
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+import requests
+
+DEFAULT_MIX = 'list=30,purchases=5,sales=5,create_purchase=20,create_sale=15,retroactive=10,patch=10,register_login=5'
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"unknown operation {name!r}; choose from {', '.join(OPERATIONS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def iso(moment):
+    return moment.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+class SimulatedUser(threading.Thread):
+    def __init__(self, index, options, deadline):
+        super().__init__(daemon=True)
+        self.index = index
+        self.options = options
+        self.deadline = deadline
+        self.rng = random.Random(None if options.seed is None else options.seed + index)
+        self.session = requests.Session()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.throttled = defaultdict(int)
+        self.transaction_ids = []
+        self.retry_after = None
+
+    def request(self, method, path, label=None, session=None, **kwargs):
+        label = label or f'{method} {path}'
+        self.retry_after = None
+        start = time.perf_counter()
+        try:
+            response = (session or self.session).request(method, self.options.base_url + path, timeout=self.options.timeout, **kwargs)
+        except requests.RequestException:
+            response = None
+        self.latencies[label].append(time.perf_counter() - start)
+        if response is not None and response.status_code == 429:
+            self.throttled[label] += 1
+            self.retry_after = float(response.headers.get('Retry-After', 1))
+            return None
+        if response is None or response.status_code >= 400:
+            self.errors[label] += 1
+            return None
+        return response
+
+    def login(self, username, password, session=None):
+        session = session or self.session
+        response = self.request('POST', '/api/auth/login/', session=session,
+                                json={'username': username, 'password': password})
+        if response is None:
+            return False
+        session.headers['Authorization'] = f"Bearer {response.json()['tokens']['access']}"
+        return True
+
+    def run(self):
+        dataset_user = f'{self.options.prefix}_{self.index % self.options.dataset_users}'
+        while not self.login(dataset_user, self.options.password):
+            # Many users logging in from one address can hit the login throttle
+            if self.retry_after is None or time.monotonic() + self.retry_after >= self.deadline:
+                return
+            time.sleep(self.retry_after)
+        names = list(self.options.mix)
+        weights = [self.options.mix[name] for name in names]
+        while time.monotonic() < self.deadline:
+            OPERATIONS[self.rng.choices(names, weights)[0]](self)
+
+    # Operations
+
+    def list(self):
+        self.request('GET', '/api/transactions/')
+
+    def purchases(self):
+        self.request('GET', '/api/transactions/purchases/')
+
+    def sales(self):
+        self.request('GET', '/api/transactions/sales/')
+
+    def create(self, transaction_type, moment):
+        response = self.request('POST', '/api/transactions/', label=f'POST /api/transactions/ ({transaction_type})', json={
+            'transaction_type': transaction_type,
+            'product_id': self.rng.choice(self.options.product_ids),
+            'quantity': self.rng.randint(1, 100),
+            'unit_price': f'{self.rng.randint(100, 500) / 100:.2f}',
+            'transaction_datetime': iso(moment),
+        })
+        if response is not None:
+            self.transaction_ids.append(response.json()['transaction']['id'])
+
+    def create_purchase(self):
+        self.create('purchase', datetime.now(timezone.utc) - timedelta(seconds=1))
+
+    def create_sale(self):
+        self.create('sale', datetime.now(timezone.utc) - timedelta(seconds=1))
+
+    def retroactive(self):
+        # A purchase dated in the past changes the cost of everything after it
+        self.create('purchase', datetime.now(timezone.utc) - timedelta(days=self.rng.uniform(1, self.options.days)))
+
+    def patch(self):
+        if not self.transaction_ids:
+            return self.create_purchase()
+        transaction_id = self.rng.choice(self.transaction_ids)
+        self.request('PATCH', f'/api/transactions/{transaction_id}/', label='PATCH /api/transactions/{id}/',
+                     json={'quantity': self.rng.randint(1, 100)})
+
+    def register_login(self):
+        username = f'load_{int(time.time() * 1e6)}_{self.index}'
+        password = 'loadpass123'
+        registered = self.request('POST', '/api/auth/register/', json={
+            'username': username,
+            'email': f'{username}@example.com',
+            'password': password,
+            'password_confirm': password,
+        })
+        if registered is not None:
+            # Log in on a separate session so this simulated user keeps its own token
+            with requests.Session() as session:
+                self.login(username, password, session=session)
+
+
+OPERATIONS = {
+    'list': SimulatedUser.list,
+    'purchases': SimulatedUser.purchases,
+    'sales': SimulatedUser.sales,
+    'create_purchase': SimulatedUser.create_purchase,
+    'create_sale': SimulatedUser.create_sale,
+    'retroactive': SimulatedUser.retroactive,
+    'patch': SimulatedUser.patch,
+    'register_login': SimulatedUser.register_login,
+}
+
+
+def percentile(ordered, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    return ordered[max(math.ceil(fraction * len(ordered)) - 1, 0)]
+
+
+def summarize(users, elapsed):
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    throttled = defaultdict(int)
+    for user in users:
+        for label, values in user.latencies.items():
+            latencies[label].extend(values)
+        for label, count in user.errors.items():
+            errors[label] += count
+        for label, count in user.throttled.items():
+            throttled[label] += count
+
+    summary = {}
+    for label in sorted(latencies):
+        ordered = sorted(latencies[label])
+        summary[label] = {
+            'requests': len(ordered),
+            'errors': errors[label],
+            'error_rate': errors[label] / len(ordered),
+            'throttled': throttled[label],
+            'throughput': len(ordered) / elapsed,
+            'p50_ms': percentile(ordered, 0.50) * 1000,
+            'p95_ms': percentile(ordered, 0.95) * 1000,
+            'p99_ms': percentile(ordered, 0.99) * 1000,
+            'max_ms': ordered[-1] * 1000,
+        }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--base-url', default='http://localhost:8000')
+    parser.add_argument('--users', type=int, default=10, help='Concurrent simulated users (threads)')
+    parser.add_argument('--duration', type=float, default=30, help='Seconds to run')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f'Weighted operations (default: {DEFAULT_MIX})')
+    parser.add_argument('--prefix', default='bench', help='generate_dataset username prefix')
+    parser.add_argument('--password', default='benchpass123', help='generate_dataset password')
+    parser.add_argument('--dataset-users', type=int, default=1, help='How many <prefix>_<n> users exist')
+    parser.add_argument('--product-ids', type=lambda value: [int(pk) for pk in value.split(',')], default=[1])
+    parser.add_argument('--days', type=int, default=365, help='How far back retroactive purchases go')
+    parser.add_argument('--timeout', type=float, default=30, help='Per-request timeout in seconds')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--json', help='Also write the results to this file')
+    options = parser.parse_args()
+    options.base_url = options.base_url.rstrip('/')
+
+    print("=" * 100)
+    print(f"LOAD TEST: {options.users} users for {options.duration:.0f}s against {options.base_url}")
+    print(f"Mix: {', '.join(f'{name}={weight:g}' for name, weight in options.mix.items())}")
+    print("=" * 100)
+
+    start = time.monotonic()
+    users = [SimulatedUser(index, options, start + options.duration) for index in range(options.users)]
+    for user in users:
+        user.start()
+    for user in users:
+        user.join()
+    elapsed = time.monotonic() - start
+
+    summary = summarize(users, elapsed)
+    total = sum(row['requests'] for row in summary.values())
+    failed = sum(row['errors'] for row in summary.values())
+    throttled = sum(row['throttled'] for row in summary.values())
+
+    print(f"{'endpoint':44} {'reqs':>7} {'req/s':>8} {'err%':>6} {'429s':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for label, row in summary.items():
+        print(f"{label:44} {row['requests']:7d} {row['throughput']:8.1f} {row['error_rate'] * 100:6.1f} {row['throttled']:6d} "
+              f"{row['p50_ms']:9.1f} {row['p95_ms']:9.1f} {row['p99_ms']:9.1f} {row['max_ms']:9.1f}")
+    print("-" * 100)
+    print(f"Total: {total} requests in {elapsed:.1f}s = {total / elapsed:.1f} req/s, "
+          f"{failed} errors ({failed / max(total, 1) * 100:.1f}%), {throttled} throttled")
+
+    if options.json:
+        with open(options.json, 'w') as output:
+            json.dump({'users': options.users, 'duration': elapsed, 'mix': options.mix, 'endpoints': summary}, output, indent=2)
+
+    if failed:
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+"""
+Stress concurrent writers against the per-(user, product) optimistic versions.
+
+Usage:
+    python scripts/stress_history_writes.py [threads] [operations_per_thread]
+
+Half the threads hammer one shared (user, product) history with retroactive
+purchases, sales, patches and deletes while its period is closed mid-run; the
+other half each write their own history. Afterwards every history must account
+for exactly the writes that succeeded: version, change log, live rows, archive
+and opening balance, and the listed costs must match calculate_cost().
+"""
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+# Set up Django BEFORE any Django imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+
+import django
+django.setup()
+
+from django.db import connections
+from django.db.models import Count, Sum
+from django.utils import timezone
+from rest_framework.test import APIClient
+from products.models import Product
+from transactions.closing import close_period
+from transactions.concurrency import HistoryConflict
+from transactions.models import ArchivedTransaction, HistoryVersion, OpeningBalance, Transaction, TransactionChange
+from users.models import User
+
+threads = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+operations = int(sys.argv[2]) if len(sys.argv) > 2 else 25
+stamp = int(time.time())
+now = timezone.now()
+cutoff = now - timedelta(days=180)
+
+product = Product.objects.order_by('id').first() or Product.objects.create(name='ProductA', price=Decimal('2.00'))
+shared = User.objects.create_user(f'stress_{stamp}_shared', f'stress_{stamp}_shared@example.com', 'stresspass123')
+owners = [shared if index % 2 == 0 else User.objects.create_user(
+    f'stress_{stamp}_{index}', f'stress_{stamp}_{index}@example.com', 'stresspass123'
+) for index in range(threads)]
+
+outcomes = defaultdict(Counter)  # user id -> Counter of 'create'/'update'/'delete'/status codes
+lock = threading.Lock()
+close_result = {}
+
+
+def writer(index):
+    user = owners[index]
+    client = APIClient()
+    client.force_authenticate(user)
+    rng = random.Random(index)
+    mine = []
+    counts = Counter()
+    try:
+        for _ in range(operations):
+            choice = rng.random()
+            if choice < 0.75 or not mine:
+                transaction_type = 'purchase' if choice < 0.5 or not mine else 'sale'
+                response = client.post('/api/transactions/', {
+                    'transaction_type': transaction_type,
+                    'product_id': product.id,
+                    'quantity': rng.randint(1, 50),
+                    'unit_price': f'{rng.randint(100, 500) / 100:.2f}',
+                    'transaction_datetime': (now - timedelta(days=rng.uniform(0, 365))).isoformat(),
+                }, format='json')
+                if response.status_code == 201:
+                    mine.append(response.json()['transaction']['id'])
+                    counts['create'] += 1
+            elif choice < 0.9:
+                response = client.patch(f'/api/transactions/{rng.choice(mine)}/', {'quantity': rng.randint(1, 50)}, format='json')
+                if response.status_code == 200:
+                    counts['update'] += 1
+            else:
+                response = client.delete(f'/api/transactions/{mine.pop(rng.randrange(len(mine)))}/')
+                if response.status_code == 204:
+                    counts['delete'] += 1
+            counts[response.status_code] += 1
+    finally:
+        connections.close_all()
+    with lock:
+        outcomes[user.id].update(counts)
+
+
+def closer():
+    time.sleep(0.5)
+    try:
+        # Like an API client getting 409, try again until the busy history lets it through
+        for _ in range(20):
+            try:
+                close_result['archived'] = close_period(shared, product, cutoff)
+                break
+            except HistoryConflict:
+                close_result['conflicts'] = close_result.get('conflicts', 0) + 1
+    finally:
+        connections.close_all()
+
+
+print("=" * 80)
+print(f"STRESS: {threads} threads x {operations} writes, shared history {shared.username}")
+print("=" * 80)
+
+workers = [threading.Thread(target=writer, args=(index,)) for index in range(threads)]
+workers.append(threading.Thread(target=closer))
+start = time.perf_counter()
+for worker in workers:
+    worker.start()
+for worker in workers:
+    worker.join()
+elapsed = time.perf_counter() - start
+
+failed = False
+
+
+def check(ok, message):
+    global failed
+    failed = failed or not ok
+    print(f"{'✅' if ok else '❌'} {message}")
+
+
+statuses = sum(outcomes.values(), Counter())
+print(f"Finished in {elapsed:.1f}s: " + ', '.join(f'{code}: {count}' for code, count in sorted(
+    (code, count) for code, count in statuses.items() if isinstance(code, int))))
+print(f"Period close archived {close_result.get('archived', 'nothing (failed)')} transactions "
+      f"after {close_result.get('conflicts', 0)} conflicts")
+print()
+
+archived = close_result.get('archived', 0)
+for user_id, counts in outcomes.items():
+    label = 'shared' if user_id == shared.id else f'user {user_id}'
+    closes = 1 if user_id == shared.id and 'archived' in close_result else 0
+    writes = counts['create'] + counts['update'] + counts['delete'] + closes
+    live = Transaction.objects.for_user(user_id).filter(product=product).count()
+    version = HistoryVersion.objects.for_user(user_id).get(product=product).version
+    log = dict(TransactionChange.objects.for_user(user_id).values_list('operation').annotate(n=Count('id')))
+    moved = archived if user_id == shared.id else 0
+
+    check(version == writes, f"{label}: version {version} == {writes} successful writes ({counts[409]} gave up on conflicts)")
+    check(log.get('create', 0) == counts['create'] and log.get('update', 0) == counts['update']
+          and log.get('delete', 0) == counts['delete'] + moved,
+          f"{label}: change log matches the successful creates, updates and deletes")
+    check(live == counts['create'] - counts['delete'] - moved, f"{label}: {live} live transactions")
+
+check(not Transaction.objects.for_user(shared).filter(product=product, transaction_datetime__lt=cutoff).exists(),
+      "shared: no live transaction inside the closed period")
+balance = OpeningBalance.objects.for_user(shared).filter(product=product).first()
+totals = ArchivedTransaction.objects.for_user(shared).filter(product=product, transaction_type='purchase').aggregate(
+    cost=Sum('total_price'), units=Sum('quantity'))
+check(balance is not None and balance.purchase_cost == (totals['cost'] or 0) and balance.purchase_units == (totals['units'] or 0),
+      "shared: opening balance equals the archived purchases")
+
+client = APIClient()
+client.force_authenticate(shared)
+listed = {row['id']: Decimal(str(row['cost'])) for row in client.get('/api/transactions/').json()['transactions']}
+sample = list(Transaction.objects.for_user(shared).filter(product=product).order_by('?')[:50])
+check(all(listed[transaction.id] == transaction.calculate_cost() for transaction in sample),
+      f"shared: listed costs match calculate_cost() for {len(sample)} sampled transactions")
+
+print()
+if failed:
+    print("❌ STRESS TEST FAILED")
+    exit(1)
+print("✅ STRESS TEST PASSED")
@@ -131,7 +131,7 @@ purchase2_data = {
     "transaction_datetime": "2022-01-05T10:00:00Z"
 }
 
-response = client.post('/api/transactions/', data=json.dumps(purchase2_data), content_type='application/json', **headers)
+response = client.post('/api/transactions/?affected_costs=1', data=json.dumps(purchase2_data), content_type='application/json', **headers)
 print(f"Status: {response.status_code}")
 resp_json = response.json()
 print(f"Response: {json.dumps(resp_json, indent=2)}")
@@ -145,6 +145,11 @@ if response.status_code != 201:
 print(f"✅ Purchase 2 created retroactively")
 print(f"   10 units @ RM1.50 = RM15.00")
 print(f"   Cost: RM{t2_cost}")
+affected = {change['id']: change['cost'] for change in resp_json.get('affected_costs', [])}
+if affected.get(t3_id) != 9.84:
+    print(f"❌ Sale missing from affected costs: {affected}")
+    exit(1)
+print(f"✅ Response reports the sale's new cost: RM{affected[t3_id]}")
 print()
 
 # Test 6: Retrieve Sale Again to See Recalculated Cost
@@ -202,12 +207,17 @@ update_data = {
 response = client.patch(f'/api/transactions/{t1_id}/', data=json.dumps(update_data), content_type='application/json', **headers)
 print(f"Status: {response.status_code}")
 updated_qty = response.json().get('transaction', {}).get('quantity')
+updated_total = response.json().get('transaction', {}).get('total_price')
 print(f"Updated Purchase 1 quantity: 150 → {updated_qty}")
+print(f"Updated Purchase 1 total price: RM300.00 → RM{updated_total}")
 print()
 
 if response.status_code != 200:
     print("❌ Update failed")
     exit(1)
+if updated_total != '400.00':
+    print("❌ Total price not recalculated (expected 200 × RM2.00 = RM400.00)")
+    exit(1)
 print("✅ Transaction updated successfully")
 print()
 
@@ -242,6 +252,564 @@ if response.status_code != 200:
 print("✅ User profile retrieved successfully")
 print()
 
+# Test 11: MessagePack Round Trip
+print("TEST 11: MessagePack Round Trip")
+print("-" * 80)
+try:
+    from transactions import msgpack_client
+except ImportError:
+    msgpack_client = None
+
+if msgpack_client is None:
+    print("⚠️  msgpack not installed, skipping")
+else:
+    for url, query in [('/api/transactions/', ''), ('/api/transactions/', '?columnar=1'),
+                       ('/api/transactions/purchases/', ''), ('/api/transactions/sales/', '?columnar=1'),
+                       ('/api/transactions/changes/', ''), ('/api/transactions/changes/', '?columnar=1')]:
+        json_data = client.get(url, **headers).json()
+        response = client.get(url + query, HTTP_ACCEPT='application/msgpack', **headers)
+        print(f"{url}{query}: {response.status_code} {response['Content-Type']}, "
+              f"{len(response.content)} bytes")
+        if response.status_code != 200 or msgpack_client.decode(response.content) != json_data:
+            print("❌ MessagePack payload does not match the JSON representation")
+            exit(1)
+
+    # Writes and previews carry rows next to cost-only entries ({id, cost} or cost_before/after)
+    from django.test import override_settings
+    msgpack_headers = dict(headers, HTTP_ACCEPT='application/msgpack')
+    client.post('/api/transactions/', data=json.dumps(dict(sale_data, transaction_datetime="2022-01-20T10:00:00Z")),
+                content_type='application/json', **headers)
+    new_purchase = dict(purchase1_data, quantity=10, unit_price="3.00", transaction_datetime="2022-01-15T10:00:00Z")
+    preview_body = json.dumps({"operation": "create", "transaction": new_purchase})
+    json_preview = client.post('/api/transactions/preview/', data=preview_body, content_type='application/json', **headers).json()
+    packed_preview = client.post('/api/transactions/preview/', data=preview_body, content_type='application/json', **msgpack_headers)
+    created = msgpack_client.decode(client.post('/api/transactions/?affected_costs=1', data=json.dumps(new_purchase),
+                                                content_type='application/json', **msgpack_headers).content)
+    created_url = f"/api/transactions/{created['transaction']['id']}/"
+    json_created = client.get(created_url, **headers).json()
+    current_costs = {row['id']: row['cost'] for row in client.get('/api/transactions/', **headers).json()['transactions']}
+    with override_settings(TIME_ZONE='Asia/Kuala_Lumpur'):
+        json_local = client.get('/api/transactions/', **headers).json()
+        packed_local = client.get('/api/transactions/', **msgpack_headers).content
+        local_matches = msgpack_client.decode(packed_local) == json_local
+    checks = {
+        'preview': msgpack_client.decode(packed_preview.content) == json_preview and bool(json_preview['affected_costs']),
+        'create': created['transaction'] == json_created,
+        'create affected_costs': bool(created['affected_costs']) and all(
+            entry['cost'] == current_costs[entry['id']] for entry in created['affected_costs']),
+        'retrieve': msgpack_client.decode(client.get(created_url, **msgpack_headers).content) == json_created,
+        'list in TIME_ZONE Asia/Kuala_Lumpur': local_matches,
+    }
+    print(f"Preview, create with affected costs, retrieve, local time zone: {checks}")
+    if not all(checks.values()):
+        print("❌ MessagePack payload does not match the JSON representation")
+        exit(1)
+    print("✅ MessagePack payloads decode to the JSON representation")
+print()
+
+# Test 12: Database Constraints
+print("TEST 12: Database Constraints")
+print("-" * 80)
+from decimal import Decimal
+from django.db import IntegrityError, transaction as db_transaction
+from transactions.models import Transaction
+from users.models import User
+
+# Saves skip model validation; writes that bypass the serializers must still be refused
+stored = Transaction.objects.for_user(User.objects.get(username=username)).get(pk=t1_id)
+for field, value in [('quantity', 0), ('unit_price', Decimal('-1.00')),
+                     ('total_price', Decimal('1.00')), ('transaction_type', 'refund')]:
+    try:
+        with db_transaction.atomic(using=stored._state.db):
+            Transaction.objects.using(stored._state.db).filter(pk=t1_id).update(**{field: value})
+    except IntegrityError:
+        print(f"{field}={value}: rejected")
+    else:
+        print(f"❌ {field}={value} was accepted")
+        exit(1)
+print("✅ Database constraints reject invalid transactions")
+print()
+
+# Test 13: Lean Write Path
+print("TEST 13: Lean Write Path (no model validation queries)")
+print("-" * 80)
+from contextlib import ExitStack
+from django.db import connections
+from django.test.utils import CaptureQueriesContext
+
+
+def capture_statements(request):
+    """Run `request()` and return its response and the statements it sent, by database"""
+    with ExitStack() as stack:
+        captured = {alias: stack.enter_context(CaptureQueriesContext(connections[alias])) for alias in connections}
+        response = request()
+    return response, {alias: [query['sql'] for query in context.captured_queries] for alias, context in captured.items()}
+
+
+purchase_data = dict(purchase1_data, quantity=3, unit_price="2.10", transaction_datetime="2022-02-01T10:00:00Z")
+response, create_statements = capture_statements(lambda: client.post(
+    '/api/transactions/', data=json.dumps(purchase_data), content_type='application/json', **headers))
+print(f"Status: {response.status_code}, total price: RM{response.json().get('transaction', {}).get('total_price')}")
+patch_response, update_statements = capture_statements(lambda: client.patch(
+    f"/api/transactions/{response.json()['transaction']['id']}/", data=json.dumps({"quantity": 4}),
+    content_type='application/json', **headers))
+
+write_db = stored._state.db
+create_queries, update_queries = create_statements.pop(write_db), update_statements.pop(write_db)
+closed_period_checks = [sql for sql in create_queries if sql.startswith('SELECT 1 AS "a" FROM "transactions_openingbalance"')]
+# Everything else is cache traffic: at most the product catalog's generation check, which
+# runs once per PRODUCT_CATALOG_CHECK_SECONDS. Throttle buckets never reach a database.
+other_queries = [sql for statements in (*create_statements.values(), *update_statements.values()) for sql in statements]
+print(f"Create: {len(create_queries)} statements, closed-period checks: {len(closed_period_checks)}; "
+      f"update: {len(update_queries)} statements; on other databases: {len(other_queries)}")
+print()
+
+if response.status_code != 201 or response.json()['transaction']['total_price'] != '6.30':
+    print("❌ Create failed")
+    exit(1)
+if patch_response.status_code != 200:
+    print("❌ Update failed")
+    exit(1)
+if len(closed_period_checks) != 1:
+    print("❌ The closed-period check ran more than once (model validation on save?)")
+    exit(1)
+# Every statement counts, BEGIN and COMMIT included. Before history versions, the change
+# log and cost-change entries, a create sent 7 and a PATCH 8 (autocommit, no transaction).
+# Create: BEGIN, auth user, version read and bump, closed-period check, insert, change-log
+# entry, later-rows lookup (none here, so no 'cost' entries), opening balance and history
+# for the cost, COMMIT. Update adds the transaction load before and inside the versioned
+# write, and the user's cost method for the change log.
+if len(create_queries) != 11 or len(update_queries) != 14 or len(other_queries) > 2:
+    print("❌ The write path runs more statements than expected:")
+    print("\n".join(create_queries + ["--"] + update_queries + ["--"] + other_queries))
+    exit(1)
+print("✅ Transactions are validated once, by the serializer")
+print()
+
+# Test 14: Cost Methods Must Name an Engine
+print("TEST 14: Cost Methods Must Name an Engine")
+print("-" * 80)
+from django.core.exceptions import ValidationError
+from products.models import Product
+
+# An unknown method (e.g. an admin typo) would fail every cost read of the history
+for instance in [Product(name=f"LifoProduct_{username}", price=Decimal("1.00"), cost_method="lifo"),
+                 User(username=f"{username}_lifo", email=f"{username}_lifo@example.com", cost_method="lifo")]:
+    try:
+        instance.full_clean(exclude=['password'])
+    except ValidationError as e:
+        print(f"{type(instance).__name__} cost_method='lifo': {e.message_dict.get('cost_method')}")
+        if 'cost_method' not in e.message_dict:
+            print("❌ Rejected for another reason")
+            exit(1)
+    else:
+        print(f"❌ {type(instance).__name__} accepted cost_method='lifo'")
+        exit(1)
+Product(name=f"FifoProduct_{username}", price=Decimal("1.00"), cost_method="fifo").full_clean()
+print("✅ Only COST_ENGINES methods validate")
+print()
+
+# Test 15: FIFO Period Close
+print("TEST 15: FIFO Costs Start From the Closed Period's Lots")
+print("-" * 80)
+from transactions.closing import close_period
+from django.utils.dateparse import parse_datetime
+
+fifo_product = Product.objects.create(name=f"FifoProduct_{username}", price=Decimal("1.00"), cost_method="fifo")
+fifo_ids = []
+for transaction_type, quantity, unit_price, day in [("purchase", 10, "1.00", 1), ("purchase", 10, "2.00", 2),
+                                                    ("sale", 15, "3.00", 3), ("purchase", 10, "4.00", 5),
+                                                    ("sale", 8, "5.00", 6)]:
+    response = client.post('/api/transactions/', data=json.dumps({
+        "transaction_type": transaction_type, "product_id": fifo_product.id, "quantity": quantity,
+        "unit_price": unit_price, "transaction_datetime": f"2022-03-0{day}T10:00:00Z"
+    }), content_type='application/json', **headers)
+    fifo_ids.append(response.json()['transaction']['id'])
+fifo_cost = lambda: client.get(f'/api/transactions/{fifo_ids[-1]}/', **headers).json()['cost']
+cost_before = fifo_cost()
+owner = User.objects.get(username=username)
+close_period(owner, fifo_product, parse_datetime("2022-03-04T00:00:00Z"))
+with CaptureQueriesContext(connections[stored._state.db]) as captured:
+    cost_after = fifo_cost()
+archive_reads = [query for query in captured.captured_queries if 'transactions_archivedtransaction' in query['sql']]
+print(f"Last sale cost: before close RM{cost_before}, after close RM{cost_after} (5 × RM2.00 + 3 × RM4.00 = RM22.00)")
+print(f"Archive queries while pricing: {len(archive_reads)}")
+print()
+
+if cost_before != 22.0 or cost_after != cost_before:
+    print("❌ FIFO cost changed across the period close")
+    exit(1)
+if archive_reads:
+    print("❌ Pricing replayed the archive instead of the stored lots")
+    exit(1)
+print("✅ FIFO histories start from the lots stored at period close")
+print()
+
+# Test 16: Admin Period Filter and Row Counts
+print("TEST 16: Admin Period Filter and Row Counts")
+print("-" * 80)
+from transactions.models import ArchivedTransaction, OpeningBalance, Transaction
+from transactions.paginators import EstimatedCountPaginator
+from unittest import mock
+
+staff = User.objects.create_superuser(username=f"{username}_staff", email=f"{username}_staff@example.com", password="testpass123")
+admin_client = Client()
+admin_client.force_login(staff)
+changelist = '/admin/transactions/transaction/'
+statuses = {period: admin_client.get(changelist, {'period': period}).status_code
+            for period in ['abcd', '2024-13', '2024-1', '0000', '2022', '2022-03']}
+print(f"Changelist status by ?period=: {statuses}")
+
+# With a limit below the table size the count is an estimate, and says so
+with mock.patch.object(EstimatedCountPaginator, 'count_limit', 1):
+    page = admin_client.get(changelist).content.decode()
+paginator = EstimatedCountPaginator(Transaction.objects.all(), 100)
+paginator.count_limit = 1
+estimate = paginator.count
+print(f"Estimated count: {paginator.count_qualifier} {estimate} (exact {Transaction.objects.count()})")
+print()
+
+if any(statuses[period] != 302 for period in ['abcd', '2024-13', '2024-1', '0000']):
+    print("❌ An invalid period was not rejected with the admin's ?e=1 redirect")
+    exit(1)
+if statuses['2022'] != 200 or statuses['2022-03'] != 200:
+    print("❌ A valid period did not render")
+    exit(1)
+if paginator.count_qualifier != 'about' or f"about {estimate} transactions" not in page:
+    print("❌ The estimated count is unlabelled")
+    exit(1)
+print("✅ Invalid periods are rejected and estimated counts are labelled")
+print()
+
+# Test 17: Moving a User Between Shards
+print("TEST 17: Moving a User Between Shards (including a re-run after a failed move)")
+print("-" * 80)
+import tempfile
+from django.core.management import call_command
+from django.db import OperationalError
+from django.test import override_settings
+from transactions.rebalancing import move_user, user_databases
+from transactions.sharding import shard_for_user
+
+shard_dir = tempfile.TemporaryDirectory()
+source, target = 'test_shard_a', 'test_shard_b'
+for alias in (source, target):
+    connections.settings[alias] = dict(connections.settings['default'], NAME=os.path.join(shard_dir.name, f'{alias}.sqlite3'))
+
+try:
+    with override_settings(TRANSACTION_SHARDS=[source, target]):
+        for alias in (source, target):
+            call_command('migrate', database=alias, verbosity=0)
+        mover = User.objects.create_user(username=f"{username}_mover", email=f"{username}_mover@example.com", password="testpass123", shard=source)
+        mover_token = client.post('/api/auth/login/', data=json.dumps({"username": mover.username, "password": "testpass123"}),
+                                  content_type='application/json').json()['tokens']['access']
+        mover_headers = {"HTTP_AUTHORIZATION": f"Bearer {mover_token}"}
+        for transaction_type, quantity, unit_price, day in [("purchase", 10, "1.00", 1), ("purchase", 10, "2.00", 2),
+                                                            ("sale", 15, "3.00", 3), ("purchase", 5, "4.00", 5),
+                                                            ("sale", 8, "5.00", 6)]:
+            client.post('/api/transactions/', data=json.dumps({
+                "transaction_type": transaction_type, "product_id": fifo_product.id, "quantity": quantity,
+                "unit_price": unit_price, "transaction_datetime": f"2022-03-0{day}T10:00:00Z"
+            }), content_type='application/json', **mover_headers)
+        close_period(mover, fifo_product, parse_datetime("2022-03-04T00:00:00Z"))
+        mover_costs = lambda: sorted((row['transaction_datetime'], row['cost']) for row in client.get('/api/transactions/', **mover_headers).json()['transactions'])
+        costs_before = mover_costs()
+
+        # The target commits, then committing the source's deletes fails
+        with mock.patch.object(connections[source], 'commit', side_effect=OperationalError('disk I/O error')):
+            try:
+                move_user(mover.pk, source, target)
+            except OperationalError:
+                pass
+        interrupted = user_databases(mover.pk)
+        move_user(mover.pk, source, target)
+        mover.shard = target
+        mover.save(update_fields=['shard'])
+        costs_after = mover_costs()
+        placed = user_databases(mover.pk)
+        row_counts = {model.__name__: model.objects.using(target).filter(user_id=mover.pk).count()
+                      for model in (Transaction, OpeningBalance, ArchivedTransaction)}
+
+        # The admin lists one shard at a time and searches users on default
+        admin_rows = {shard: admin_client.get(changelist, {'shard': shard, 'q': mover.username}).content.decode().count('name="_selected_action"')
+                      for shard in (source, target)}
+        unknown_shard_status = admin_client.get(changelist, {'shard': 'nowhere'}).status_code
+
+        # A new user is pinned where the hash places them, and stays there when the shard list changes
+        newcomer = User.objects.create_user(username=f"{username}_newcomer", email=f"{username}_newcomer@example.com", password="testpass123")
+        pinned = User.objects.get(pk=newcomer.pk).shard
+        with override_settings(TRANSACTION_SHARDS=[target, source, 'test_shard_c']):
+            placed_after_resize = shard_for_user(User.objects.get(pk=newcomer.pk))
+finally:
+    for alias in (source, target):
+        connections[alias].close()
+        del connections.settings[alias]
+    shard_dir.cleanup()
+
+print(f"Databases after the failed move: {interrupted}, after the re-run: {placed}")
+print(f"Rows on {target}: {row_counts}")
+print(f"Costs before: {costs_before}")
+print(f"Costs after:  {costs_after}")
+print(f"Admin rows per shard for the mover: {admin_rows}")
+print(f"New user pinned to {pinned!r}, routed to {placed_after_resize!r} after the shard list changed")
+print()
+
+if interrupted != [source, target] or placed != [target]:
+    print("❌ The user's rows were not where expected")
+    exit(1)
+if row_counts != {'Transaction': 2, 'OpeningBalance': 1, 'ArchivedTransaction': 3}:
+    print("❌ The re-run duplicated or dropped rows")
+    exit(1)
+if costs_after != costs_before:
+    print("❌ Costs changed across the move")
+    exit(1)
+if admin_rows != {source: 0, target: 2} or unknown_shard_status != 302:
+    print(f"❌ The admin did not list the shard picked: {admin_rows}, unknown shard status {unknown_shard_status}")
+    exit(1)
+if pinned not in (source, target) or placed_after_resize != pinned:
+    print("❌ The new user was not pinned to a shard")
+    exit(1)
+print("✅ Moves are idempotent, keep costs unchanged, and new users keep their shard")
+print()
+
+# Test 18: Cost Method Changes Reach the Changes Feed
+print("TEST 18: Changing a Cost Method Logs Cost Changes")
+print("-" * 80)
+
+
+def changes_since(cursor):
+    """Every change after `cursor` as {transaction id: cost}, and the cursor to continue from"""
+    changed = {}
+    while True:
+        page = client.get('/api/transactions/changes/', {'since': cursor, 'limit': 1000}, **headers).json()
+        changed.update((row['id'], row['cost']) for row in page['changes'])
+        cursor = page['cursor']
+        if not page['has_more']:
+            return changed, cursor
+
+
+method_product = Product.objects.create(name=f"MethodProduct_{username}", price=Decimal("1.00"))
+for transaction_type, quantity, unit_price, day in [("purchase", 10, "1.00", 1), ("purchase", 10, "3.00", 2),
+                                                    ("sale", 10, "5.00", 3)]:
+    response = client.post('/api/transactions/', data=json.dumps({
+        "transaction_type": transaction_type, "product_id": method_product.id, "quantity": quantity,
+        "unit_price": unit_price, "transaction_datetime": f"2022-04-0{day}T10:00:00Z"
+    }), content_type='application/json', **headers)
+method_sale_id = response.json()['transaction']['id']
+_, cursor = changes_since(0)
+
+# WAC prices the sale at 10 × RM2.00, FIFO at 10 × RM1.00
+method_product.cost_method = 'fifo'
+method_product.save()
+after_product, cursor = changes_since(cursor)
+method_product.cost_method = ''
+method_product.save()
+_, cursor = changes_since(cursor)
+owner.cost_method = 'fifo'
+owner.save()
+after_user, cursor = changes_since(cursor)
+owner.cost_method = ''
+owner.save()
+print(f"Sale cost in the feed after Product.cost_method='fifo': {after_product.get(method_sale_id)}, "
+      f"after User.cost_method='fifo': {after_user.get(method_sale_id)}")
+print()
+
+if after_product.get(method_sale_id) != 10.0 or after_user.get(method_sale_id) != 10.0:
+    print("❌ The changes feed missed a cost method change")
+    exit(1)
+print("✅ Cost method changes are logged for syncing clients")
+print()
+
+# Test 19: Bulk Update and Delete
+print("TEST 19: Bulk Update and Delete")
+print("-" * 80)
+bulk_product = Product.objects.create(name=f"BulkProduct_{username}", price=Decimal("1.00"))
+bulk_ids = []
+for transaction_type, quantity, unit_price, day in [("purchase", 10, "1.00", 1), ("purchase", 10, "3.00", 2),
+                                                    ("sale", 10, "5.00", 3)]:
+    response = client.post('/api/transactions/', data=json.dumps({
+        "transaction_type": transaction_type, "product_id": bulk_product.id, "quantity": quantity,
+        "unit_price": unit_price, "transaction_datetime": f"2022-05-0{day}T10:00:00Z"
+    }), content_type='application/json', **headers)
+    bulk_ids.append(response.json()['transaction']['id'])
+bulk_purchase1, bulk_purchase2, bulk_sale = bulk_ids
+bulk_sale_cost = lambda: client.get(f'/api/transactions/{bulk_sale}/', **headers).json()['cost']
+
+# WAC prices the sale at 10 × RM2.00; then at 10 × (20 + 90) / 40 after the update, and 10 × RM2.00 after the delete
+# One invalid change rejects the whole batch, with the errors keyed by id
+invalid = client.patch('/api/transactions/bulk/', data=json.dumps({"transactions": [
+    {"id": bulk_purchase1, "unit_price": "2.00"}, {"id": bulk_purchase2, "quantity": -5}
+]}), content_type='application/json', **headers)
+cost_after_invalid = bulk_sale_cost()
+missing = client.patch('/api/transactions/bulk/', data=json.dumps({"transactions": [
+    {"id": bulk_purchase1, "unit_price": "2.00"}, {"id": 999999999, "unit_price": "2.00"}
+]}), content_type='application/json', **headers)
+updated = client.patch('/api/transactions/bulk/?affected_costs=1', data=json.dumps({"transactions": [
+    {"id": bulk_purchase1, "unit_price": "2.00"}, {"id": bulk_purchase2, "quantity": 30}
+]}), content_type='application/json', **headers)
+cost_after_update = bulk_sale_cost()
+missing_delete = client.delete('/api/transactions/bulk/', data=json.dumps({"ids": [bulk_purchase2, 999999999]}),
+                               content_type='application/json', **headers)
+deleted = client.delete('/api/transactions/bulk/', data=json.dumps({"ids": [bulk_purchase2]}),
+                        content_type='application/json', **headers)
+cost_after_delete = bulk_sale_cost()
+print(f"Invalid PATCH: {invalid.status_code} {invalid.json()}")
+print(f"Missing id: PATCH {missing.status_code}, DELETE {missing_delete.status_code}")
+print(f"Valid PATCH: {updated.status_code}, affected costs {updated.json().get('affected_costs')}")
+print(f"DELETE: {deleted.status_code}")
+print(f"Sale cost: {cost_after_invalid} after the invalid PATCH, {cost_after_update} after the update, "
+      f"{cost_after_delete} after the delete")
+print()
+
+if invalid.status_code != 400 or list(invalid.json().get('errors', {})) != [str(bulk_purchase2)] or cost_after_invalid != 20.0:
+    print("❌ An invalid bulk change was not rejected as a whole with its errors by id")
+    exit(1)
+if missing.status_code != 404 or missing_delete.status_code != 404:
+    print("❌ A bulk request naming a missing transaction was not a 404")
+    exit(1)
+if updated.status_code != 200 or updated.json().get('affected_costs') != [{'id': bulk_sale, 'cost': 27.5}] or cost_after_update != 27.5:
+    print("❌ The bulk update did not reprice the sale")
+    exit(1)
+if deleted.status_code != 204 or cost_after_delete != 20.0:
+    print("❌ The bulk delete failed")
+    exit(1)
+print("✅ Bulk writes are all-or-nothing and reprice later sales once")
+print()
+
+# Test 20: Costs at Points in Time
+print("TEST 20: Costs at Points in Time")
+print("-" * 80)
+client.post('/api/transactions/', data=json.dumps({
+    "transaction_type": "purchase", "product_id": bulk_product.id, "quantity": 10,
+    "unit_price": "4.00", "transaction_datetime": "2022-05-04T10:00:00Z"
+}), content_type='application/json', **headers)
+# Bulk product history: 10 @ RM2.00 on May 1, a sale on May 3, 10 @ RM4.00 on May 4
+queries = [
+    {"product_id": bulk_product.id, "as_of": "2022-05-05T00:00:00Z"},
+    {"product_id": bulk_product.id, "as_of": "2022-05-01T10:00:00Z"},
+    {"product_id": bulk_product.id, "as_of": "2022-05-04T09:59:59Z"},
+]
+response = client.post('/api/costs/query/', data=json.dumps({"queries": queries}), content_type='application/json', **headers)
+answered = response.json()
+unit_costs = [result['unit_cost'] for result in answered.get('results', [])]
+invalid = client.post('/api/costs/query/', data=json.dumps({"queries": [
+    queries[0], {"product_id": 999999999, "as_of": "2022-05-05T00:00:00Z"}, {"product_id": bulk_product.id, "as_of": "May 5"}
+]}), content_type='application/json', **headers)
+empty = client.post('/api/costs/query/', data=json.dumps({"queries": []}), content_type='application/json', **headers)
+print(f"Status: {response.status_code}, unit costs in input order: {unit_costs}")
+print(f"Invalid queries: {invalid.status_code} {invalid.json()}")
+print(f"Empty batch: {empty.status_code}")
+print()
+
+if response.status_code != 200 or answered['count'] != 3 or unit_costs != [3.0, 2.0, 2.0]:
+    print("❌ Unit costs were wrong or out of order")
+    exit(1)
+if invalid.status_code != 400 or sorted(invalid.json().get('errors', {})) != ['1', '2'] or empty.status_code != 400:
+    print("❌ Invalid queries were not reported by index")
+    exit(1)
+print("✅ Cost queries are answered in input order and invalid ones reported by index")
+print()
+
+# Test 21: What-If Preview
+print("TEST 21: What-If Preview of Retroactive Writes")
+print("-" * 80)
+_, cursor_before = changes_since(0)
+rows_before = client.get('/api/transactions/', **headers).json()['count']
+
+
+def preview(payload):
+    response = client.post('/api/transactions/preview/', data=json.dumps(payload), content_type='application/json', **headers)
+    return response.status_code, response.json()
+
+
+def sale_change(previewed):
+    """The previewed sale's (cost before, cost after), None if it does not move"""
+    return next(((change['cost_before'], change['cost_after']) for change in previewed['affected_costs'] if change['id'] == bulk_sale), None)
+
+
+# A purchase of 10 @ RM4.00 before the sale moves it from 10 × RM2.00 to 10 × RM3.00
+create_status, created = preview({"operation": "create", "transaction": {
+    "transaction_type": "purchase", "product_id": bulk_product.id, "quantity": 10,
+    "unit_price": "4.00", "transaction_datetime": "2022-05-02T10:00:00Z"
+}})
+update_status, updated = preview({"operation": "update", "id": bulk_purchase1, "transaction": {"unit_price": "4.00"}})
+delete_status, deleted = preview({"operation": "delete", "id": bulk_sale})
+invalid_status, _ = preview({"operation": "create", "transaction": {"transaction_type": "purchase", "product_id": bulk_product.id}})
+unknown_status, _ = preview({"operation": "replace"})
+missing_status, _ = preview({"operation": "delete", "id": 999999999})
+_, cursor_after = changes_since(cursor_before)
+rows_after = client.get('/api/transactions/', **headers).json()['count']
+print(f"Create: {create_status}, sale {sale_change(created)}")
+print(f"Update: {update_status}, purchase {updated['transaction']}, sale {sale_change(updated)}")
+print(f"Delete: {delete_status}, sale {deleted['transaction']}")
+print(f"Invalid write: {invalid_status}, unknown operation: {unknown_status}, missing id: {missing_status}")
+print(f"Rows {rows_before} -> {rows_after}, changes cursor {cursor_before} -> {cursor_after}")
+print()
+
+if create_status != 200 or created['transaction']['id'] is not None or sale_change(created) != (20.0, 30.0):
+    print("❌ The create preview did not reprice the sale")
+    exit(1)
+if update_status != 200 or updated['transaction']['id'] != bulk_purchase1 or sale_change(updated) != (20.0, 40.0):
+    print("❌ The update preview did not reprice the sale")
+    exit(1)
+if delete_status != 200 or deleted['transaction'] != {'id': bulk_sale, 'cost_before': 20.0, 'cost_after': None}:
+    print("❌ The delete preview was wrong")
+    exit(1)
+if (invalid_status, unknown_status, missing_status) != (400, 400, 404):
+    print("❌ An invalid preview was not rejected")
+    exit(1)
+if rows_after != rows_before or cursor_after != cursor_before:
+    print("❌ A preview wrote to the history")
+    exit(1)
+print("✅ Previews price the write without saving or logging it")
+print()
+
+# Test 22: Incremental Sync Feed
+print("TEST 22: Changes Feed Paging and Tombstones")
+print("-" * 80)
+_, sync_cursor = changes_since(0)
+feed_product = Product.objects.create(name=f"FeedProduct_{username}", price=Decimal("1.00"))
+feed_ids = []
+for day in (1, 2, 3):
+    response = client.post('/api/transactions/', data=json.dumps({
+        "transaction_type": "purchase", "product_id": feed_product.id, "quantity": 10,
+        "unit_price": f"{day}.00", "transaction_datetime": f"2022-06-0{day}T10:00:00Z"
+    }), content_type='application/json', **headers)
+    feed_ids.append(response.json()['transaction']['id'])
+client.patch(f'/api/transactions/{feed_ids[0]}/', data=json.dumps({"quantity": 20}), content_type='application/json', **headers)
+client.delete(f'/api/transactions/{feed_ids[1]}/', **headers)
+
+# Page through with two log entries per page
+pages = []
+cursor = sync_cursor
+while True:
+    page = client.get('/api/transactions/changes/', {'since': cursor, 'limit': 2}, **headers).json()
+    pages.append(page)
+    cursor = page['cursor']
+    if not page['has_more']:
+        break
+synced = {row['id']: row['quantity'] for page in pages for row in page['changes']}
+tombstones = {pk for page in pages for pk in page['deleted']}
+caught_up = client.get('/api/transactions/changes/', {'since': cursor}, **headers).json()
+bad_cursor = client.get('/api/transactions/changes/', {'since': 'yesterday'}, **headers).status_code
+print(f"Pages: {[(page['count'], len(page['deleted']), page['has_more']) for page in pages]}")
+print(f"Synced quantities: {synced}, tombstones: {sorted(tombstones)}")
+print(f"Caught up: {caught_up['changes']} {caught_up['deleted']} at {caught_up['cursor']}, bad cursor status {bad_cursor}")
+print()
+
+if len(pages) < 3 or any(len(page['changes']) + len(page['deleted']) > 2 for page in pages) \
+        or any(not page['has_more'] for page in pages[:-1]):
+    print("❌ The feed did not page by its limit")
+    exit(1)
+if synced != {feed_ids[0]: 20, feed_ids[2]: 10} or tombstones != {feed_ids[1]}:
+    print("❌ The feed did not end in the current rows and a tombstone for the deleted one")
+    exit(1)
+if caught_up['changes'] or caught_up['deleted'] or caught_up['cursor'] != cursor or bad_cursor != 400:
+    print("❌ The feed did not stop at its cursor")
+    exit(1)
+print("✅ The changes feed pages by cursor and reports deletes as tombstones")
+print()
+
 print("=" * 80)
 print("✅ ALL TESTS PASSED")
 print("=" * 80)
@@ -1,10 +1,180 @@
+import re
+from datetime import datetime
 from django.contrib import admin
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ChangeList
+from django.db.models import Max, Min, Q
+from django.http import QueryDict
+from django.utils import timezone
+from products.catalog import product_catalog
+from products.models import Product
+from transactions.costing import batch_costs
 from transactions.models import Transaction
+from transactions.paginators import EstimatedCountPaginator
+from transactions.sharding import shard_aliases
+from users.models import User
+
+SHARD_PARAMETER = 'shard'
+
+
+def request_shard(request):
+    """
+    The shard an admin request reads, None without sharding: ?shard= on the
+    changelist, carried to the change form in _changelist_filters, else the first
+    """
+    aliases = shard_aliases()
+    if not aliases:
+        return None
+    value = request.GET.get(SHARD_PARAMETER)
+    if value is None:
+        value = QueryDict(request.GET.get('_changelist_filters', '')).get(SHARD_PARAMETER)
+    return value if value in aliases else aliases[0]
+
+
+class TransactionShardFilter(admin.SimpleListFilter):
+    """
+    Picks the shard the changelist shows. Shards are separate databases, so there
+    is no 'All': one shard is listed at a time, the first unless another is picked.
+    """
+    title = 'shard'
+    parameter_name = SHARD_PARAMETER
+
+    def lookups(self, request, model_admin):
+        return [(alias, alias) for alias in shard_aliases()]
+
+    def choices(self, changelist):
+        selected = self.value() or self.lookup_choices[0][0]
+        for lookup, title in self.lookup_choices:
+            yield {
+                'selected': lookup == selected,
+                'query_string': changelist.get_query_string({self.parameter_name: lookup}),
+                'display': title,
+            }
+
+    def queryset(self, request, queryset):
+        # TransactionAdmin.get_queryset already reads from the shard
+        if self.value() is not None and self.value() not in shard_aliases():
+            raise IncorrectLookupParameters(f'Unknown shard {self.value()!r}')
+        return queryset
+
+
+class TransactionPeriodFilter(admin.SimpleListFilter):
+    """
+    Year/month drill-down on transaction_datetime. Choices come from MIN/MAX and
+    each choice is a datetime range, so both stay on the transaction_datetime index.
+    """
+    title = 'transaction period'
+    parameter_name = 'period'
+    period_pattern = re.compile(r'([0-9]{4})(?:-([0-9]{2}))?')
+
+    def parse_period(self, value):
+        """`'YYYY'` or `'YYYY-MM'` as (year, month or None); None if it is neither"""
+        match = self.period_pattern.fullmatch(value or '')
+        if not match:
+            return None
+        year, month = int(match[1]), match[2] and int(match[2])
+        if not 1 <= year < 9999 or month is not None and not 1 <= month <= 12:
+            return None
+        return year, month
+
+    def lookups(self, request, model_admin):
+        bounds = model_admin.get_queryset(request).aggregate(first=Min('transaction_datetime'), last=Max('transaction_datetime'))
+        if bounds['first'] is None:
+            return []
+        first, last = timezone.localtime(bounds['first']), timezone.localtime(bounds['last'])
+        choices = [(str(year), str(year)) for year in range(last.year, first.year - 1, -1)]
+
+        # Once a year is picked, offer its months as well
+        selected = self.parse_period(self.value())
+        if selected:
+            year = selected[0]
+            choices += [(f'{year}-{month:02d}', f'{year}-{month:02d}') for month in range(1, 13)]
+        return choices
+
+    def queryset(self, request, queryset):
+        value = self.value()
+        if not value:
+            return queryset
+        period = self.parse_period(value)
+        if period is None:
+            raise IncorrectLookupParameters(f'Invalid period {value!r}, expected YYYY or YYYY-MM')
+        year, month = period
+        if month:
+            start = datetime(year, month, 1)
+            end = datetime(year + month // 12, month % 12 + 1, 1)
+        else:
+            start, end = datetime(year, 1, 1), datetime(year + 1, 1, 1)
+        return queryset.filter(
+            transaction_datetime__gte=timezone.make_aware(start),
+            transaction_datetime__lt=timezone.make_aware(end)
+        )
+
+
+class TransactionChangeList(ChangeList):
+    def get_results(self, request):
+        super().get_results(request)
+        # Price the whole page in one batch instead of a calculate_cost scan per row
+        page = list(self.result_list)
+        costs = batch_costs(Transaction.objects.using(self.queryset.db), page)
+        for transaction in page:
+            transaction.admin_cost = costs[transaction.pk]
+
 
 @admin.register(Transaction)
 class TransactionAdmin(admin.ModelAdmin):
-    list_display = ('id', 'user', 'transaction_type', 'product', 'quantity', 'unit_price', 'total_price', 'transaction_datetime')
-    list_filter = ('transaction_type', 'transaction_datetime', 'created_at')
+    list_display = ('id', 'user', 'transaction_type', 'product_name', 'quantity', 'unit_price', 'total_price', 'transaction_datetime', 'cost')
+    list_filter = ('transaction_type', TransactionPeriodFilter)
+    list_select_related = ('user',)
     search_fields = ('user__username', 'product__name')
     readonly_fields = ('total_price', 'created_at')
     ordering = ('-transaction_datetime',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_changelist(self, request, **kwargs):
+        return TransactionChangeList
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        shard = request_shard(request)
+        if shard is None:
+            return queryset
+        # Users and products live on default, so nothing may join them in the shard's query
+        return queryset.using(shard).prefetch_related('user')
+
+    def get_list_filter(self, request):
+        if request_shard(request) is None:
+            return self.list_filter
+        return (TransactionShardFilter, *self.list_filter)
+
+    def get_list_select_related(self, request):
+        if request_shard(request) is None:
+            return self.list_select_related
+        return ()
+
+    def get_sortable_by(self, request):
+        if request_shard(request) is None:
+            return super().get_sortable_by(request)
+        return [field for field in self.get_list_display(request) if field not in ('user', 'product_name')]
+
+    def get_search_results(self, request, queryset, search_term):
+        if request_shard(request) is None:
+            return super().get_search_results(request, queryset, search_term)
+        # Match usernames and product names on default, then filter the shard by id;
+        # like the admin's own search, every word must match one of them
+        for word in search_term.split():
+            queryset = queryset.filter(
+                Q(user_id__in=list(User.objects.filter(username__icontains=word).values_list('id', flat=True)))
+                | Q(product_id__in=list(Product.objects.filter(name__icontains=word).values_list('id', flat=True)))
+            )
+        return queryset, False
+
+    @admin.display(description='Product', ordering='product__name')
+    def product_name(self, obj):
+        return product_catalog.get(obj.product_id).name
+
+    @admin.display(description='Cost')
+    def cost(self, obj):
+        if hasattr(obj, 'admin_cost'):
+            return obj.admin_cost
+        return obj.calculate_cost()
@@ -0,0 +1,43 @@
+from django.conf import settings
+from django.core.checks import Error, Tags, Warning, register
+from rest_framework.settings import api_settings
+from transactions.throttling import BUCKET_CACHE, TokenBucketThrottle, bucket_cache
+
+# Backends whose entries only the process that wrote them can see
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register(Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    """
+    Replica stickiness lives in the default cache. In a process-local one every
+    worker has its own, and users read stale replicas right after writing.
+    """
+    backend = settings.CACHES.get('default', {}).get('BACKEND', '')
+    if backend not in PROCESS_LOCAL_CACHES or not any(getattr(settings, 'DATABASE_REPLICAS', {}).values()):
+        return []
+    return [Error(
+        f'Read replicas need a cache shared by all server processes; the default cache is {backend}',
+        hint='Set REDIS_URL, or use the database cache (python manage.py createcachetable --database cache).',
+        obj='CACHES',
+        id='transactions.E001',
+    )]
+
+
+@register(Tags.caches)
+def check_throttle_cache(app_configs, **kwargs):
+    """Token buckets need a cache that updates them atomically, or nothing is throttled"""
+    if not any(issubclass(throttle, TokenBucketThrottle) for throttle in api_settings.DEFAULT_THROTTLE_CLASSES):
+        return []
+    if bucket_cache() is not None:
+        return []
+    backend = settings.CACHES.get(BUCKET_CACHE, {}).get('BACKEND', 'not configured')
+    return [Warning(
+        f"Requests are not throttled: the token buckets need CACHES['{BUCKET_CACHE}'] to be "
+        f'RedisCache or LocMemCache; it is {backend}',
+        obj='CACHES',
+        id='transactions.W001',
+    )]
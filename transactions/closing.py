@@ -0,0 +1,85 @@
+from decimal import Decimal
+from transactions.concurrency import versioned_write
+from transactions.costing import FifoLots
+from transactions.models import ArchivedTransaction, OpeningBalance, Transaction, TransactionChange
+from transactions.replicas import mark_write
+from transactions.sharding import shard_for_user
+
+
+class PeriodCloseError(Exception):
+    pass
+
+
+ARCHIVE_FIELDS = (
+    'original_id', 'user_id', 'transaction_type', 'product_id', 'quantity', 'unit_price',
+    'total_price', 'transaction_datetime', 'created_at',
+)
+
+
+def close_period(user, product, closing_datetime, batch_size=2000):
+    """
+    Close the (user, product) history before `closing_datetime`: fold its purchases
+    into the opening balance, with the FIFO lots they leave open, and move the rows
+    to ArchivedTransaction.
+    Costs of the remaining transactions are unchanged. Returns the number archived.
+    """
+    using = shard_for_user(user)
+    archived = versioned_write(
+        user, [product.pk],
+        lambda attempt: archive_closed(user, product, closing_datetime, batch_size, using),
+        using=using
+    )
+    mark_write(user.pk)
+    return archived
+
+
+def archive_closed(user, product, closing_datetime, batch_size, using):
+    """One attempt of close_period, inside its versioned database transaction"""
+    balance = OpeningBalance.objects.for_user(user).select_for_update().filter(product=product).first()
+    if balance is not None and closing_datetime <= balance.closing_datetime:
+        raise PeriodCloseError(f'Already closed through {balance.closing_datetime.isoformat()}')
+    if balance is None:
+        balance = OpeningBalance(user=user, product=product)
+
+    closed = Transaction.objects.for_user(user).filter(
+        product=product,
+        transaction_datetime__lt=closing_datetime
+    ).order_by('id')
+
+    # Whatever the history's engine is now, either can start from the balance later
+    entries = closed.order_by('transaction_datetime', 'id').values_list(
+        'transaction_type', 'product_id', 'quantity', 'total_price', 'transaction_datetime'
+    )
+    balance.fifo_lots = FifoLots.from_json(balance.fifo_lots).replay(entries.iterator(chunk_size=batch_size)).as_json()
+
+    archived = 0
+    purchase_cost = Decimal('0.00')
+    purchase_units = 0
+    last_id = 0
+    while True:
+        rows = list(closed.filter(id__gt=last_id).values_list('id', *ARCHIVE_FIELDS[1:])[:batch_size])
+        if not rows:
+            break
+        ArchivedTransaction.objects.using(using).bulk_create([
+            ArchivedTransaction(**dict(zip(ARCHIVE_FIELDS, row))) for row in rows
+        ])
+        for row in rows:
+            if row[2] == 'purchase':
+                purchase_cost += row[6]
+                purchase_units += row[4]
+
+        ids = [row[0] for row in rows]
+        # Raw delete: nothing references transactions and no cost changes, so skip
+        # the per-row collector and signals; sync clients still get tombstones
+        Transaction.objects.using(using).filter(id__in=ids).raw_delete()
+        TransactionChange.objects.using(using).bulk_create([
+            TransactionChange(user=user, transaction_id=pk, operation='delete') for pk in ids
+        ])
+        archived += len(rows)
+        last_id = ids[-1]
+
+    balance.closing_datetime = closing_datetime
+    balance.purchase_cost += purchase_cost
+    balance.purchase_units += purchase_units
+    balance.save(using=using)
+    return archived
@@ -0,0 +1,74 @@
+"""
+Optimistic concurrency for writes to (user, product) histories.
+
+A retroactive write changes the cost of everything after it, and a period close
+folds the history into an opening balance, so two writers to the same history
+must not interleave. Instead of one global write lock, each history has a
+HistoryVersion row: a writer reads the versions of the histories it touches,
+does its work, and advances them with `UPDATE ... WHERE version = <read>`. If
+another writer got there first the whole attempt rolls back and runs again.
+Writers to different histories never update the same row.
+
+SQLite still serialises all writers to one database file. Its connections begin
+transactions IMMEDIATE (see DATABASES), so writers queue on the busy timeout instead
+of failing a lock upgrade, and one that still finds the database locked is retried
+the same way. Shards are separate files.
+"""
+import random
+import time
+from django.conf import settings
+from django.db import OperationalError, transaction as db_transaction
+from django.db.models import F
+from transactions.models import HistoryVersion
+from transactions.sharding import shard_for_user
+
+
+class HistoryConflict(Exception):
+    """A write kept losing the race for its history and gave up"""
+
+
+class VersionMoved(Exception):
+    pass
+
+
+def versioned_write(user, product_ids, operation, using=None):
+    """
+    Run `operation(attempt)` in a database transaction that advances the version of
+    each of the user's `product_ids` histories, retrying from scratch on conflict up
+    to HISTORY_WRITE_RETRIES times. The versions are read first, so `operation` must
+    load and validate everything it depends on itself, on every attempt: anything
+    read before the call may predate a write the versions would not catch.
+    `user` is a User, or a user id when `using` is given.
+    Returns what `operation` returns; raises HistoryConflict.
+    """
+    using = using or shard_for_user(user)
+    user_id = getattr(user, 'pk', user)
+    # Lock in a fixed order so writers touching several histories cannot deadlock
+    product_ids = sorted(set(product_ids))
+    versions = HistoryVersion.objects.using(using).filter(user_id=user_id, product_id__in=product_ids)
+
+    for attempt in range(settings.HISTORY_WRITE_RETRIES + 1):
+        if attempt:
+            time.sleep(random.uniform(0, settings.HISTORY_WRITE_BACKOFF * 2 ** attempt))
+        try:
+            with db_transaction.atomic(using=using):
+                read = dict(versions.values_list('product_id', 'version'))
+                if len(read) < len(product_ids):
+                    # First write to a history: create its version in the same transaction
+                    HistoryVersion.objects.using(using).bulk_create([
+                        HistoryVersion(user_id=user_id, product_id=product_id)
+                        for product_id in product_ids if product_id not in read
+                    ], ignore_conflicts=True)
+                    read = dict(versions.values_list('product_id', 'version'))
+                result = operation(attempt)
+                for product_id in product_ids:
+                    if not versions.filter(product_id=product_id, version=read[product_id]).update(version=F('version') + 1):
+                        raise VersionMoved
+                return result
+        except VersionMoved:
+            continue
+        except OperationalError as e:
+            # SQLite gave up waiting for another connection's write lock
+            if 'locked' not in str(e):
+                raise
+    raise HistoryConflict(f'Gave up after {settings.HISTORY_WRITE_RETRIES + 1} attempts on a busy history')
@@ -0,0 +1,561 @@
+"""
+Cost engines. Each (user, product) history is priced by one engine: the product's
+`cost_method` if set, else the user's, else DEFAULT_COST_METHOD. COST_ENGINES maps
+method names to engine classes.
+
+- `wac`: periodic weighted average cost of all purchases up to the transaction.
+- `fifo`: sales consume the oldest open purchase lots first.
+
+An engine prices a datetime-ordered history in one pass (`costs`), starting from
+the state its closed periods left (`opening`), prices the suffix a write
+affects (`suffix_costs`) and answers point-in-time unit cost queries (`unit_costs`).
+"""
+from collections import deque
+from decimal import Decimal
+from functools import lru_cache
+from itertools import chain
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import Sum
+from django.utils.module_loading import import_string
+from products.catalog import product_catalog
+from transactions.metrics import record_cost_run
+from transactions.models import OpeningBalance, Transaction
+from users.models import User
+
+
+ZERO_COST = Decimal('0.00')
+
+
+def wac_cost(transaction_type, quantity, total_purchase_cost, total_units):
+    """
+    Cost of a single transaction given the purchase totals up to its datetime.
+    Mirrors WACEngine.transaction_cost so both paths round identically.
+    """
+    if total_units == 0:
+        return ZERO_COST
+
+    average_cost_per_unit = total_purchase_cost / Decimal(total_units)
+
+    if transaction_type == 'purchase':
+        return round(average_cost_per_unit, 2)
+    return round(average_cost_per_unit * quantity, 2)
+
+
+def running_wac_costs(entries, opening=None):
+    """
+    Calculate the WAC cost of every entry in a single ordered pass.
+
+    `entries` is a sequence of (transaction_type, product_id, quantity, total_price,
+    transaction_datetime) tuples sorted by transaction_datetime. Purchases that share
+    a datetime with an entry are included in its cost, as in calculate_cost.
+    `opening` optionally maps product_id to the (total_purchase_cost, total_units)
+    of purchases before the first entry. Returns the costs in the same order as `entries`.
+    """
+    totals = {product_id: list(product_totals) for product_id, product_totals in (opening or {}).items()}
+    costs = [ZERO_COST] * len(entries)
+    count = len(entries)
+    start = 0
+    while start < count:
+        # Fold every purchase at this datetime into the totals before pricing the group
+        current_datetime = entries[start][4]
+        end = start
+        while end < count and entries[end][4] == current_datetime:
+            transaction_type, product_id, quantity, total_price, _ = entries[end]
+            if transaction_type == 'purchase':
+                product_totals = totals.setdefault(product_id, [ZERO_COST, 0])
+                product_totals[0] += total_price
+                product_totals[1] += quantity
+            end += 1
+
+        for index in range(start, end):
+            transaction_type, product_id, quantity, _, _ = entries[index]
+            total_purchase_cost, total_units = totals.get(product_id, (ZERO_COST, 0))
+            costs[index] = wac_cost(transaction_type, quantity, total_purchase_cost, total_units)
+        start = end
+
+    return costs
+
+
+def suffix_costs(history, user_id, product_id, since, until=None, cost_method=''):
+    """
+    Costs of the transactions in one (user, product) `history` at or after `since`
+    (and up to `until`, if given), as {id: cost} in datetime order, priced by the
+    history's engine. `cost_method` is the user's.
+    """
+    return engine_for(product_id, cost_method).suffix_costs(history, user_id, product_id, since, until)
+
+
+def batch_costs(history, transactions):
+    """
+    Costs of arbitrary saved `transactions` as {id: cost}, with one window query and
+    one aggregate per (user, product) instead of a calculate_cost scan per row.
+    `history` is the queryset the transactions come from, e.g. Transaction.objects.all().
+    """
+    windows = {}
+    for transaction in transactions:
+        key = (transaction.user_id, transaction.product_id)
+        start, end = windows.get(key, (transaction.transaction_datetime, transaction.transaction_datetime))
+        windows[key] = (min(start, transaction.transaction_datetime), max(end, transaction.transaction_datetime))
+
+    methods = user_cost_methods({user_id for user_id, _ in windows})
+    costs = {}
+    for (user_id, product_id), (since, until) in windows.items():
+        group = history.filter(user_id=user_id, product_id=product_id)
+        costs.update(suffix_costs(group, user_id, product_id, since, until, methods.get(user_id, '')))
+    return {transaction.pk: costs[transaction.pk] for transaction in transactions}
+
+
+def preview_costs(history, user_id, removed=None, added=None, cost_method=''):
+    """
+    Costs before and after a proposed write, computed in memory without saving it.
+    `removed` is the saved transaction the write deletes or changes and `added` the
+    unsaved state it would store (an update keeps the id, a create has none). Each
+    touched (user, product) history is loaded once, from the earliest state that
+    moves later costs (or just around the touched states when none does), and
+    priced with and without the write. Returns ({id: cost before}, {id: cost after});
+    a created transaction is under None.
+    """
+    windows = {}
+    for state in (removed, added):
+        if state is None:
+            continue
+        moves = engine_for(state.product_id, cost_method).moves_later_costs(state.transaction_type)
+        since, until, moved = windows.get(
+            state.product_id, (state.transaction_datetime, state.transaction_datetime, False)
+        )
+        windows[state.product_id] = (
+            min(since, state.transaction_datetime), max(until, state.transaction_datetime), moved or moves
+        )
+
+    before, after = {}, {}
+    for product_id, (since, until, moves) in windows.items():
+        engine = engine_for(product_id, cost_method)
+        opening, rows = engine.suffix_window(
+            history.filter(product_id=product_id), user_id, product_id, since, None if moves else until
+        )
+        proposed = [row for row in rows if removed is None or row[0] != removed.pk]
+        if added is not None and added.product_id == product_id:
+            proposed.append((
+                added.pk, added.transaction_type, product_id, added.quantity,
+                added.quantity * added.unit_price, added.transaction_datetime
+            ))
+            # A new transaction gets the highest id, so it sorts last among its datetime
+            proposed.sort(key=lambda row: (row[5], row[0] is None, row[0] or 0))
+        before.update(zip([row[0] for row in rows], engine.costs([row[1:] for row in rows], opening)))
+        after.update(zip([row[0] for row in proposed], engine.costs([row[1:] for row in proposed], opening)))
+    return before, after
+
+
+def query_unit_costs(history, user_id, queries, cost_method=''):
+    """
+    Answer (product_id, as_of) `queries` on one user's `history` with the cost of
+    one unit sold at `as_of`, in input order. Each product's history up to its
+    latest query is loaded once and merged with its sorted queries, so a batch
+    costs O(history + queries log queries) rather than a scan per query.
+    """
+    moments_by_product = {}
+    for index, (product_id, as_of) in enumerate(queries):
+        moments_by_product.setdefault(product_id, []).append((as_of, index))
+
+    costs = [ZERO_COST] * len(queries)
+    for product_id, moments in moments_by_product.items():
+        moments.sort()
+        engine = engine_for(product_id, cost_method)
+        entries = list(history.filter(
+            product_id=product_id, transaction_datetime__lte=moments[-1][0]
+        ).order_by('transaction_datetime', 'id').values_list(
+            'transaction_type', 'product_id', 'quantity', 'total_price', 'transaction_datetime'
+        ))
+        opening = engine.opening(user_id, [product_id], history.db)
+        answers = engine.unit_costs(product_id, entries, [as_of for as_of, _ in moments], opening)
+        for (_, index), cost in zip(moments, answers):
+            costs[index] = cost
+    return costs
+
+
+class CostDelta:
+    """
+    Collects the transactions whose cost changes because of a write.
+    Track the states the write touches, call `begin()` before saving and `changes()`
+    afterwards; only the suffix after the earliest state that moves other costs is recomputed.
+    """
+
+    def __init__(self, history, user_id, cost_method=''):
+        self.history = history
+        self.user_id = user_id
+        self.cost_method = cost_method
+        self.starts = {}
+        self.before = {}
+
+    def track(self, transaction_type, product_id, transaction_datetime):
+        if not engine_for(product_id, self.cost_method).moves_later_costs(transaction_type):
+            return
+        start = self.starts.get(product_id)
+        if start is None or transaction_datetime < start:
+            self.starts[product_id] = transaction_datetime
+
+    def snapshot(self):
+        costs = {}
+        for product_id, since in self.starts.items():
+            costs.update(suffix_costs(
+                self.history.filter(product_id=product_id), self.user_id, product_id, since, cost_method=self.cost_method
+            ))
+        return costs
+
+    def begin(self):
+        self.before = self.snapshot()
+
+    def changes(self, exclude=()):
+        """Transactions (other than `exclude`) whose cost differs from before the write"""
+        return [
+            {'id': pk, 'cost': cost}
+            for pk, cost in self.snapshot().items()
+            if pk not in exclude and self.before.get(pk) != cost
+        ]
+
+
+def user_cost_methods(user_ids):
+    """Map each user id to its cost_method ('' when unset)"""
+    return dict(User.objects.filter(pk__in=user_ids).values_list('id', 'cost_method'))
+
+
+@lru_cache(maxsize=None)
+def cost_engine(method):
+    """The engine registered for `method` in COST_ENGINES"""
+    try:
+        path = settings.COST_ENGINES[method]
+    except KeyError:
+        raise ImproperlyConfigured(f"Unknown cost method {method!r}; COST_ENGINES has {', '.join(settings.COST_ENGINES)}")
+    return import_string(path)()
+
+
+def engine_for(product_id, cost_method=''):
+    """Engine of a history: the product's cost_method, else the user's `cost_method`, else the default"""
+    method = product_catalog.get(product_id).cost_method or cost_method or settings.DEFAULT_COST_METHOD
+    return cost_engine(method)
+
+
+def history_costs(entries, user_id=None, cost_method='', using='default'):
+    """
+    Costs of a user's entries (the `running_wac_costs` tuples, any mix of products),
+    each priced by its history's engine, with one pass per engine. With `user_id`
+    the histories start from that user's closed periods.
+    """
+    engines = {}
+    indexes_by_engine = {}
+    for index, entry in enumerate(entries):
+        product_id = entry[1]
+        if product_id not in engines:
+            engines[product_id] = engine_for(product_id, cost_method)
+        indexes_by_engine.setdefault(engines[product_id], []).append(index)
+
+    costs = [ZERO_COST] * len(entries)
+    for engine, indexes in indexes_by_engine.items():
+        product_ids = [product_id for product_id, owner in engines.items() if owner is engine]
+        opening = engine.opening(user_id, product_ids, using) if user_id is not None else None
+        if len(indexes) == len(entries):
+            return engine.costs(entries, opening)
+        for index, cost in zip(indexes, engine.costs([entries[index] for index in indexes], opening)):
+            costs[index] = cost
+    return costs
+
+
+class CostEngine:
+    """
+    Prices (user, product) histories. `costs` takes the `running_wac_costs` entry
+    tuples sorted by (transaction_datetime, id) and `opening` as returned by
+    `opening()`, keyed by product id.
+    """
+    name = None
+
+    def moves_later_costs(self, transaction_type):
+        """Whether a transaction of this type changes the cost of later ones"""
+        return True
+
+    def opening(self, user_id, product_ids, using):
+        """State each history starts from, after its closed periods"""
+        raise NotImplementedError
+
+    def costs(self, entries, opening=None):
+        raise NotImplementedError
+
+    def suffix_window(self, history, user_id, product_id, since, until=None):
+        """
+        What pricing the history from `since` (up to `until`) needs: the opening state
+        and the (id, *entry) rows to price from it, in (transaction_datetime, id) order.
+        """
+        raise NotImplementedError
+
+    def suffix_costs(self, history, user_id, product_id, since, until=None):
+        raise NotImplementedError
+
+    def unit_costs(self, product_id, entries, moments, opening=None):
+        """
+        Cost of one unit sold right after each of `moments` (ascending datetimes),
+        in one pass over the product's history `entries` and the moments together.
+        """
+        raise NotImplementedError
+
+    def transaction_cost(self, transaction):
+        """Cost of one saved transaction, computed from scratch; the reference for the fast paths"""
+        history = Transaction.objects.using(transaction.shard_alias()).filter(
+            user_id=transaction.user_id, product_id=transaction.product_id
+        )
+        return self.suffix_costs(
+            history, transaction.user_id, transaction.product_id,
+            transaction.transaction_datetime, transaction.transaction_datetime
+        )[transaction.pk]
+
+
+class WACEngine(CostEngine):
+    name = 'wac'
+
+    def moves_later_costs(self, transaction_type):
+        # A sale only changes its own cost, so only purchases start a suffix
+        return transaction_type == 'purchase'
+
+    def opening(self, user_id, product_ids, using):
+        return OpeningBalance.totals_for(user_id, product_ids, using=using)
+
+    def costs(self, entries, opening=None):
+        record_cost_run(self.name, len(entries))
+        return running_wac_costs(entries, opening)
+
+    def suffix_window(self, history, user_id, product_id, since, until=None):
+        """
+        Purchases before `since` are aggregated in the database on top of any
+        closed-period opening balance, so only the affected suffix is loaded.
+        """
+        prefix = history.filter(
+            transaction_type='purchase',
+            transaction_datetime__lt=since
+        ).aggregate(cost=Sum('total_price'), units=Sum('quantity'))
+        opening_cost, opening_units = OpeningBalance.totals_for(
+            user_id, [product_id], using=history.db
+        ).get(product_id, (ZERO_COST, 0))
+
+        window = history.filter(transaction_datetime__gte=since)
+        if until is not None:
+            window = window.filter(transaction_datetime__lte=until)
+        rows = list(window.order_by('transaction_datetime', 'id').values_list(
+            'id', 'transaction_type', 'product_id', 'quantity', 'total_price', 'transaction_datetime'
+        ))
+        opening = {product_id: (opening_cost + (prefix['cost'] or ZERO_COST), opening_units + (prefix['units'] or 0))}
+        return opening, rows
+
+    def suffix_costs(self, history, user_id, product_id, since, until=None):
+        opening, rows = self.suffix_window(history, user_id, product_id, since, until)
+        costs = self.costs([row[1:] for row in rows], opening)
+        return {row[0]: cost for row, cost in zip(rows, costs)}
+
+    def unit_costs(self, product_id, entries, moments, opening=None):
+        record_cost_run(self.name, len(entries))
+        total_purchase_cost, total_units = (opening or {}).get(product_id, (ZERO_COST, 0))
+        costs = []
+        index = 0
+        count = len(entries)
+        for moment in moments:
+            while index < count and entries[index][4] <= moment:
+                transaction_type, _, quantity, total_price, _ = entries[index]
+                if transaction_type == 'purchase':
+                    total_purchase_cost += total_price
+                    total_units += quantity
+                index += 1
+            costs.append(wac_cost('sale', 1, total_purchase_cost, total_units))
+        return costs
+
+    def transaction_cost(self, transaction):
+        """
+        Average cost per unit at the moment of the transaction.
+        For purchases: Average cost = Total cost of all purchases including this one / Total units including this one
+        For sales: Cost of unit sold = Average cost per unit * Quantity sold
+        """
+        using = transaction.shard_alias()
+        # Get all purchases of this product by the user before or on this transaction datetime
+        purchases = Transaction.objects.using(using).filter(
+            user_id=transaction.user_id,
+            product_id=transaction.product_id,
+            transaction_type='purchase',
+            transaction_datetime__lte=transaction.transaction_datetime
+        )
+
+        # Calculate total cost and total units of all purchases up to this point,
+        # starting from the opening balance of any closed period
+        total_purchase_cost = Decimal('0.00')
+        total_units = 0
+        scanned = 0
+        opening = OpeningBalance.objects.using(using).filter(
+            user_id=transaction.user_id, product_id=transaction.product_id
+        ).first()
+        if opening is not None:
+            total_purchase_cost += opening.purchase_cost
+            total_units += opening.purchase_units
+        for purchase in purchases:
+            total_purchase_cost += purchase.total_price
+            total_units += purchase.quantity
+            scanned += 1
+
+        record_cost_run(self.name, scanned)
+        return wac_cost(transaction.transaction_type, transaction.quantity, total_purchase_cost, total_units)
+
+
+class FifoLots:
+    """Open purchase lots of one history, oldest first, as [units left, unit cost] pairs"""
+    __slots__ = ('lots', 'last_unit_cost')
+
+    def __init__(self, lots=(), last_unit_cost=None):
+        self.lots = deque([units, unit_cost] for units, unit_cost in lots)
+        self.last_unit_cost = last_unit_cost
+
+    def copy(self):
+        return FifoLots(self.lots, self.last_unit_cost)
+
+    def add(self, quantity, total_price):
+        """Open a lot for a purchase and return its unit cost"""
+        if not quantity:
+            return ZERO_COST
+        unit_cost = total_price / quantity
+        self.lots.append([quantity, unit_cost])
+        self.last_unit_cost = unit_cost
+        return unit_cost
+
+    def take(self, quantity):
+        """
+        Consume `quantity` units from the oldest lots and return their cost. Units
+        beyond what is open (overselling) cost the last purchase's unit cost.
+        """
+        lots = self.lots
+        cost = ZERO_COST
+        while quantity and lots:
+            lot = lots[0]
+            taken = min(quantity, lot[0])
+            cost += taken * lot[1]
+            quantity -= taken
+            if taken == lot[0]:
+                lots.popleft()
+            else:
+                lot[0] -= taken
+        if quantity and self.last_unit_cost is not None:
+            cost += quantity * self.last_unit_cost
+        return cost
+
+    def unit_cost(self):
+        """Cost of the next unit a sale would take, as `take(1)` without consuming it"""
+        if self.lots:
+            return self.lots[0][1]
+        return self.last_unit_cost if self.last_unit_cost is not None else ZERO_COST
+
+    def as_json(self):
+        """For OpeningBalance.fifo_lots; unit costs are strings so they round-trip exactly"""
+        return {
+            'lots': [[units, str(unit_cost)] for units, unit_cost in self.lots],
+            'last_unit_cost': None if self.last_unit_cost is None else str(self.last_unit_cost),
+        }
+
+    @classmethod
+    def from_json(cls, data):
+        data = data or {}
+        last_unit_cost = data.get('last_unit_cost')
+        return cls(
+            [(units, Decimal(unit_cost)) for units, unit_cost in data.get('lots', ())],
+            None if last_unit_cost is None else Decimal(last_unit_cost),
+        )
+
+    def replay(self, entries):
+        """
+        Apply one history's `running_wac_costs` entries, in (transaction_datetime, id)
+        order, from any iterable: like running_fifo_costs, purchases open before the
+        sales of their datetime, but the entries are streamed instead of held.
+        """
+        group = []
+        for entry in chain(entries, [None]):
+            if group and (entry is None or entry[4] != group[0][4]):
+                for transaction_type, _, quantity, total_price, _ in group:
+                    if transaction_type == 'purchase':
+                        self.add(quantity, total_price)
+                for transaction_type, _, quantity, _, _ in group:
+                    if transaction_type != 'purchase':
+                        self.take(quantity)
+                group = []
+            if entry is not None:
+                group.append(entry)
+        return self
+
+
+def running_fifo_costs(entries, opening=None):
+    """
+    FIFO cost of every entry in a single ordered pass: a purchase costs its own unit
+    cost, a sale the cost of the oldest open units it consumes. Every lot is opened
+    and closed once, so a history replays in O(n). Purchases sharing a datetime with
+    a sale are available to it, as in WAC. `opening` maps product_id to FifoLots.
+    """
+    lots = {product_id: product_lots.copy() for product_id, product_lots in (opening or {}).items()}
+    costs = [ZERO_COST] * len(entries)
+    count = len(entries)
+    start = 0
+    while start < count:
+        current_datetime = entries[start][4]
+        end = start
+        while end < count and entries[end][4] == current_datetime:
+            transaction_type, product_id, quantity, total_price, _ = entries[end]
+            if transaction_type == 'purchase':
+                unit_cost = lots.setdefault(product_id, FifoLots()).add(quantity, total_price)
+                costs[end] = round(unit_cost, 2)
+            end += 1
+
+        for index in range(start, end):
+            transaction_type, product_id, quantity, _, _ = entries[index]
+            if transaction_type != 'purchase':
+                costs[index] = round(lots.setdefault(product_id, FifoLots()).take(quantity), 2)
+        start = end
+
+    return costs, lots
+
+
+class FIFOEngine(CostEngine):
+    name = 'fifo'
+
+    def opening(self, user_id, product_ids, using):
+        """The lots each closed period left open, stored on its opening balance by close_period"""
+        balances = OpeningBalance.objects.using(using).filter(user_id=user_id, product_id__in=product_ids)
+        return {product_id: FifoLots.from_json(lots) for product_id, lots in balances.values_list('product_id', 'fifo_lots')}
+
+    def costs(self, entries, opening=None):
+        record_cost_run(self.name, len(entries))
+        return running_fifo_costs(entries, opening)[0]
+
+    def suffix_window(self, history, user_id, product_id, since, until=None):
+        """A sale's cost depends on every earlier one, so the whole history up to `until` is replayed"""
+        window = history if until is None else history.filter(transaction_datetime__lte=until)
+        rows = list(window.order_by('transaction_datetime', 'id').values_list(
+            'id', 'transaction_type', 'product_id', 'quantity', 'total_price', 'transaction_datetime'
+        ))
+        return self.opening(user_id, [product_id], history.db), rows
+
+    def suffix_costs(self, history, user_id, product_id, since, until=None):
+        opening, rows = self.suffix_window(history, user_id, product_id, since, until)
+        costs = self.costs([row[1:] for row in rows], opening)
+        return {row[0]: cost for row, cost in zip(rows, costs) if row[5] >= since}
+
+    def unit_costs(self, product_id, entries, moments, opening=None):
+        record_cost_run(self.name, len(entries))
+        lots = (opening or {}).get(product_id, FifoLots()).copy()
+        costs = []
+        index = 0
+        count = len(entries)
+        for moment in moments:
+            while index < count and entries[index][4] <= moment:
+                # Purchases sharing a datetime are open to its sales, as in running_fifo_costs
+                end = index
+                while end < count and entries[end][4] == entries[index][4]:
+                    end += 1
+                for transaction_type, _, quantity, total_price, _ in entries[index:end]:
+                    if transaction_type == 'purchase':
+                        lots.add(quantity, total_price)
+                for transaction_type, _, quantity, _, _ in entries[index:end]:
+                    if transaction_type != 'purchase':
+                        lots.take(quantity)
+                index = end
+            costs.append(round(lots.unit_cost(), 2))
+        return costs
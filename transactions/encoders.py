@@ -0,0 +1,150 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from django.conf import settings
+from django.utils import timezone
+from products.catalog import product_catalog
+from transactions.costing import history_costs, suffix_costs
+
+
+CENTS = Decimal('0.01')
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+
+# Field order of the compact (MessagePack) schema, also used for columnar output
+COMPACT_FIELDS = (
+    'id', 'transaction_type', 'product_name', 'quantity', 'unit_price',
+    'total_price', 'transaction_datetime', 'cost', 'created_at',
+)
+
+
+def to_cents(value):
+    return int(value.quantize(CENTS) * 100)
+
+
+def to_epoch_us(value):
+    return (value - EPOCH) // MICROSECOND
+
+
+class TransactionRowEncoder:
+    """
+    Encode transactions straight from `values_list` tuples into the same structure
+    TransactionListSerializer produces, without building DRF field objects per row.
+    Pass `user_id` so costs start from that user's closed periods, and the user's
+    `cost_method` so histories are priced by the right engine.
+    """
+    # Product names come from the catalog rather than a join, since transactions
+    # may live on a shard without the products table; product_id stands in here
+    columns = (
+        'id', 'transaction_type', 'product_id', 'quantity', 'unit_price',
+        'total_price', 'transaction_datetime', 'created_at', 'product_id',
+    )
+
+    def __init__(self, user_id=None, cost_method=''):
+        self.user_id = user_id
+        self.cost_method = cost_method
+        self.tz = timezone.get_current_timezone() if settings.USE_TZ else None
+
+    def format_datetime(self, value):
+        # Same output as DRF's DateTimeField with the default ISO 8601 format
+        if self.tz is not None and timezone.is_aware(value):
+            value = value.astimezone(self.tz)
+        value = value.isoformat()
+        if value.endswith('+00:00'):
+            value = value[:-6] + 'Z'
+        return value
+
+    def values(self, queryset):
+        names = {}
+        rows = []
+        for row in queryset.values_list(*self.columns):
+            product_id = row[2]
+            if product_id not in names:
+                names[product_id] = product_catalog.get(product_id).name
+            rows.append((row[0], row[1], names[product_id]) + row[3:])
+        return rows
+
+    def fetch(self, queryset):
+        """Fetch raw rows (ordered by transaction_datetime, then id) and their costs"""
+        rows = self.values(queryset)
+        costs = history_costs([
+            (row[1], row[8], row[3], row[5], row[6]) for row in rows
+        ], self.user_id, self.cost_method, using=queryset.db)
+        return rows, costs
+
+    def fetch_ids(self, history, ids):
+        """
+        Fetch the rows of `history` (the encoder user's transactions) with the given ids.
+        Costs only cover each product's suffix from the earliest fetched row.
+        """
+        rows = self.values(history.filter(id__in=ids).order_by('transaction_datetime', 'id'))
+        starts = {}
+        for row in rows:
+            starts.setdefault(row[8], row[6])
+
+        costs_by_id = {}
+        for product_id, since in starts.items():
+            costs_by_id.update(suffix_costs(
+                history.filter(product_id=product_id), self.user_id, product_id, since, cost_method=self.cost_method
+            ))
+        return rows, [costs_by_id[row[0]] for row in rows]
+
+    def encode(self, queryset, transaction_type=None):
+        """
+        Encode every transaction in `queryset`, optionally keeping only one
+        transaction_type. Costs are computed over the full queryset, so it must
+        contain the transactions the kept rows depend on.
+        """
+        return self.format_rows(*self.fetch(queryset), transaction_type=transaction_type)
+
+    def format_rows(self, rows, costs, transaction_type=None):
+        format_datetime = self.format_datetime
+        return [
+            {
+                'id': row[0],
+                'transaction_type': row[1],
+                'product_name': row[2],
+                'quantity': row[3],
+                'unit_price': '{:f}'.format(row[4].quantize(CENTS)),
+                'total_price': '{:f}'.format(row[5].quantize(CENTS)),
+                'transaction_datetime': format_datetime(row[6]),
+                'cost': float(cost),
+                'created_at': format_datetime(row[7]),
+            }
+            for row, cost in zip(rows, costs)
+            if transaction_type is None or row[1] == transaction_type
+        ]
+
+    def encode_compact(self, queryset, transaction_type=None, columnar=False):
+        """
+        Encode rows in the compact schema: prices and costs as integer cents and
+        datetimes as epoch microseconds. With `columnar`, return one list per field
+        instead of one dict per row.
+        """
+        return self.format_compact(*self.fetch(queryset), transaction_type=transaction_type, columnar=columnar)
+
+    def format_compact(self, rows, costs, transaction_type=None, columnar=False):
+        encoded = [
+            self.compact_row(row[0], row[1], row[2], row[3], row[4], row[5], row[6], cost, row[7])
+            for row, cost in zip(rows, costs)
+            if transaction_type is None or row[1] == transaction_type
+        ]
+        if columnar:
+            return {field: [row[index] for row in encoded] for index, field in enumerate(COMPACT_FIELDS)}
+        return [dict(zip(COMPACT_FIELDS, row)) for row in encoded]
+
+    def encode_instance_compact(self, transaction):
+        """Compact schema for a single saved transaction"""
+        return dict(zip(COMPACT_FIELDS, self.compact_row(
+            transaction.id, transaction.transaction_type, product_catalog.get(transaction.product_id).name,
+            transaction.quantity, transaction.unit_price, transaction.total_price,
+            transaction.transaction_datetime, transaction.calculate_cost(), transaction.created_at,
+        )))
+
+    @staticmethod
+    def compact_row(pk, transaction_type, product_name, quantity, unit_price, total_price,
+                    transaction_datetime, cost, created_at):
+        return (
+            pk, transaction_type, product_name, quantity, to_cents(unit_price),
+            to_cents(total_price), to_epoch_us(transaction_datetime), to_cents(cost),
+            to_epoch_us(created_at),
+        )
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+from django.utils import timezone
+from products.models import Product
+from transactions.closing import PeriodCloseError, close_period
+from transactions.concurrency import HistoryConflict
+from transactions.models import Transaction
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = 'Close the period before a date: archive old transactions into opening balances'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--before', required=True, help='Closing datetime (ISO 8601); earlier transactions are archived')
+        parser.add_argument('--user', required=True, help='Username whose history to close')
+        parser.add_argument('--product', help='Product name (default: every product the user has transactions for)')
+
+    def handle(self, *args, **options):
+        closing_datetime = parse_datetime(options['before'])
+        if closing_datetime is None:
+            raise CommandError('--before must be an ISO 8601 datetime')
+        if timezone.is_naive(closing_datetime):
+            closing_datetime = timezone.make_aware(closing_datetime)
+
+        try:
+            user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f"User not found: {options['user']}")
+
+        if options['product']:
+            products = Product.objects.filter(name=options['product'])
+            if not products.exists():
+                raise CommandError(f"Product not found: {options['product']}")
+        else:
+            # Evaluate the product ids first: transactions may live on another database
+            product_ids = set(Transaction.objects.for_user(user).values_list('product_id', flat=True).distinct())
+            products = Product.objects.filter(id__in=product_ids)
+
+        for product in products:
+            try:
+                archived = close_period(user, product, closing_datetime)
+            except (PeriodCloseError, HistoryConflict) as e:
+                self.stdout.write(self.style.WARNING(f'{product.name}: {e}'))
+                continue
+            self.stdout.write(self.style.SUCCESS(f'{product.name}: archived {archived} transactions'))
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+from transactions.metrics import HISTORY_ROW_BUCKETS, TABLE_STATS, as_snapshot, metrics_store, write_snapshot
+from transactions.models import Transaction
+from transactions.replicas import read_alias
+from transactions.sharding import shard_aliases
+
+
+class Command(BaseCommand):
+    help = ('Count transaction rows and users by history size per database for /metrics; '
+            'schedule it (e.g. every few minutes) instead of grouping every table on each scrape')
+
+    def handle(self, *args, **options):
+        rows, users = {}, {}
+        for alias in dict.fromkeys(['default', *shard_aliases()]):
+            # A replica where there is one, like export_ledger
+            sizes = Transaction.objects.using(read_alias(alias)).order_by().values('user_id').annotate(
+                n=Count('id')
+            ).values_list('n', flat=True)
+            histogram = {'buckets': list(HISTORY_ROW_BUCKETS), 'counts': [0] * len(HISTORY_ROW_BUCKETS), 'sum': 0, 'count': 0}
+            for size in sizes.iterator():
+                for index, bound in enumerate(HISTORY_ROW_BUCKETS):
+                    if size <= bound:
+                        histogram['counts'][index] += 1
+                        break
+                histogram['sum'] += size
+                histogram['count'] += 1
+            rows[(('database', alias),)] = histogram['sum']
+            users[(('database', alias),)] = histogram
+            self.stdout.write(f"{alias}: {histogram['sum']} rows, {histogram['count']} users")
+
+        write_snapshot(metrics_store() / TABLE_STATS, as_snapshot({
+            'transaction_rows': rows, 'transaction_users_by_rows': users
+        }))
+        self.stdout.write(self.style.SUCCESS(f'Wrote {metrics_store() / TABLE_STATS}'))
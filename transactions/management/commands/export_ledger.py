@@ -0,0 +1,207 @@
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from products.models import Product
+from transactions.costing import user_cost_methods
+from transactions.encoders import TransactionRowEncoder, to_cents, to_epoch_us
+from transactions.models import Transaction, TransactionChange
+from transactions.replicas import read_alias
+from transactions.sharding import shard_aliases
+from transactions.snapshots import COLUMNS, FORMAT_VERSION, MANIFEST, TRANSACTION_TYPES, map_column, numpy, read_manifest
+from users.models import User
+
+TYPE_INDEX = {name: index for index, name in enumerate(TRANSACTION_TYPES)}
+
+
+def cost_methods_digest():
+    """Changes with any cost method assignment; costs then move without change log entries"""
+    assignments = {
+        'default': settings.DEFAULT_COST_METHOD,
+        'engines': settings.COST_ENGINES,
+        'products': list(Product.objects.exclude(cost_method='').order_by('id').values_list('id', 'cost_method')),
+        'users': list(User.objects.exclude(cost_method='').order_by('id').values_list('id', 'cost_method')),
+    }
+    return hashlib.sha256(json.dumps(assignments, sort_keys=True).encode()).hexdigest()
+
+
+def latest_change(using):
+    return TransactionChange.objects.using(using).order_by('-id').values_list('id', flat=True).first() or 0
+
+
+class ColumnWriter:
+    """Appends rows to one file per column of a new generation"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        directory.mkdir(parents=True)
+        self.files = {name: open(directory / f'{name}.bin', 'wb') for name in COLUMNS}
+        self.rows = 0
+
+    def append(self, columns):
+        for name, values in columns.items():
+            numpy.asarray(values, dtype=COLUMNS[name]).tofile(self.files[name])
+        self.rows += len(columns['id'])
+
+    def append_rows(self, database_index, user_id, rows, costs):
+        """Append `TransactionRowEncoder.fetch` rows and their costs"""
+        if not rows:
+            return
+        self.append({
+            'id': [row[0] for row in rows],
+            'database': [database_index] * len(rows),
+            'user_id': [user_id] * len(rows),
+            'product_id': [row[8] for row in rows],
+            'transaction_type': [TYPE_INDEX[row[1]] for row in rows],
+            'quantity': [row[3] for row in rows],
+            'unit_price': [to_cents(row[4]) for row in rows],
+            'total_price': [to_cents(row[5]) for row in rows],
+            'cost': [to_cents(cost) for cost in costs],
+            'transaction_datetime': [to_epoch_us(row[6]) for row in rows],
+            'created_at': [to_epoch_us(row[7]) for row in rows],
+        })
+
+    def close(self):
+        for file in self.files.values():
+            file.close()
+
+
+class Command(BaseCommand):
+    help = 'Write a columnar snapshot of the transaction ledger with costs, incrementally when one exists'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=settings.LEDGER_SNAPSHOT_DIR, help='Snapshot directory')
+        parser.add_argument('--full', action='store_true', help='Rebuild the snapshot instead of applying the change log')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Users per cost method query; changed ids per user fetched by id')
+
+    def handle(self, *args, **options):
+        if numpy is None:
+            raise CommandError('export_ledger needs numpy: pip install numpy')
+        output = Path(options['output'])
+        batch_size = options['batch_size']
+        databases = list(dict.fromkeys(['default', *shard_aliases()]))
+        # Read from a replica where there is one, keeping the export off the primaries
+        sources = {alias: read_alias(alias) for alias in databases}
+        digest = cost_methods_digest()
+
+        previous = read_manifest(output)
+        reason = 'requested with --full' if options['full'] else self.full_export_reason(output, previous, databases, digest)
+        generation = previous['generation'] + 1 if previous else 1
+        directory = output / str(generation)
+        if directory.exists():  # left by an interrupted export
+            shutil.rmtree(directory)
+        writer = ColumnWriter(directory)
+        try:
+            # Cursors first: anything written meanwhile is applied again by the next export
+            cursors = {alias: latest_change(sources[alias]) for alias in databases}
+            if reason is None:
+                self.stdout.write(f'Incremental export after {previous["cursors"]}')
+                self.export_changes(writer, output, previous, databases, sources, cursors, batch_size)
+            else:
+                self.stdout.write(f'Full export ({reason})')
+                for index, alias in enumerate(databases):
+                    self.export_database(writer, index, sources[alias], batch_size)
+        finally:
+            writer.close()
+
+        manifest = {
+            'format': FORMAT_VERSION,
+            'generation': generation,
+            'rows': writer.rows,
+            'exported_at': timezone.now().isoformat(),
+            'columns': COLUMNS,
+            'transaction_types': list(TRANSACTION_TYPES),
+            'databases': databases,
+            'cursors': cursors,
+            'cost_methods': digest,
+            'products': {str(pk): name for pk, name in Product.objects.values_list('id', 'name')},
+        }
+        temporary = output / f'{MANIFEST}.tmp'
+        temporary.write_text(json.dumps(manifest, indent=2))
+        os.replace(temporary, output / MANIFEST)
+        for path in output.iterdir():
+            # Open snapshots keep their mapped files; where the OS refuses, the next export retries
+            if path.is_dir() and path.name.isdigit() and path.name != str(generation):
+                shutil.rmtree(path, ignore_errors=True)
+        self.stdout.write(self.style.SUCCESS(f'Wrote {writer.rows} rows to {directory}'))
+
+    def full_export_reason(self, output, previous, databases, digest):
+        """Why the previous snapshot cannot be updated from the change log, or None"""
+        if previous is None:
+            return 'no previous snapshot'
+        if previous['databases'] != databases:
+            return 'the databases changed'
+        if previous['cost_methods'] != digest:
+            return 'cost methods changed'
+        if previous['rows'] and not (output / str(previous['generation'])).is_dir():
+            return 'the previous generation is missing'
+        return None
+
+    def export_database(self, writer, database_index, using, batch_size):
+        user_ids = list(
+            Transaction.objects.using(using).order_by('user_id').values_list('user_id', flat=True).distinct()
+        )
+        for start in range(0, len(user_ids), batch_size):
+            batch = user_ids[start:start + batch_size]
+            methods = user_cost_methods(batch)
+            for user_id in batch:
+                encoder = TransactionRowEncoder(user_id, methods.get(user_id, ''))
+                history = Transaction.objects.using(using).filter(user_id=user_id)
+                writer.append_rows(database_index, user_id, *encoder.fetch(history.order_by('transaction_datetime', 'id')))
+
+    def export_changes(self, writer, output, previous, databases, sources, cursors, batch_size):
+        """
+        Carry the previous rows over, minus those the change log touched since its
+        cursors and those of users no longer on their database (deleted, moved to
+        another shard), then append the touched rows as they are now.
+        """
+        touched = {}
+        live_users = {}
+        for alias in databases:
+            changed = touched[alias] = {}
+            entries = TransactionChange.objects.using(sources[alias]).filter(
+                id__gt=previous['cursors'][alias], id__lte=cursors[alias]
+            ).values_list('user_id', 'transaction_id')
+            for user_id, transaction_id in entries.iterator(chunk_size=10000):
+                changed.setdefault(user_id, set()).add(transaction_id)
+            live_users[alias] = list(
+                Transaction.objects.using(sources[alias]).order_by().values_list('user_id', flat=True).distinct()
+            )
+
+        if previous['rows']:
+            old_database = map_column(output, previous, 'database')
+            old_id = map_column(output, previous, 'id')
+            old_user = map_column(output, previous, 'user_id')
+            keep = numpy.ones(previous['rows'], dtype=bool)
+            for index, alias in enumerate(databases):
+                changed_ids = numpy.fromiter((pk for ids in touched[alias].values() for pk in ids), dtype='<i8')
+                keep &= ~((old_database == index) & (
+                    numpy.isin(old_id, changed_ids) | ~numpy.isin(old_user, numpy.asarray(live_users[alias], dtype='<i8'))
+                ))
+            self.stdout.write(f'Carrying over {int(keep.sum())} of {previous["rows"]} rows')
+            writer.append({name: map_column(output, previous, name)[keep] for name in COLUMNS})
+
+        for index, alias in enumerate(databases):
+            using = sources[alias]
+            live = set(live_users[alias])
+            user_ids = [user_id for user_id in touched[alias] if user_id in live]
+            for start in range(0, len(user_ids), batch_size):
+                batch = user_ids[start:start + batch_size]
+                methods = user_cost_methods(batch)
+                for user_id in batch:
+                    ids = touched[alias][user_id]
+                    encoder = TransactionRowEncoder(user_id, methods.get(user_id, ''))
+                    history = Transaction.objects.using(using).filter(user_id=user_id)
+                    if len(ids) <= batch_size:
+                        rows, costs = encoder.fetch_ids(history, ids)
+                    else:
+                        # Too many ids for one IN clause: price the whole history and keep the touched rows
+                        rows, costs = encoder.fetch(history.order_by('transaction_datetime', 'id'))
+                        kept = [position for position, row in enumerate(rows) if row[0] in ids]
+                        rows, costs = [rows[position] for position in kept], [costs[position] for position in kept]
+                    writer.append_rows(index, user_id, rows, costs)
@@ -0,0 +1,71 @@
+import random
+from datetime import timedelta
+from decimal import Decimal
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from products.models import Product
+from transactions.models import Transaction, TransactionChange
+from transactions.sharding import shard_for_user
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = 'Generate users and random purchase/sale histories for benchmarking'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1, help='Number of users to create')
+        parser.add_argument('--transactions', type=int, default=1000, help='Transactions per user')
+        parser.add_argument('--products', type=int, default=1, help='Number of products to spread transactions over')
+        parser.add_argument('--prefix', default='bench', help='Username prefix for generated users')
+        parser.add_argument('--password', default='benchpass123', help='Password for generated users')
+        parser.add_argument('--days', type=int, default=365, help='Spread transactions over this many past days')
+        parser.add_argument('--seed', type=int, default=None, help='Random seed for repeatable datasets')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        products = self.get_products(options['products'])
+        password = make_password(options['password'])
+        now = timezone.now()
+        span = timedelta(days=options['days']).total_seconds()
+
+        for index in range(options['users']):
+            username = f"{options['prefix']}_{index}"
+            user, _ = User.objects.get_or_create(
+                username=username,
+                defaults={'email': f'{username}@example.com', 'password': password},
+            )
+
+            transactions = []
+            for _ in range(options['transactions']):
+                transaction_type = 'purchase' if rng.random() < 0.5 else 'sale'
+                quantity = rng.randint(1, 200)
+                unit_price = Decimal(rng.randint(100, 500)) / 100
+                transactions.append(Transaction(
+                    user=user,
+                    product=rng.choice(products),
+                    transaction_type=transaction_type,
+                    quantity=quantity,
+                    unit_price=unit_price,
+                    total_price=quantity * unit_price,
+                    transaction_datetime=now - timedelta(seconds=rng.uniform(0, span)),
+                ))
+            # bulk_create skips Transaction.save() and its signals, so log the creates here
+            using = shard_for_user(user)
+            Transaction.objects.db_manager(using).bulk_create(transactions, batch_size=options['batch_size'])
+            TransactionChange.objects.db_manager(using).bulk_create([
+                TransactionChange(user=user, transaction_id=transaction.pk, operation='create')
+                for transaction in transactions
+            ], batch_size=options['batch_size'])
+            self.stdout.write(f'{username}: {len(transactions)} transactions')
+
+        self.stdout.write(self.style.SUCCESS(
+            f"\nGenerated {options['users'] * options['transactions']} transactions "
+            f"for {options['users']} users"))
+
+    def get_products(self, count):
+        products = list(Product.objects.order_by('id')[:count])
+        for index in range(len(products), count):
+            products.append(Product.objects.create(name=f'BenchProduct{index}', price=Decimal('2.00')))
+        return products
@@ -0,0 +1,116 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Runs in a fresh interpreter so nothing is imported yet. Prints the timings as JSON.
+PROBE = r'''
+import json, os, sys, time
+start = time.perf_counter()
+target, path = sys.argv[1], sys.argv[2]
+if target == 'wsgi':
+    from config.wsgi import application
+    ready = time.perf_counter()
+    from io import BytesIO
+    status = []
+    environ = {
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': '', 'SERVER_NAME': 'localhost',
+        'SERVER_PORT': '80', 'HTTP_HOST': 'localhost', 'wsgi.input': BytesIO(), 'wsgi.errors': sys.stderr,
+        'wsgi.url_scheme': 'http', 'wsgi.version': (1, 0), 'wsgi.multithread': False,
+        'wsgi.multiprocess': True, 'wsgi.run_once': False,
+    }
+    response = application(environ, lambda s, headers, exc_info=None: status.append(s))
+    b''.join(response)
+    status = status[0]
+else:
+    import asyncio
+    from config.asgi import application
+    ready = time.perf_counter()
+    messages = []
+    pending = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+    async def receive():
+        if pending:
+            return pending.pop()
+        await asyncio.Event().wait()
+    async def send(message):
+        messages.append(message)
+    asyncio.run(application({
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+        'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': b'',
+        'root_path': '', 'headers': [(b'host', b'localhost')], 'client': ('127.0.0.1', 0),
+        'server': ('localhost', 80),
+    }, receive, send))
+    status = str(messages[0]['status'])
+done = time.perf_counter()
+print(json.dumps({'setup': ready - start, 'first_response': done - ready, 'status': status}))
+'''
+
+
+class Command(BaseCommand):
+    help = 'Report import and setup time of config.wsgi / config.asgi and the time to the first response'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target', choices=['wsgi', 'asgi', 'both'], default='both')
+        parser.add_argument('--settings-module', default=os.environ.get('DJANGO_SETTINGS_MODULE', 'config.settings'),
+                            help='Settings module the worker would start with')
+        parser.add_argument('--path', default='/api/auth/profile/',
+                            help='Path of the first request (unauthenticated, so it is answered without the database)')
+        parser.add_argument('--runs', type=int, default=5, help='Cold starts to measure; medians are reported')
+        parser.add_argument('--top', type=int, default=15, help='Number of modules and packages to list')
+
+    def handle(self, *args, **options):
+        targets = ['wsgi', 'asgi'] if options['target'] == 'both' else [options['target']]
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': options['settings_module']}
+        env['PYTHONPATH'] = os.pathsep.join(filter(None, [str(settings.BASE_DIR), env.get('PYTHONPATH')]))
+
+        self.stdout.write(f"Settings: {options['settings_module']}, median of {options['runs']} cold starts")
+        for target in targets:
+            runs = [self.cold_start(target, options['path'], env) for _ in range(options['runs'])]
+            timings = [timing for timing, _ in runs]
+            imports = runs[-1][1]
+
+            self.stdout.write(self.style.MIGRATE_HEADING(f'\n{target}'))
+            for key, label in (('total', 'process start to first response'), ('setup', 'import + django.setup()'),
+                               ('first_response', 'first request'), ('imports', 'of which imports')):
+                value = statistics.median(timing[key] for timing in timings)
+                self.stdout.write(f'  {label:34} {value * 1000:8.1f} ms')
+            self.stdout.write(f"  first response status: {timings[-1]['status']}, modules imported: {len(imports)}")
+
+            self.stdout.write(f"\n  Slowest modules (self time, last run):")
+            for module, self_us, _ in sorted(imports, key=lambda item: -item[1])[:options['top']]:
+                self.stdout.write(f'    {self_us / 1000:8.1f} ms  {module}')
+
+            packages = defaultdict(int)
+            for module, self_us, _ in imports:
+                packages[module.split('.')[0]] += self_us
+            self.stdout.write(f"\n  Slowest top-level packages (self time summed, last run):")
+            for package, self_us in sorted(packages.items(), key=lambda item: -item[1])[:options['top']]:
+                self.stdout.write(f'    {self_us / 1000:8.1f} ms  {package}')
+
+    def cold_start(self, target, path, env):
+        """Start a fresh interpreter under -X importtime; returns (timings, [(module, self us, cumulative us)])"""
+        started = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', PROBE, target, path],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True
+        )
+        total = time.perf_counter() - started
+        if result.returncode != 0:
+            raise CommandError(f'{target} probe failed:\n{result.stderr[-2000:]}')
+
+        imports = []
+        for line in result.stderr.splitlines():
+            if not line.startswith('import time:') or 'imported package' in line:
+                continue
+            self_us, cumulative_us, module = line[len('import time:'):].split('|')
+            imports.append((module.strip(), int(self_us), int(cumulative_us)))
+
+        timings = json.loads(result.stdout.strip().splitlines()[-1])
+        timings['total'] = total
+        timings['imports'] = sum(self_us for _, self_us, _ in imports) / 1e6
+        return timings, imports
@@ -0,0 +1,130 @@
+from collections import defaultdict
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction as db_transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from products.models import Product
+from transactions.costing import engine_for, user_cost_methods
+from transactions.models import ArchivedTransaction, HistoryVersion, OpeningBalance, Transaction, TransactionChange
+from transactions.replicas import mark_write
+from transactions.sharding import shard_aliases, shard_for_user
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = 'Delete transactions in bounded chunks with raw DELETEs, committing between chunks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='Only this username')
+        parser.add_argument('--product', help='Only this product name')
+        parser.add_argument('--before', help='Only transactions dated before this ISO 8601 datetime')
+        parser.add_argument('--all', action='store_true', help='Required to purge without any filter')
+        parser.add_argument('--all-data', action='store_true',
+                            help="Delete everything of --user: also the change log, opening balances, archive and versions")
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        filters = {}
+        databases = list(dict.fromkeys(['default', *shard_aliases()]))
+        if options['user']:
+            try:
+                user = User.objects.get(username=options['user'])
+            except User.DoesNotExist:
+                raise CommandError(f"User not found: {options['user']}")
+            filters['user_id'] = user.pk
+            databases = [shard_for_user(user)]
+        if options['product']:
+            try:
+                filters['product_id'] = Product.objects.get(name=options['product']).pk
+            except Product.DoesNotExist:
+                raise CommandError(f"Product not found: {options['product']}")
+        if options['before']:
+            before = parse_datetime(options['before'])
+            if before is None:
+                raise CommandError('--before must be an ISO 8601 datetime')
+            filters['transaction_datetime__lt'] = before if timezone.is_aware(before) else timezone.make_aware(before)
+        if not filters and not options['all']:
+            raise CommandError('Refusing to delete every transaction without --all')
+        if options['all_data'] and (not options['user'] or options['product'] or options['before']):
+            raise CommandError('--all-data needs --user and cannot be combined with --product or --before')
+
+        total = 0
+        for using in databases:
+            deleted, user_ids, purchases_from = self.purge(
+                using, filters, options['batch_size'], tombstones=not options['all_data'])
+            if options['all_data']:
+                self.delete_user_data(using, filters['user_id'])
+            else:
+                self.log_cost_changes(using, purchases_from, options['batch_size'])
+            for user_id in user_ids:
+                mark_write(user_id)
+            if deleted:
+                self.stdout.write(f'{using}: deleted {deleted} transactions')
+            total += deleted
+        self.stdout.write(self.style.SUCCESS(f'Purged {total} transactions'))
+
+    def purge(self, using, filters, batch_size, tombstones):
+        """
+        Delete matching transactions in id order, one short database transaction per
+        chunk so readers and other writers get in between. Returns the number deleted,
+        the user ids touched and, per (user, product), the earliest deleted datetime
+        that moves later costs (a purchase, or under FIFO any transaction).
+        """
+        matching = Transaction.objects.using(using).filter(**filters).order_by('id')
+        user_ids = set()
+        purchases_from = {}
+        methods = {}
+        deleted = 0
+        last_id = 0
+        while True:
+            rows = list(matching.filter(id__gt=last_id).values_list(
+                'id', 'user_id', 'product_id', 'transaction_type', 'transaction_datetime'
+            )[:batch_size])
+            if not rows:
+                break
+            last_id = rows[-1][0]
+
+            methods.update(user_cost_methods({row[1] for row in rows}.difference(methods)))
+            histories = defaultdict(set)
+            for pk, user_id, product_id, transaction_type, transaction_datetime in rows:
+                histories[user_id].add(product_id)
+                key = (user_id, product_id)
+                if not engine_for(product_id, methods.get(user_id, '')).moves_later_costs(transaction_type):
+                    continue
+                if key not in purchases_from or transaction_datetime < purchases_from[key]:
+                    purchases_from[key] = transaction_datetime
+
+            ids = [row[0] for row in rows]
+            with db_transaction.atomic(using=using):
+                # Raw delete: skip the collector that loads every row and the per-row signals
+                Transaction.objects.using(using).filter(id__in=ids).raw_delete()
+                if tombstones:
+                    TransactionChange.objects.using(using).bulk_create([
+                        TransactionChange(user_id=row[1], transaction_id=row[0], operation='delete') for row in rows
+                    ])
+                # Concurrent versioned writers to these histories must retry against the new state
+                for user_id, product_ids in histories.items():
+                    HistoryVersion.objects.using(using).filter(
+                        user_id=user_id, product_id__in=product_ids
+                    ).update(version=F('version') + 1)
+            user_ids.update(histories)
+            deleted += len(ids)
+        return deleted, user_ids, purchases_from
+
+    def log_cost_changes(self, using, purchases_from, batch_size):
+        """Costs after a deleted purchase (or FIFO sale) changed: log them for sync clients"""
+        for (user_id, product_id), since in purchases_from.items():
+            affected = Transaction.objects.using(using).filter(
+                user_id=user_id, product_id=product_id, transaction_datetime__gte=since
+            ).order_by('id').values_list('id', flat=True)
+            last_id = 0
+            while ids := list(affected.filter(id__gt=last_id)[:batch_size]):
+                TransactionChange.objects.using(using).bulk_create([
+                    TransactionChange(user_id=user_id, transaction_id=pk, operation='cost') for pk in ids
+                ])
+                last_id = ids[-1]
+
+    def delete_user_data(self, using, user_id):
+        for model in (TransactionChange, OpeningBalance, ArchivedTransaction, HistoryVersion):
+            model.objects.using(using).filter(user_id=user_id).raw_delete()
@@ -0,0 +1,63 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+from transactions.models import Transaction, TransactionChange
+from transactions.rebalancing import move_user, user_databases
+from transactions.sharding import shard_aliases, shard_for_user
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        "Move users' transaction histories onto the shard they are routed to, and pin "
+        "users still placed by hash to that shard"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='Only this username (default: every user with transactions)')
+        parser.add_argument('--to', help='Pin the user to this shard alias before moving (requires --user)')
+        parser.add_argument('--dry-run', action='store_true', help='Report the moves without making them')
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        aliases = shard_aliases()
+        if options['to'] and not options['user']:
+            raise CommandError('--to requires --user')
+        if options['to'] and options['to'] not in aliases:
+            raise CommandError(f"Unknown shard {options['to']}; configured shards: {', '.join(aliases) or 'none'}")
+
+        if options['user']:
+            try:
+                users = [User.objects.get(username=options['user'])]
+            except User.DoesNotExist:
+                raise CommandError(f"User not found: {options['user']}")
+            if options['to'] and not options['dry_run']:
+                users[0].shard = options['to']
+                users[0].save(update_fields=['shard'])
+        else:
+            # Histories can sit on default (before sharding was enabled) or any shard
+            user_ids = set()
+            for alias in dict.fromkeys(['default', *aliases]):
+                for model in (Transaction, TransactionChange):
+                    user_ids.update(model.objects.using(alias).values_list('user_id', flat=True).distinct())
+            # ...and users without a pinned shard get one, histories or not
+            unpinned = Q(shard='') if aliases else Q(pk__in=[])
+            users = User.objects.filter(Q(id__in=user_ids) | unpinned).order_by('id')
+
+        moved = 0
+        for user in users:
+            target = options['to'] or shard_for_user(user)
+            if aliases and not user.shard and not options['dry_run']:
+                # Placed by hash until now: pin it, so changing the shard list leaves it where it is
+                user.shard = target
+                user.save(update_fields=['shard'])
+            for source in user_databases(user.pk):
+                if source == target:
+                    continue
+                if options['dry_run']:
+                    self.stdout.write(f'{user.username}: would move {source} -> {target}')
+                    continue
+                count = move_user(user.pk, source, target, batch_size=options['batch_size'])
+                self.stdout.write(self.style.SUCCESS(f'{user.username}: moved {count} transactions {source} -> {target}'))
+                moved += 1
+
+        self.stdout.write(f'{moved} moves')
@@ -0,0 +1,37 @@
+import sqlite3
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from transactions.replicas import replica_aliases
+
+
+class Command(BaseCommand):
+    help = 'Refresh the local SQLite read replicas with a copy of their primary'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', help='Only refresh the replicas of this primary alias')
+
+    def handle(self, *args, **options):
+        primaries = [options['database']] if options['database'] else list(settings.DATABASE_REPLICAS)
+        for primary in primaries:
+            if primary not in settings.DATABASES:
+                raise CommandError(f'Unknown database: {primary}')
+            replicas = replica_aliases(primary)
+            if not replicas:
+                continue
+            if settings.DATABASES[primary]['ENGINE'] != 'django.db.backends.sqlite3':
+                self.stdout.write(self.style.WARNING(
+                    f"{primary}: not SQLite; its replicas are kept in sync by the database's own replication"))
+                continue
+
+            # The backup API takes a consistent snapshot even while the primary is being written
+            source = sqlite3.connect(settings.DATABASES[primary]['NAME'])
+            try:
+                for replica in replicas:
+                    target = sqlite3.connect(settings.DATABASES[replica]['NAME'])
+                    try:
+                        source.backup(target)
+                    finally:
+                        target.close()
+                    self.stdout.write(self.style.SUCCESS(f'{primary} -> {replica}'))
+            finally:
+                source.close()
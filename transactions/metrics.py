@@ -0,0 +1,346 @@
+"""
+Operational metrics in the Prometheus text format, served at `/metrics`.
+
+Each worker process keeps its counters and histograms in memory (a dict update
+under a lock per observation) and writes a snapshot to its own file in
+METRICS_DIR at most every METRICS_FLUSH_SECONDS, and at least that often while
+it lives. A scrape flushes the serving process and sums every process's file.
+Files nobody wrote for METRICS_RETIRE_SECONDS belong to exited processes: the
+scrape folds them into `retired.json` and deletes them, so totals still cover
+every worker while the directory stays bounded under recycling and autoscaling.
+Deleting METRICS_DIR resets the counters.
+
+Collected:
+- requests and latency per DRF endpoint (`transaction.list`, `login`, ...),
+- database queries per request,
+- cost engine passes and the rows they priced,
+- product catalog hits and misses,
+- transaction rows per database and users bucketed by history size, written to
+  `table_stats.json` by `manage.py collect_table_stats`, off the scrape path.
+"""
+import atexit
+import json
+import os
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from pathlib import Path
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+
+try:
+    import fcntl
+except ImportError:  # Windows: concurrent scrapes are not kept from folding a file twice
+    fcntl = None
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+HISTORY_ROW_BUCKETS = (100, 1000, 10000, 100000)
+
+RETIRED = 'retired.json'
+TABLE_STATS = 'table_stats.json'
+
+METRICS = {
+    'http_requests_total': ('counter', 'Requests by endpoint, method and status'),
+    'http_request_duration_seconds': ('histogram', 'Request latency by endpoint'),
+    'db_queries_per_request': ('histogram', 'Database queries per request by endpoint'),
+    'cost_engine_runs_total': ('counter', 'Cost engine pricing passes by engine'),
+    'cost_engine_rows_total': ('counter', 'Rows priced or scanned by the cost engines, by engine'),
+    'product_catalog_hits_total': ('counter', 'Product catalog lookups served from memory'),
+    'product_catalog_misses_total': ('counter', 'Product catalog lookups that queried the database'),
+    'product_catalog_hit_ratio': ('gauge', 'Share of product catalog lookups served from memory'),
+    'transaction_rows': ('gauge', 'Live transaction rows by database'),
+    'transaction_users_by_rows': ('histogram', 'Users by number of live transaction rows, by database'),
+}
+
+
+class Registry:
+    """In-process counters and histograms, keyed by (name, sorted label pairs)"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.last_flush = 0.0
+        self.started = time.time_ns()
+        self.written = False
+        self.catalog_offset = (0, 0)
+        self.heartbeat_pid = None
+
+    def inc(self, name, labels=(), amount=1):
+        key = (name, tuple(sorted(labels)))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, labels, value, buckets):
+        key = (name, tuple(sorted(labels)))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {'buckets': list(buckets), 'counts': [0] * len(buckets), 'sum': 0, 'count': 0}
+            for index, bound in enumerate(histogram['buckets']):
+                if value <= bound:
+                    histogram['counts'][index] += 1
+                    break
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def snapshot(self):
+        from products.catalog import product_catalog
+        with self.lock:
+            counters = [[name, list(labels), value] for (name, labels), value in self.counters.items()]
+            histograms = [[name, list(labels), dict(histogram, counts=list(histogram['counts']))]
+                          for (name, labels), histogram in self.histograms.items()]
+        # The catalog counts its own hits; they are per process like everything here
+        counters.append(['product_catalog_hits_total', [], product_catalog.hits - self.catalog_offset[0]])
+        counters.append(['product_catalog_misses_total', [], product_catalog.misses - self.catalog_offset[1]])
+        return {'counters': counters, 'histograms': histograms}
+
+    def reset(self):
+        from products.catalog import product_catalog
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+            self.catalog_offset = (product_catalog.hits, product_catalog.misses)
+
+    def path(self):
+        # Start time too, so a later process reusing the pid does not overwrite these totals
+        return metrics_store() / f'process-{os.getpid()}-{self.started}.json'
+
+    def flush(self, force=False):
+        now = time.monotonic()
+        if not force and now - self.last_flush < settings.METRICS_FLUSH_SECONDS:
+            return
+        self.last_flush = now
+        path = self.path()
+        if self.written and not path.exists():
+            # A scrape retired this file while the process stalled; its totals are counted there
+            self.reset()
+        write_snapshot(path, self.snapshot())
+        self.written = True
+
+    def start_heartbeat(self):
+        """Keep flushing while idle, so only the files of exited processes go stale"""
+        if self.heartbeat_pid == os.getpid():
+            return
+        self.heartbeat_pid = os.getpid()  # after a fork the parent's thread is gone
+        threading.Thread(target=self.beat, name='metrics-heartbeat', daemon=True).start()
+
+    def beat(self):
+        while True:
+            time.sleep(settings.METRICS_FLUSH_SECONDS)
+            try:
+                self.flush(force=True)
+            except OSError:
+                pass
+
+
+registry = Registry()
+atexit.register(lambda: registry.flush(force=True))
+
+
+def metrics_store():
+    directory = Path(settings.METRICS_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    return directory
+
+
+def record_cost_run(engine, rows):
+    registry.inc('cost_engine_runs_total', [('engine', engine)])
+    registry.inc('cost_engine_rows_total', [('engine', engine)], rows)
+
+
+def endpoint_for(request):
+    """
+    `<basename>.<action>` for ViewSets, the URL name for other DRF views (as in
+    transactions.throttling), or None for everything else (admin, this endpoint).
+    """
+    match = getattr(request, 'resolver_match', None)
+    if match is None or getattr(match.func, 'cls', None) is None:
+        return None
+    actions = getattr(match.func, 'actions', None)
+    if actions:
+        basename = match.func.initkwargs.get('basename')
+        return f"{basename}.{actions.get(request.method.lower(), 'not_allowed')}"
+    return match.url_name or match.func.cls.__name__
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class MetricsMiddleware:
+    """Records the request count, latency and query count of DRF endpoints"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        counter = QueryCounter()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all(initialized_only=False):
+                stack.enter_context(connection.execute_wrapper(counter))
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - start
+
+        endpoint = endpoint_for(request)
+        if endpoint is not None:
+            registry.inc('http_requests_total', [
+                ('endpoint', endpoint), ('method', request.method), ('status', str(response.status_code))
+            ])
+            registry.observe('http_request_duration_seconds', [('endpoint', endpoint)], elapsed, LATENCY_BUCKETS)
+            registry.observe('db_queries_per_request', [('endpoint', endpoint)], counter.count, QUERY_BUCKETS)
+        registry.start_heartbeat()
+        registry.flush()
+        return response
+
+
+def read_snapshot(path):
+    try:
+        return json.loads(path.read_text())
+    except (OSError, ValueError):  # removed, replaced or half-written meanwhile
+        return None
+
+
+def write_snapshot(path, snapshot):
+    temporary = path.parent / f'{path.name}.{os.getpid()}.{threading.get_ident()}.tmp'
+    temporary.write_text(json.dumps(snapshot))
+    os.replace(temporary, path)
+
+
+def merge(totals, snapshot):
+    """Add a snapshot's counters and histograms to `totals`: {name: {labels: value or histogram}}"""
+    for name, labels, value in snapshot['counters']:
+        series = totals.setdefault(name, {})
+        key = tuple(tuple(pair) for pair in labels)
+        series[key] = series.get(key, 0) + value
+    for name, labels, histogram in snapshot['histograms']:
+        series = totals.setdefault(name, {})
+        key = tuple(tuple(pair) for pair in labels)
+        total = series.get(key)
+        if total is None:
+            series[key] = dict(histogram, counts=list(histogram['counts']))
+        else:
+            total['counts'] = [a + b for a, b in zip(total['counts'], histogram['counts'])]
+            total['sum'] += histogram['sum']
+            total['count'] += histogram['count']
+    return totals
+
+
+def as_snapshot(totals):
+    snapshot = {'counters': [], 'histograms': []}
+    for name, series in totals.items():
+        for labels, value in series.items():
+            kind = 'histograms' if isinstance(value, dict) else 'counters'
+            snapshot[kind].append([name, [list(pair) for pair in labels], value])
+    return snapshot
+
+
+@contextmanager
+def store_lock(directory):
+    if fcntl is None:
+        yield
+        return
+    with open(directory / '.lock', 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def retire_stale(directory):
+    """
+    Fold the files of processes that stopped flushing into RETIRED and delete them.
+    RETIRED lists the files it last folded, so a fold interrupted before the deletes
+    does not count them twice. Returns the retired snapshot.
+    """
+    with store_lock(directory):
+        retired = read_snapshot(directory / RETIRED) or {'counters': [], 'histograms': [], 'folded': []}
+        cutoff = time.time() - settings.METRICS_RETIRE_SECONDS
+        stale = []
+        for path in directory.glob('process-*.json'):
+            try:
+                if path.stat().st_mtime < cutoff:
+                    stale.append(path)
+            except FileNotFoundError:
+                continue
+        fresh = [path for path in stale if path.name not in retired['folded']]
+        if fresh:
+            totals = merge({}, retired)
+            for path in fresh:
+                snapshot = read_snapshot(path)
+                if snapshot is not None:
+                    merge(totals, snapshot)
+            retired = dict(as_snapshot(totals), folded=[path.name for path in fresh])
+            write_snapshot(directory / RETIRED, retired)
+        for path in stale:
+            path.unlink(missing_ok=True)
+    return retired
+
+
+def collect():
+    """Sum the retired totals and the snapshots of live processes: {name: {labels: value or histogram}}"""
+    registry.flush(force=True)
+    directory = metrics_store()
+    totals = merge({}, retire_stale(directory))
+    for path in directory.glob('process-*.json'):
+        snapshot = read_snapshot(path)
+        if snapshot is not None:
+            merge(totals, snapshot)
+
+    hits = sum(totals.get('product_catalog_hits_total', {}).values())
+    misses = sum(totals.get('product_catalog_misses_total', {}).values())
+    if hits + misses:
+        totals['product_catalog_hit_ratio'] = {(): hits / (hits + misses)}
+    table_stats = read_snapshot(directory / TABLE_STATS)
+    if table_stats is not None:
+        merge(totals, table_stats)
+    return totals
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in pairs) + '}'
+
+
+def render(totals):
+    lines = []
+    for name, (metric_type, description) in METRICS.items():
+        series = totals.get(name)
+        if not series:
+            continue
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} {metric_type}')
+        for labels, value in sorted(series.items()):
+            if metric_type != 'histogram':
+                lines.append(f'{name}{format_labels(labels)} {value}')
+                continue
+            cumulative = 0
+            for bound, count in zip(value['buckets'], value['counts']):
+                cumulative += count
+                lines.append(f'{name}_bucket{format_labels(labels, [("le", bound)])} {cumulative}')
+            lines.append(f'{name}_bucket{format_labels(labels, [("le", "+Inf")])} {value["count"]}')
+            lines.append(f'{name}_sum{format_labels(labels)} {value["sum"]}')
+            lines.append(f'{name}_count{format_labels(labels)} {value["count"]}')
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    """Prometheus scrape endpoint, open to METRICS_ALLOWED_IPS only"""
+    if request.META.get('REMOTE_ADDR') not in settings.METRICS_ALLOWED_IPS:
+        return HttpResponseForbidden('Forbidden\n', content_type='text/plain')
+    return HttpResponse(render(collect()), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,45 @@
+# Generated by Django 6.0.2 on 2026-10-19 16:03
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_changes(apps, schema_editor):
+    """Log existing transactions as creates so a sync from cursor 0 sees the full history"""
+    Transaction = apps.get_model('transactions', 'Transaction')
+    TransactionChange = apps.get_model('transactions', 'TransactionChange')
+    rows = Transaction.objects.order_by('id').values_list('id', 'user_id')
+    batch = []
+    for transaction_id, user_id in rows.iterator(chunk_size=5000):
+        batch.append(TransactionChange(user_id=user_id, transaction_id=transaction_id, operation='create'))
+        if len(batch) >= 5000:
+            TransactionChange.objects.bulk_create(batch)
+            batch = []
+    TransactionChange.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0003_remove_transaction_cost'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TransactionChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('transaction_id', models.BigIntegerField()),
+                ('operation', models.CharField(choices=[('create', 'Create'), ('update', 'Update'), ('delete', 'Delete'), ('cost', 'Cost change')], max_length=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='transaction_changes', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['user', 'id'], name='transaction_user_id_0d2c13_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_changes, migrations.RunPython.noop),
+    ]
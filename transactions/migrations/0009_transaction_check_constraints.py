@@ -0,0 +1,70 @@
+# Generated by Django 6.0.2 on 2026-10-19 17:00
+
+import django.db.models.expressions
+import django.db.models.functions.math
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F
+from django.db.models.functions import Round
+
+
+def fix_stale_total_prices(apps, schema_editor):
+    """
+    Saves used to keep total_price when the quantity or unit price changed. Recompute
+    it before the constraint is added, and log the fix for sync clients: an update for
+    each corrected row and a cost change for its history from that row on.
+    """
+    using = schema_editor.connection.alias
+    Transaction = apps.get_model('transactions', 'Transaction')
+    TransactionChange = apps.get_model('transactions', 'TransactionChange')
+    expected = Round(F('quantity') * F('unit_price'), 2)
+    stale = Transaction.objects.using(using).exclude(total_price=expected)
+    fixed = list(stale.values_list('id', 'user_id', 'product_id', 'transaction_datetime'))
+    if not fixed:
+        return
+    Transaction.objects.using(using).filter(id__in=[row[0] for row in fixed]).update(total_price=expected)
+
+    TransactionChange.objects.using(using).bulk_create([
+        TransactionChange(user_id=user_id, transaction_id=pk, operation='update') for pk, user_id, _, _ in fixed
+    ], batch_size=5000)
+    starts = {}
+    for _, user_id, product_id, transaction_datetime in fixed:
+        key = (user_id, product_id)
+        if key not in starts or transaction_datetime < starts[key]:
+            starts[key] = transaction_datetime
+    for (user_id, product_id), since in starts.items():
+        later = Transaction.objects.using(using).filter(
+            user_id=user_id, product_id=product_id, transaction_datetime__gte=since
+        ).values_list('id', flat=True)
+        TransactionChange.objects.using(using).bulk_create([
+            TransactionChange(user_id=user_id, transaction_id=pk, operation='cost') for pk in later
+        ], batch_size=5000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0002_product_cost_method'),
+        ('transactions', '0008_history_version'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(fix_stale_total_prices, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='transaction',
+            constraint=models.CheckConstraint(condition=models.Q(('quantity__gt', 0)), name='transaction_quantity_positive'),
+        ),
+        migrations.AddConstraint(
+            model_name='transaction',
+            constraint=models.CheckConstraint(condition=models.Q(('unit_price__gt', 0)), name='transaction_unit_price_positive'),
+        ),
+        migrations.AddConstraint(
+            model_name='transaction',
+            constraint=models.CheckConstraint(condition=models.Q(('total_price', django.db.models.functions.math.Round(django.db.models.expressions.CombinedExpression(models.F('quantity'), '*', models.F('unit_price')), 2))), name='transaction_total_price_matches'),
+        ),
+        migrations.AddConstraint(
+            model_name='transaction',
+            constraint=models.CheckConstraint(condition=models.Q(('transaction_type__in', ['purchase', 'sale'])), name='transaction_type_valid'),
+        ),
+    ]
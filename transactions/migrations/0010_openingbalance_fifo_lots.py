@@ -0,0 +1,73 @@
+# Generated by Django 6.0.2 on 2026-10-19 18:10
+
+from collections import deque
+from itertools import groupby
+
+from django.db import migrations, models
+
+
+def replay_fifo_lots(archived):
+    """
+    The purchase lots a closed history leaves open, in the OpeningBalance.fifo_lots
+    format, from its (transaction_type, quantity, total_price, transaction_datetime)
+    rows in order. Purchases open [units, unit cost] lots before the sales of the same
+    datetime take from the oldest ones. Kept here rather than imported from
+    transactions.costing so this migration does not change with that code.
+    """
+    lots = deque()
+    last_unit_cost = None
+    for _, group in groupby(archived, key=lambda row: row[3]):
+        group = list(group)
+        for transaction_type, quantity, total_price, _ in group:
+            if transaction_type == 'purchase' and quantity:
+                last_unit_cost = total_price / quantity
+                lots.append([quantity, last_unit_cost])
+        for transaction_type, quantity, _, _ in group:
+            if transaction_type == 'purchase':
+                continue
+            while quantity and lots:
+                taken = min(quantity, lots[0][0])
+                quantity -= taken
+                if taken == lots[0][0]:
+                    lots.popleft()
+                else:
+                    lots[0][0] -= taken
+    return {
+        'lots': [[units, str(unit_cost)] for units, unit_cost in lots],
+        'last_unit_cost': None if last_unit_cost is None else str(last_unit_cost),
+    }
+
+
+def store_fifo_lots(apps, schema_editor):
+    """
+    FIFO costs used to replay the whole archive of a history on every request.
+    Store the lots each closed period left open on its balance, as close_period
+    now does, so they start from there.
+    """
+    using = schema_editor.connection.alias
+    OpeningBalance = apps.get_model('transactions', 'OpeningBalance')
+    ArchivedTransaction = apps.get_model('transactions', 'ArchivedTransaction')
+    for balance in list(OpeningBalance.objects.using(using).all()):
+        archived = ArchivedTransaction.objects.using(using).filter(
+            user_id=balance.user_id, product_id=balance.product_id
+        ).order_by('transaction_datetime', 'original_id').values_list(
+            'transaction_type', 'quantity', 'total_price', 'transaction_datetime'
+        )
+        balance.fifo_lots = replay_fifo_lots(archived.iterator())
+        balance.save(update_fields=['fifo_lots'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0009_transaction_check_constraints'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='openingbalance',
+            name='fifo_lots',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.RunPython(store_fifo_lots, migrations.RunPython.noop),
+    ]
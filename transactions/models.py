@@ -1,9 +1,33 @@
-from django.db import models
+from django.db import models, router
+from django.db.models import F, Q
+from django.db.models.functions import Round
 from django.core.exceptions import ValidationError
 from django.utils import timezone
-from decimal import Decimal
 from users.models import User
 from products.models import Product
+from transactions.sharding import shard_for_user
+
+
+class ShardedQuerySet(models.QuerySet):
+    def for_user(self, user, replica=False):
+        """
+        Rows belonging to `user` (a User or id), read from the user's shard. With
+        `replica`, reads may be served by a replica of it; only use that for reads.
+        """
+        alias = shard_for_user(user)
+        if replica:
+            user_id = user if isinstance(user, int) else user.pk
+            alias = router.db_for_read(self.model, replica_of=alias, user_id=user_id)
+        return self.using(alias).filter(user=user)
+
+    def raw_delete(self):
+        """
+        Delete the rows in one DELETE, without the delete collector, cascades or
+        pre/post_delete signals, so callers log their own changes. Returns the row count.
+        QuerySet._raw_delete is private Django API; this is its only caller, checked
+        against Django 5.2 (`_raw_delete(using)`, returning the row count).
+        """
+        return self._raw_delete(self.db)
 
 
 class Transaction(models.Model):
@@ -13,62 +37,194 @@ class Transaction(models.Model):
         ('sale', 'Sale'),
     ]
 
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='transactions')
+    # No database-level FK constraints: with sharding, users and products live on another database
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='transactions', db_constraint=False)
     transaction_type = models.CharField(max_length=10, choices=TRANSACTION_TYPE_CHOICES)
-    product = models.ForeignKey(Product, on_delete=models.PROTECT, related_name='transactions')
+    product = models.ForeignKey(Product, on_delete=models.PROTECT, related_name='transactions', db_constraint=False)
     quantity = models.PositiveIntegerField()
     unit_price = models.DecimalField(max_digits=10, decimal_places=2)
     total_price = models.DecimalField(max_digits=12, decimal_places=2, default=0)
     transaction_datetime = models.DateTimeField()
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = ShardedQuerySet.as_manager()
+
     class Meta:
         ordering = ['transaction_datetime']
         indexes = [
             models.Index(fields=['user', 'transaction_datetime']),
             models.Index(fields=['transaction_type', 'transaction_datetime']),
+            # Admin changelist ordering and period filters across all users
+            models.Index(fields=['transaction_datetime']),
+        ]
+        # The write path relies on these instead of running full_clean on every save
+        constraints = [
+            models.CheckConstraint(condition=Q(quantity__gt=0), name='transaction_quantity_positive'),
+            models.CheckConstraint(condition=Q(unit_price__gt=0), name='transaction_unit_price_positive'),
+            # Rounded because SQLite multiplies decimals as floats
+            models.CheckConstraint(
+                condition=Q(total_price=Round(F('quantity') * F('unit_price'), 2)),
+                name='transaction_total_price_matches'
+            ),
+            models.CheckConstraint(
+                condition=Q(transaction_type__in=['purchase', 'sale']), name='transaction_type_valid'
+            ),
         ]
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.remember_loaded_state()
+        return instance
+
+    def remember_loaded_state(self):
+        """Keep the stored costing state so signal handlers can tell which history suffix a save moved"""
+        self._loaded_state = (self.transaction_type, self.product_id, self.transaction_datetime)
+
+    def shard_alias(self):
+        """Database this transaction is (or will be) stored in"""
+        return self._state.db or router.db_for_write(Transaction, instance=self)
+
     def clean(self):
-        """Validate transaction constraints"""
+        """
+        Validate transaction constraints. Only ModelForms (the admin) run this: the API
+        serializers check the same rules, and save() leaves the rest to the database.
+        """
         # Check date sequence (no transactions after now)
         if self.transaction_datetime > timezone.now():
             raise ValidationError("Transaction datetime cannot be in the future.")
+        # Check the period is still open
+        if OpeningBalance.is_closed(self.user_id, self.product_id, self.transaction_datetime, using=self.shard_alias()):
+            raise ValidationError("Transaction datetime falls in a closed period.")
 
     def save(self, *args, **kwargs):
-        self.full_clean()
-        # Calculate total price if not set
-        if not self.total_price:
-            self.total_price = self.quantity * self.unit_price
+        # Always derived, so a changed quantity or unit price cannot leave it stale
+        self.total_price = self.quantity * self.unit_price
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'quantity', 'unit_price'}.intersection(update_fields):
+            kwargs['update_fields'] = {*update_fields, 'total_price'}
         super().save(*args, **kwargs)
 
     def calculate_cost(self):
         """
-        Calculate average cost per unit at the moment of the transaction.
-        For purchases: Average cost = Total cost of all purchases including this one / Total units including this one
-        For sales: Cost of unit sold = Average cost per unit * Quantity sold
+        Cost of this transaction under its history's cost engine, computed from
+        scratch (see transactions.costing for the engines and how one is chosen).
         """
-        # Get all purchases of this product by the user before or on this transaction datetime
-        purchases = Transaction.objects.filter(
-            user=self.user,
-            product=self.product,
-            transaction_type='purchase',
-            transaction_datetime__lte=self.transaction_datetime
-        )
-
-        # Calculate total cost and total units of all purchases up to this point
-        total_purchase_cost = Decimal('0.00')
-        total_units = 0
-        for purchase in purchases:
-            total_purchase_cost += purchase.total_price
-            total_units += purchase.quantity
-
-        if total_units == 0:
-            return Decimal('0.00')
-
-        average_cost_per_unit = total_purchase_cost / Decimal(total_units)
-
-        if self.transaction_type == 'purchase':
-            return round(average_cost_per_unit, 2)
-        else:
-            return round(average_cost_per_unit * self.quantity, 2)
+        from transactions.costing import engine_for
+        return engine_for(self.product_id, self.user.cost_method).transaction_cost(self)
+
+
+class TransactionChange(models.Model):
+    """Append-only change log read by incremental sync clients through a cursor (the id)"""
+    OPERATION_CHOICES = [
+        ('create', 'Create'),
+        ('update', 'Update'),
+        ('delete', 'Delete'),
+        ('cost', 'Cost change'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='transaction_changes', db_constraint=False)
+    # Not a ForeignKey: entries must outlive the deleted transaction as tombstones
+    transaction_id = models.BigIntegerField()
+    operation = models.CharField(max_length=10, choices=OPERATION_CHOICES)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = ShardedQuerySet.as_manager()
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['user', 'id']),
+        ]
+
+    def __str__(self):
+        return f'{self.operation} #{self.transaction_id}'
+
+
+class HistoryVersion(models.Model):
+    """
+    Optimistic version of one (user, product) history. Every write to the history
+    advances it with a compare-and-set (see transactions.concurrency), so writers to
+    the same history conflict and retry while writers to different ones never meet.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='history_versions', db_constraint=False)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='history_versions', db_constraint=False)
+    version = models.PositiveBigIntegerField(default=0)
+
+    objects = ShardedQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'product'], name='unique_history_version'),
+        ]
+
+    def __str__(self):
+        return f'{self.user} / {self.product} v{self.version}'
+
+
+class OpeningBalance(models.Model):
+    """
+    Cumulative purchases of a closed period for one (user, product), and the FIFO
+    lots still open at its end. Transactions before closing_datetime are archived
+    and costs start from these totals (WAC) or lots (FIFO).
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='opening_balances', db_constraint=False)
+    product = models.ForeignKey(Product, on_delete=models.PROTECT, related_name='opening_balances', db_constraint=False)
+    closing_datetime = models.DateTimeField()
+    purchase_units = models.PositiveBigIntegerField(default=0)
+    purchase_cost = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    # transactions.costing.FifoLots.as_json(): the lots and unit costs kept exactly, as strings
+    fifo_lots = models.JSONField(default=dict, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = ShardedQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'product'], name='unique_opening_balance'),
+        ]
+
+    def __str__(self):
+        return f'{self.user} / {self.product} closed before {self.closing_datetime}'
+
+    @classmethod
+    def is_closed(cls, user_id, product_id, transaction_datetime, using='default'):
+        return cls.objects.using(using).filter(
+            user_id=user_id,
+            product_id=product_id,
+            closing_datetime__gt=transaction_datetime
+        ).exists()
+
+    @classmethod
+    def totals_for(cls, user_id, product_ids=None, using='default'):
+        """Map product_id to (purchase_cost, purchase_units) for the user's closed periods"""
+        balances = cls.objects.using(using).filter(user_id=user_id)
+        if product_ids is not None:
+            balances = balances.filter(product_id__in=product_ids)
+        return {
+            product_id: (purchase_cost, purchase_units)
+            for product_id, purchase_cost, purchase_units
+            in balances.values_list('product_id', 'purchase_cost', 'purchase_units')
+        }
+
+
+class ArchivedTransaction(models.Model):
+    """Transaction moved out of the live table by a period close"""
+    original_id = models.BigIntegerField()
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_transactions', db_constraint=False)
+    transaction_type = models.CharField(max_length=10, choices=Transaction.TRANSACTION_TYPE_CHOICES)
+    product = models.ForeignKey(Product, on_delete=models.PROTECT, related_name='archived_transactions', db_constraint=False)
+    quantity = models.PositiveIntegerField()
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2)
+    total_price = models.DecimalField(max_digits=12, decimal_places=2)
+    transaction_datetime = models.DateTimeField()
+    created_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    objects = ShardedQuerySet.as_manager()
+
+    class Meta:
+        ordering = ['transaction_datetime']
+        indexes = [
+            models.Index(fields=['user', 'product', 'transaction_datetime']),
+        ]
@@ -0,0 +1,85 @@
+"""
+Client helper for the MessagePack transaction API.
+
+Request with `Accept: application/msgpack` (add `?columnar=1` for one array per
+field) and pass the response body to `decode`. It only needs `msgpack`, not Django.
+"""
+from datetime import datetime, timedelta, timezone
+
+import msgpack
+
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+ROW_KEYS = ('transactions', 'purchases', 'sales', 'transaction', 'changes', 'affected_costs')
+CENT_FIELDS = ('unit_price', 'total_price')
+COST_FIELDS = ('cost', 'cost_before', 'cost_after')
+DATETIME_FIELDS = ('transaction_datetime', 'created_at')
+
+
+def decode(content, as_json=True, tz=None):
+    """
+    Unpack a MessagePack response body. With `as_json`, compact transaction rows and
+    cost entries are converted back to the JSON representation (decimal strings,
+    float costs, ISO datetimes in `tz`). `tz` defaults to Django's current time zone
+    when Django is configured, as the JSON renderer uses, and to UTC otherwise.
+    """
+    data = msgpack.unpackb(content, raw=False)
+    if not as_json or not isinstance(data, dict):
+        return data
+
+    tz = tz or active_timezone()
+    if 'id' in data and 'cost' in data:
+        return entry_to_json(data, tz)
+    for key in ROW_KEYS:
+        if key not in data:
+            continue
+        value = data[key]
+        if isinstance(value, dict) and 'id' in value and isinstance(value['id'], list):
+            value = columns_to_rows(value)
+        if isinstance(value, list):
+            data[key] = [entry_to_json(entry, tz) for entry in value]
+        elif isinstance(value, dict):
+            data[key] = entry_to_json(value, tz)
+    return data
+
+
+def active_timezone():
+    try:
+        from django.conf import settings
+        from django.utils import timezone as django_timezone
+    except ImportError:
+        return timezone.utc
+    if not settings.configured or not settings.USE_TZ:
+        return timezone.utc
+    return django_timezone.get_current_timezone()
+
+
+def columns_to_rows(columns):
+    """Turn a columnar payload ({field: [values]}) into a list of row dicts"""
+    fields = list(columns)
+    return [dict(zip(fields, values)) for values in zip(*(columns[field] for field in fields))]
+
+
+def entry_to_json(entry, tz):
+    """A transaction row, or an `{id, cost...}` entry (affected costs, previews)"""
+    entry = dict(entry)
+    if all(field in entry for field in CENT_FIELDS + DATETIME_FIELDS):
+        for field in CENT_FIELDS:
+            entry[field] = cents_to_string(entry[field])
+        for field in DATETIME_FIELDS:
+            entry[field] = epoch_us_to_iso(entry[field], tz)
+    for field in COST_FIELDS:
+        if entry.get(field) is not None:
+            entry[field] = entry[field] / 100
+    return entry
+
+
+def cents_to_string(cents):
+    return f'{cents // 100}.{cents % 100:02d}'
+
+
+def epoch_us_to_iso(microseconds, tz=timezone.utc):
+    value = (EPOCH + timedelta(microseconds=microseconds)).astimezone(tz).isoformat()
+    if value.endswith('+00:00'):
+        value = value[:-6] + 'Z'
+    return value
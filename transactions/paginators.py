@@ -0,0 +1,55 @@
+from django.core.paginator import Paginator
+from django.db import DatabaseError, connections
+from django.utils.functional import cached_property
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that avoids an exact COUNT(*) over large tables.
+    Unfiltered querysets use the database's table statistics once they exceed
+    `count_limit` rows; below that, and for filtered ones, rows are counted up to
+    `count_limit`, which is enough to page through. `count_qualifier` says when
+    the count is not exact ('about' an estimate, 'at least' a capped count).
+    """
+    count_limit = 10000
+    count_qualifier = ''
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = self.estimate_table_rows(queryset)
+            if estimate is not None and estimate > self.count_limit:
+                self.count_qualifier = 'about'
+                return estimate
+        count = queryset.order_by()[:self.count_limit].count()
+        if count == self.count_limit:
+            self.count_qualifier = 'at least'
+        return count
+
+    def estimate_table_rows(self, queryset):
+        model = queryset.model
+        connection = connections[queryset.db]
+        table = model._meta.db_table
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE relname = %s', [table])
+                row = cursor.fetchone()
+                if row and row[0] > 0:
+                    return row[0]
+                return None
+            if connection.vendor == 'sqlite':
+                # Primary keys are AUTOINCREMENT, so the largest id bounds the row count: a
+                # small table is counted exactly. Deletes make it overshoot, so prefer the
+                # row count ANALYZE stored, when there is one.
+                cursor.execute(f'SELECT MAX("{model._meta.pk.column}") FROM "{table}"')
+                bound = cursor.fetchone()[0] or 0
+                if bound <= self.count_limit:
+                    return bound
+                try:
+                    cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1', [table])
+                    row = cursor.fetchone()
+                except DatabaseError:  # never analyzed
+                    row = None
+                return int(row[0].split()[0]) if row else bound
+        return None
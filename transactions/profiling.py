@@ -0,0 +1,171 @@
+"""
+On-demand profiling of single requests.
+
+A staff user sends `X-Profile: pstats` (deterministic, cProfile) or
+`X-Profile: collapsed` (sampled stacks, flamegraph-ready), or `?profile=...`.
+The request runs under the profiler, including rendering, and the result is
+saved to PROFILE_DIR. The file name is returned in the `X-Profile-Id` header.
+The store is pruned to PROFILE_MAX_FILES, PROFILE_MAX_BYTES and
+PROFILE_MAX_AGE_SECONDS after every save. One request per process is profiled
+at a time; others asking meanwhile run unprofiled. Requests without the trigger
+only pay for the header lookup.
+"""
+import cProfile
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from django.conf import settings
+from django.utils import timezone
+
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+PROFILE_FORMATS = {'pstats': '.prof', 'collapsed': '.collapsed'}
+# cProfile cannot run twice at once in a process (and profiles every thread on 3.12+)
+PROFILE_LOCK = threading.Lock()
+
+
+def requested_format(request):
+    value = request.META.get(PROFILE_HEADER)
+    if not value and 'profile=' in request.META.get('QUERY_STRING', ''):
+        value = request.GET.get('profile')
+    if not value:
+        return None
+    value = value.lower()
+    if value in PROFILE_FORMATS:
+        return value
+    return 'pstats' if value in ('1', 'true') else None
+
+
+def profiling_user(request):
+    """The staff user allowed to profile this request, or None"""
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return user if user.is_staff else None
+
+    # API requests authenticate in DRF, after middleware; check the JWT here
+    from rest_framework.exceptions import AuthenticationFailed
+    from rest_framework_simplejwt.authentication import JWTAuthentication
+    try:
+        authenticated = JWTAuthentication().authenticate(request)
+    except AuthenticationFailed:
+        return None
+    if authenticated is None or not authenticated[0].is_staff:
+        return None
+    return authenticated[0]
+
+
+class StackSampler:
+    """Samples one thread's stack every `interval` seconds into collapsed-stack counts"""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{frame.f_globals.get('__name__', '?')}:{code.co_name}:{frame.f_lineno}")
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def dump(self, path):
+        with open(path, 'w') as output:
+            for stack, count in self.stacks.most_common():
+                output.write(f'{stack} {count}\n')
+
+
+def profile_store():
+    directory = Path(settings.PROFILE_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    return directory
+
+
+def prune_profiles(directory):
+    """Drop expired profiles, then the oldest ones until the count and size limits hold"""
+    profiles = []
+    for path in directory.iterdir():
+        if path.suffix not in PROFILE_FORMATS.values():
+            continue
+        try:
+            stat = path.stat()
+        except FileNotFoundError:  # pruned by another worker
+            continue
+        profiles.append((stat.st_mtime, stat.st_size, path))
+    profiles.sort()
+
+    expired_before = time.time() - settings.PROFILE_MAX_AGE_SECONDS
+    total_bytes = sum(size for _, size, _ in profiles)
+    while profiles and (
+        len(profiles) > settings.PROFILE_MAX_FILES
+        or total_bytes > settings.PROFILE_MAX_BYTES
+        or profiles[0][0] < expired_before
+    ):
+        _, size, path = profiles.pop(0)
+        total_bytes -= size
+        path.unlink(missing_ok=True)
+
+
+def profile_name(request, user, profile_format):
+    path = re.sub(r'[^A-Za-z0-9]+', '-', request.path).strip('-') or 'root'
+    stamp = timezone.now().strftime('%Y%m%dT%H%M%S%f')
+    return f'{stamp}-{user.pk}-{request.method}-{path[:80]}{PROFILE_FORMATS[profile_format]}'
+
+
+class RequestProfilerMiddleware:
+    """Profiles one request when a staff user asks for it (see module docstring)"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        profile_format = requested_format(request)
+        if profile_format is None:
+            return self.get_response(request)
+        user = profiling_user(request)
+        if user is None or not PROFILE_LOCK.acquire(blocking=False):
+            return self.get_response(request)
+        try:
+            return self.profile(request, user, profile_format)
+        finally:
+            PROFILE_LOCK.release()
+
+    def profile(self, request, user, profile_format):
+        if profile_format == 'pstats':
+            profiler = cProfile.Profile()
+            profiler.enable()
+        else:
+            profiler = StackSampler(threading.get_ident(), settings.PROFILE_SAMPLE_INTERVAL)
+            profiler.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            if profile_format == 'pstats':
+                profiler.disable()
+            else:
+                profiler.stop()
+
+        directory = profile_store()
+        name = profile_name(request, user, profile_format)
+        if profile_format == 'pstats':
+            profiler.dump_stats(directory / name)
+        else:
+            profiler.dump(directory / name)
+        prune_profiles(directory)
+        response['X-Profile-Id'] = name
+        return response
@@ -0,0 +1,99 @@
+import json
+from collections import Counter
+from django.db import transaction as db_transaction
+from django.db.models import Case, DateTimeField, Value, When
+from transactions.models import ArchivedTransaction, HistoryVersion, OpeningBalance, Transaction, TransactionChange
+from transactions.replicas import mark_write
+from transactions.sharding import shard_aliases
+
+# Version rows are not copied; the target starts them afresh on the next write
+SHARDED_MODELS = (Transaction, TransactionChange, OpeningBalance, ArchivedTransaction, HistoryVersion)
+
+# Fields set by auto_now/auto_now_add, which bulk_create would overwrite with the move time
+PRESERVED_TIMESTAMPS = {
+    Transaction: 'created_at',
+    OpeningBalance: 'updated_at',
+    ArchivedTransaction: 'archived_at',
+}
+
+
+def user_databases(user_id):
+    """Aliases currently holding any transactions-app rows of `user_id`"""
+    return [
+        alias for alias in dict.fromkeys(['default', *shard_aliases()])
+        if any(model.objects.using(alias).filter(user_id=user_id).exists() for model in SHARDED_MODELS)
+    ]
+
+
+def row_key(instance, fields):
+    """The row's values apart from its id, which a copy keeps (timestamps included)"""
+    return json.dumps([getattr(instance, field.attname) for field in fields], default=repr)
+
+
+def copy_rows(model, source, target, user_id, batch_size):
+    """
+    Copy the user's rows of `model` to `target` under new ids, skipping rows an
+    interrupted earlier move already copied; returns the new ids in old-id order
+    """
+    fields = [field for field in model._meta.concrete_fields if not field.primary_key]
+    timestamp = PRESERVED_TIMESTAMPS.get(model)
+    rows = model.objects.using(source).filter(user_id=user_id).order_by('id')
+    copied = Counter(
+        row_key(instance, fields) for instance in model.objects.using(target).filter(user_id=user_id).iterator()
+    )
+
+    new_ids = []
+    last_id = 0
+    while True:
+        batch = list(rows.filter(id__gt=last_id)[:batch_size])
+        if not batch:
+            break
+        last_id = batch[-1].pk
+        pending = []
+        for instance in batch:
+            key = row_key(instance, fields)
+            if copied[key]:
+                copied[key] -= 1
+            else:
+                pending.append(instance)
+        if not pending:
+            continue
+        timestamps = [getattr(instance, timestamp) for instance in pending] if timestamp else None
+        copies = model.objects.using(target).bulk_create([
+            model(**{field.attname: getattr(instance, field.attname) for field in fields}) for instance in pending
+        ])
+        ids = [copy.pk for copy in copies]
+        if timestamp:
+            model.objects.using(target).filter(id__in=ids).update(**{timestamp: Case(
+                *[When(id=pk, then=Value(value)) for pk, value in zip(ids, timestamps)],
+                output_field=DateTimeField()
+            )})
+        new_ids.extend(ids)
+    return new_ids
+
+
+def move_user(user_id, source, target, batch_size=2000):
+    """
+    Move the user's transactions, opening balances and archive from `source` to
+    `target`. Rows get new ids on the target; the change log is not copied but
+    restarted with a 'create' entry per transaction, and sync clients see a
+    cursor reset. Returns the number of transactions moved.
+
+    The target commits before the source is cleared, so a failure in between
+    leaves a copy on both databases rather than losing history. Running the move
+    again then completes it: rows the target already holds with identical values
+    are not copied twice. Writes for the user during a move are not locked out;
+    run it while the user is idle.
+    """
+    with db_transaction.atomic(using=source), db_transaction.atomic(using=target):
+        transaction_ids = copy_rows(Transaction, source, target, user_id, batch_size)
+        copy_rows(OpeningBalance, source, target, user_id, batch_size)
+        copy_rows(ArchivedTransaction, source, target, user_id, batch_size)
+        TransactionChange.objects.using(target).bulk_create([
+            TransactionChange(user_id=user_id, transaction_id=pk, operation='create') for pk in transaction_ids
+        ], batch_size=batch_size)
+
+        for model in SHARDED_MODELS:
+            model.objects.using(source).filter(user_id=user_id).raw_delete()
+    mark_write(user_id)
+    return len(transaction_ids)
@@ -0,0 +1,89 @@
+import datetime
+import decimal
+from django.utils.functional import Promise
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.settings import api_settings
+from rest_framework.utils import encoders
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer that encodes with orjson when it is installed.
+    Output is byte-for-byte the same as JSONRenderer; anything orjson cannot
+    reproduce exactly (indentation, non-default JSON settings) uses the stdlib path.
+    """
+    encoder = encoders.JSONEncoder()
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+
+        indent = self.get_indent(accepted_media_type, renderer_context or {})
+        if orjson is None or indent is not None or self.ensure_ascii or not self.compact:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            ret = orjson.dumps(
+                data,
+                default=self.encoder.default,
+                option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME,
+            )
+        except (orjson.JSONEncodeError, TypeError):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        # Match JSONRenderer, which always escapes \u2028 and \u2029
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
+
+
+class MessagePackRenderer(BaseRenderer):
+    """
+    Renders to MessagePack. Transaction payloads use the compact schema from
+    TransactionRowEncoder; anything else is packed as-is.
+    """
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, use_bin_type=True, default=self.default)
+
+    def default(self, obj):
+        if isinstance(obj, datetime.datetime):
+            return obj.isoformat()
+        if isinstance(obj, (decimal.Decimal, Promise)):
+            return str(obj)
+        raise TypeError(f'Cannot pack {type(obj).__name__}')
+
+
+def transaction_renderers():
+    """
+    DEFAULT_RENDERER_CLASSES with JSON rendered by FastJSONRenderer, plus MessagePack
+    when the optional dependency is installed. Following the setting keeps the
+    transactions endpoints negotiating like every other view (e.g. no HTML in
+    config.settings_api).
+    """
+    renderers = [
+        FastJSONRenderer if renderer is JSONRenderer else renderer
+        for renderer in api_settings.DEFAULT_RENDERER_CLASSES
+    ]
+    if msgpack is not None:
+        renderers.append(MessagePackRenderer)
+    return renderers
+
+
+TRANSACTION_RENDERERS = transaction_renderers()
@@ -0,0 +1,45 @@
+"""
+Read replica selection with read-your-writes stickiness.
+
+Every primary database (default and each transaction shard) may have replicas in
+settings.DATABASE_REPLICAS. Reads that opt in go to a random replica, except for
+users who wrote within REPLICA_STICKY_SECONDS: replicas may not have their write
+yet, and a retroactive purchase changes the cost of everything after it.
+"""
+import random
+from django.conf import settings
+from django.core.cache import cache
+
+
+def replica_aliases(primary):
+    return list(getattr(settings, 'DATABASE_REPLICAS', {}).get(primary, []))
+
+
+def primary_for(alias):
+    """The primary `alias` replicates, or None if it is not a replica"""
+    for primary, replicas in getattr(settings, 'DATABASE_REPLICAS', {}).items():
+        if alias in replicas:
+            return primary
+    return None
+
+
+def sticky_key(user_id):
+    return f'replicas:recent-write:{user_id}'
+
+
+def mark_write(user_id):
+    """Keep `user_id`'s reads on the primary for the stickiness window"""
+    if settings.REPLICA_STICKY_SECONDS > 0 and any(getattr(settings, 'DATABASE_REPLICAS', {}).values()):
+        cache.set(sticky_key(user_id), True, timeout=settings.REPLICA_STICKY_SECONDS)
+
+
+def recently_wrote(user_id):
+    return cache.get(sticky_key(user_id), False)
+
+
+def read_alias(primary, user_id=None):
+    """Database to read `user_id`'s rows of `primary` from"""
+    replicas = replica_aliases(primary)
+    if not replicas or (user_id is not None and recently_wrote(user_id)):
+        return primary
+    return random.choice(replicas)
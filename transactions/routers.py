@@ -0,0 +1,114 @@
+from django.conf import settings
+from transactions.replicas import primary_for, read_alias
+from transactions.sharding import shard_for_user, sharding_enabled
+
+
+class CacheRouter:
+    """
+    Keeps the database cache's table on CACHE_DATABASE, when that is configured, and
+    nothing else there: cache writes never wait for a primary's write lock.
+    """
+    cache_app = 'django_cache'
+
+    def cache_database(self):
+        alias = getattr(settings, 'CACHE_DATABASE', None)
+        return alias if alias in settings.DATABASES else None
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label == self.cache_app:
+            return self.cache_database()
+        return None
+
+    def db_for_write(self, model, **hints):
+        return self.db_for_read(model, **hints)
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        alias = self.cache_database()
+        if alias is None:
+            return None
+        if app_label == self.cache_app:
+            return db == alias
+        if db == alias:
+            return False
+        return None
+
+
+class ReplicaRouter:
+    """
+    Sends reads hinted with `replica_of` (see ShardedQuerySet.for_user) to a replica
+    of that database, and keeps writes and migrations on primaries. Rows loaded
+    from a replica are saved back to its primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        primary = hints.get('replica_of')
+        if primary is None:
+            return None
+        return read_alias(primary, hints.get('user_id'))
+
+    def db_for_write(self, model, **hints):
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            return primary_for(instance._state.db)
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        db1 = primary_for(obj1._state.db) or obj1._state.db
+        db2 = primary_for(obj2._state.db) or obj2._state.db
+        if db1 == db2:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas are copies of their primary, never migrated directly
+        if primary_for(db) is not None:
+            return False
+        return None
+
+
+class TransactionShardRouter:
+    """
+    Routes the transactions app to the shard of the user a row belongs to, and
+    everything else to `default`. Querysets without an instance hint cannot be
+    routed, so code reading transactions uses `Transaction.objects.for_user()`.
+    """
+    sharded_app = 'transactions'
+
+    def user_shard(self, hints):
+        instance = hints.get('instance')
+        if instance is None:
+            return None
+        if instance._meta.app_label == self.sharded_app:
+            # A loaded row's shard is where it was loaded from
+            if instance._state.db:
+                return primary_for(instance._state.db) or instance._state.db
+            user = instance._state.fields_cache.get('user')
+            return shard_for_user(user if user is not None else instance.user_id)
+        if instance._meta.model_name == 'user':
+            return shard_for_user(instance)
+        return None
+
+    def db_for_read(self, model, **hints):
+        if not sharding_enabled():
+            return None
+        if model._meta.app_label == self.sharded_app:
+            return self.user_shard(hints)
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        return self.db_for_read(model, **hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Transactions reference users and products across databases
+        if sharding_enabled():
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if not sharding_enabled():
+            return None
+        # The transactions schema also exists (empty) on default, so the delete
+        # collector and unrouted admin queries find tables instead of failing
+        if app_label == self.sharded_app:
+            return True
+        return db == 'default'
@@ -1,5 +1,7 @@
 from rest_framework import serializers
-from transactions.models import Transaction
+from transactions.models import OpeningBalance, Transaction
+from transactions.sharding import shard_for_user
+from products.catalog import product_catalog
 from products.models import Product
 from django.utils import timezone
 
@@ -14,7 +16,7 @@ class TransactionCreateSerializer(serializers.ModelSerializer):
 
     def validate_product_id(self, value):
         try:
-            product = Product.objects.get(pk=value)
+            product_catalog.get(value)
         except Product.DoesNotExist:
             raise serializers.ValidationError("Product not found.")
         return value
@@ -34,9 +36,15 @@ class TransactionCreateSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("Transaction datetime cannot be in the future.")
         return value
 
+    def validate(self, data):
+        user = self.context['request'].user
+        if OpeningBalance.is_closed(user.id, data['product_id'], data['transaction_datetime'], using=shard_for_user(user)):
+            raise serializers.ValidationError({'transaction_datetime': "Transaction datetime falls in a closed period."})
+        return data
+
     def create(self, validated_data):
         product_id = validated_data.pop('product_id')
-        product = Product.objects.get(pk=product_id)
+        product = product_catalog.get(product_id)
         user = self.context['request'].user
 
         transaction = Transaction(
@@ -57,7 +65,7 @@ class TransactionUpdateSerializer(serializers.ModelSerializer):
 
     def validate_product_id(self, value):
         try:
-            Product.objects.get(pk=value)
+            product_catalog.get(value)
         except Product.DoesNotExist:
             raise serializers.ValidationError("Product not found.")
         return value
@@ -77,22 +85,34 @@ class TransactionUpdateSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("Transaction datetime cannot be in the future.")
         return value
 
-    def update(self, instance, validated_data):
+    def validate(self, data):
+        product_id = data.get('product_id', self.instance.product_id)
+        transaction_datetime = data.get('transaction_datetime', self.instance.transaction_datetime)
+        if OpeningBalance.is_closed(self.instance.user_id, product_id, transaction_datetime, using=self.instance.shard_alias()):
+            raise serializers.ValidationError({'transaction_datetime': "Transaction datetime falls in a closed period."})
+        return data
+
+    def apply(self, instance, validated_data):
+        """Set the validated changes on `instance` without saving it"""
         # Update product if provided
         if 'product_id' in validated_data:
             product_id = validated_data.pop('product_id')
-            instance.product = Product.objects.get(pk=product_id)
+            instance.product = product_catalog.get(product_id)
 
         # Update other fields
         for attr, value in validated_data.items():
             setattr(instance, attr, value)
+        return instance
 
-        instance.save()
+    def update(self, instance, validated_data):
+        self.apply(instance, validated_data)
+        # A row deleted meanwhile must fail the write, not be inserted again
+        instance.save(force_update=True)
         return instance
 
 
 class TransactionListSerializer(serializers.ModelSerializer):
-    product_name = serializers.CharField(source='product.name', read_only=True)
+    product_name = serializers.SerializerMethodField()
     cost = serializers.SerializerMethodField()
 
     class Meta:
@@ -103,5 +123,8 @@ class TransactionListSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = fields
 
+    def get_product_name(self, obj):
+        return product_catalog.get(obj.product_id).name
+
     def get_cost(self, obj):
         return obj.calculate_cost()
@@ -0,0 +1,44 @@
+"""
+User-sharded placement of the transactions app.
+
+With TRANSACTION_SHARDS configured, every (user) history in the transactions app
+lives on one shard database; users and products stay on `default`. A user's shard
+is `User.shard`, written when the user is created (from a hash of the user id) so
+that changing the shard list later does not re-home anyone. Users created before
+sharding was enabled are placed by the hash until rebalance_shards pins them.
+Primary keys are only unique within a shard; rows get new ids when a user moves.
+"""
+import zlib
+from django.conf import settings
+
+
+def shard_aliases():
+    return list(getattr(settings, 'TRANSACTION_SHARDS', []))
+
+
+def sharding_enabled():
+    return bool(getattr(settings, 'TRANSACTION_SHARDS', []))
+
+
+def hashed_shard(user_id):
+    aliases = shard_aliases()
+    if not aliases:
+        return 'default'
+    return aliases[zlib.crc32(str(user_id).encode()) % len(aliases)]
+
+
+def shard_for_user(user):
+    """
+    Database alias holding `user`'s transactions. Accepts a User or a user id; an
+    id costs a query, so pass the User where one is at hand.
+    """
+    if not sharding_enabled():
+        return 'default'
+
+    if isinstance(user, int):
+        from users.models import User
+        override = User.objects.filter(pk=user).values_list('shard', flat=True).first()
+        user_id = user
+    else:
+        override, user_id = user.shard, user.pk
+    return override or hashed_shard(user_id)
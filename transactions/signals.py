@@ -0,0 +1,139 @@
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from products.catalog import product_catalog
+from products.models import Product
+from transactions.costing import engine_for, user_cost_methods
+from transactions.models import ArchivedTransaction, HistoryVersion, OpeningBalance, Transaction, TransactionChange
+from transactions.replicas import mark_write
+from transactions.sharding import hashed_shard, shard_aliases, shard_for_user, sharding_enabled
+from users.models import User
+
+
+def log_cost_changes(user_id, states, using, exclude=(), cost_method=''):
+    """
+    Log a cost change for every transaction (other than `exclude`) in the user's
+    (product) suffixes the given states start, if their engine says they move the
+    cost of later transactions. Each history is logged once, from its earliest state.
+    `cost_method` is the user's.
+    """
+    starts = {}
+    for transaction_type, product_id, transaction_datetime in states:
+        if not engine_for(product_id, cost_method).moves_later_costs(transaction_type):
+            continue
+        if product_id not in starts or transaction_datetime < starts[product_id]:
+            starts[product_id] = transaction_datetime
+
+    for product_id, since in starts.items():
+        affected = Transaction.objects.using(using).filter(
+            user_id=user_id,
+            product_id=product_id,
+            transaction_datetime__gte=since
+        ).exclude(pk__in=exclude).values_list('id', flat=True)
+        TransactionChange.objects.using(using).bulk_create([
+            TransactionChange(user_id=user_id, transaction_id=pk, operation='cost')
+            for pk in affected
+        ])
+
+
+def log_repriced_histories(histories, using):
+    """Log a cost change for every transaction of the given (user_id, product_id) histories"""
+    for user_id, product_id in histories:
+        affected = Transaction.objects.using(using).filter(
+            user_id=user_id, product_id=product_id
+        ).values_list('id', flat=True)
+        TransactionChange.objects.using(using).bulk_create([
+            TransactionChange(user_id=user_id, transaction_id=pk, operation='cost')
+            for pk in affected
+        ], batch_size=2000)
+
+
+@receiver(pre_save, sender=Product)
+@receiver(pre_save, sender=User)
+def remember_cost_method(sender, instance, update_fields=None, **kwargs):
+    # The stored method, for the post_save receivers below to compare against
+    instance._stored_cost_method = None
+    if instance.pk is not None and (update_fields is None or 'cost_method' in update_fields):
+        instance._stored_cost_method = (
+            sender.objects.filter(pk=instance.pk).values_list('cost_method', flat=True).first()
+        )
+
+
+@receiver(post_save, sender=Product)
+def log_product_cost_method_change(sender, instance, **kwargs):
+    """A product's cost_method reprices every history of it that does not end up on the same engine"""
+    previous = getattr(instance, '_stored_cost_method', None)
+    if previous is None or previous == instance.cost_method:
+        return
+    for using in dict.fromkeys(['default', *shard_aliases()]):
+        user_ids = set(
+            Transaction.objects.using(using).filter(product_id=instance.pk).values_list('user_id', flat=True).distinct()
+        )
+        methods = user_cost_methods(user_ids)
+        log_repriced_histories([
+            (user_id, instance.pk) for user_id in user_ids
+            if (previous or methods.get(user_id) or settings.DEFAULT_COST_METHOD)
+            != (instance.cost_method or methods.get(user_id) or settings.DEFAULT_COST_METHOD)
+        ], using)
+
+
+@receiver(post_save, sender=User)
+def pin_user_shard(sender, instance, created, raw=False, **kwargs):
+    """Place a new user once, so a later change to the shard list does not move them"""
+    if not created or raw or instance.shard or not sharding_enabled():
+        return
+    instance.shard = hashed_shard(instance.pk)
+    User.objects.filter(pk=instance.pk).update(shard=instance.shard)
+
+
+@receiver(post_save, sender=User)
+def log_user_cost_method_change(sender, instance, **kwargs):
+    """A user's cost_method reprices their histories of products without a method of their own"""
+    previous = getattr(instance, '_stored_cost_method', None)
+    if previous is None or (previous or settings.DEFAULT_COST_METHOD) == (instance.cost_method or settings.DEFAULT_COST_METHOD):
+        return
+    using = shard_for_user(instance)
+    product_ids = Transaction.objects.using(using).filter(user_id=instance.pk).values_list('product_id', flat=True).distinct()
+    log_repriced_histories([
+        (instance.pk, product_id) for product_id in product_ids
+        if not product_catalog.get(product_id).cost_method
+    ], using)
+
+
+@receiver(post_save, sender=Transaction)
+def log_transaction_save(sender, instance, created, using, **kwargs):
+    mark_write(instance.user_id)
+    TransactionChange.objects.using(using).create(
+        user_id=instance.user_id,
+        transaction_id=instance.pk,
+        operation='create' if created else 'update'
+    )
+
+    new_state = (instance.transaction_type, instance.product_id, instance.transaction_datetime)
+    old_state = getattr(instance, '_loaded_state', None)
+    states = [new_state] if old_state is None else [old_state, new_state]
+    log_cost_changes(instance.user_id, states, using, exclude={instance.pk}, cost_method=instance.user.cost_method)
+    instance.remember_loaded_state()
+
+
+@receiver(post_delete, sender=Transaction)
+def log_transaction_delete(sender, instance, using, **kwargs):
+    mark_write(instance.user_id)
+    TransactionChange.objects.using(using).create(
+        user_id=instance.user_id,
+        transaction_id=instance.pk,
+        operation='delete'
+    )
+    log_cost_changes(instance.user_id, [getattr(instance, '_loaded_state', None) or (
+        instance.transaction_type, instance.product_id, instance.transaction_datetime
+    )], using, exclude={instance.pk}, cost_method=instance.user.cost_method)
+
+
+@receiver(post_delete, sender=User)
+def delete_sharded_history(sender, instance, **kwargs):
+    # The delete collector only cascades on default; remove the user's shard rows here
+    if not sharding_enabled():
+        return
+    using = shard_for_user(instance)
+    for model in (Transaction, TransactionChange, OpeningBalance, ArchivedTransaction, HistoryVersion):
+        model.objects.using(using).filter(user_id=instance.pk).raw_delete()
@@ -0,0 +1,127 @@
+"""
+Columnar snapshots of the transaction ledger, written by `manage.py export_ledger`.
+
+A snapshot directory holds `manifest.json` and one generation directory of column
+files. Each column is a raw little-endian array with one value per row: money in
+integer cents, datetimes in epoch microseconds, and the transaction type and
+database as indexes into the manifest's `transaction_types` and `databases`.
+Rows are in no particular order; sort by `transaction_datetime` (and `id`) for
+running analyses.
+
+The files can be mapped with `numpy.memmap` (or `mmap` and `memoryview.cast('q')`)
+without Django or a database; this module only needs numpy:
+
+    from transactions.snapshots import open_snapshot
+    ledger = open_snapshot('ledger')
+    sales = ledger['transaction_type'] == ledger.transaction_types.index('sale')
+    margin_cents = (ledger['total_price'] - ledger['cost'])[sales].sum()
+
+An export writes a new generation and then swaps the manifest, so an open
+snapshot keeps reading the generation it mapped.
+"""
+import json
+from pathlib import Path
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+FORMAT_VERSION = 1
+MANIFEST = 'manifest.json'
+
+# Column name -> numpy dtype string, in file order
+COLUMNS = {
+    'id': '<i8',
+    'database': '<u1',
+    'user_id': '<i8',
+    'product_id': '<i8',
+    'transaction_type': '<u1',
+    'quantity': '<i8',
+    'unit_price': '<i8',
+    'total_price': '<i8',
+    'cost': '<i8',
+    'transaction_datetime': '<i8',
+    'created_at': '<i8',
+}
+TRANSACTION_TYPES = ('purchase', 'sale')
+
+
+def column_path(directory, generation, name):
+    return Path(directory) / str(generation) / f'{name}.bin'
+
+
+def read_manifest(directory):
+    """The manifest of the snapshot in `directory`, or None if there is none"""
+    try:
+        manifest = json.loads((Path(directory) / MANIFEST).read_text())
+    except FileNotFoundError:
+        return None
+    if manifest.get('format') != FORMAT_VERSION:
+        raise ValueError(f"{directory}: unsupported ledger snapshot format {manifest.get('format')!r}")
+    return manifest
+
+
+def map_column(directory, manifest, name, mode='r'):
+    """Map one column of the manifest's generation; an empty snapshot gives an empty array"""
+    dtype = numpy.dtype(manifest['columns'][name])
+    if not manifest['rows']:
+        return numpy.zeros(0, dtype=dtype)
+    return numpy.memmap(column_path(directory, manifest['generation'], name), dtype=dtype, mode=mode,
+                        shape=(manifest['rows'],))
+
+
+class LedgerSnapshot:
+    """
+    Read-only view of a snapshot: `snapshot['cost']` is the memory-mapped column,
+    `len(snapshot)` the number of rows.
+    """
+
+    def __init__(self, directory):
+        if numpy is None:
+            raise ImportError('Reading ledger snapshots needs numpy: pip install numpy')
+        self.directory = Path(directory)
+        # An export may remove the generation between reading the manifest and mapping it
+        for attempt in range(2):
+            manifest = read_manifest(self.directory)
+            if manifest is None:
+                raise FileNotFoundError(f'No ledger snapshot in {self.directory}')
+            try:
+                self.columns = {name: map_column(self.directory, manifest, name) for name in manifest['columns']}
+                break
+            except FileNotFoundError:
+                if attempt:
+                    raise
+        self.manifest = manifest
+
+    def __len__(self):
+        return self.manifest['rows']
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    @property
+    def transaction_types(self):
+        return list(self.manifest['transaction_types'])
+
+    @property
+    def databases(self):
+        return list(self.manifest['databases'])
+
+    @property
+    def products(self):
+        """Product names by id"""
+        return {int(pk): name for pk, name in self.manifest['products'].items()}
+
+    @property
+    def exported_at(self):
+        return self.manifest['exported_at']
+
+    def to_pandas(self):
+        """A pandas DataFrame over the columns; pandas decides whether it copies them"""
+        import pandas
+        return pandas.DataFrame(self.columns, copy=False)
+
+
+def open_snapshot(directory):
+    return LedgerSnapshot(directory)
@@ -0,0 +1,164 @@
+"""
+Cost-weighted token-bucket throttling.
+
+Every request spends tokens: THROTTLE_COSTS in REST_FRAMEWORK maps an endpoint
+(`<basename>.<action>` for viewsets, the URL name otherwise) to its weight, 1 by
+default, so a full history listing costs more than a retrieve. Rates use the
+usual DEFAULT_THROTTLE_RATES format: '600/min' is a bucket of 600 tokens that
+refills at 600 tokens a minute.
+
+- UserTokenBucketThrottle: one bucket per user ('user' rate), or per client IP
+  for anonymous requests ('anon' rate), across all endpoints.
+- EndpointTokenBucketThrottle: one bucket per user and endpoint, for endpoints
+  with their own rate (e.g. 'transaction.list').
+
+A bucket is stored as its theoretical arrival time (GCRA): the moment it would
+be full again, in integer microseconds. Buckets live in the BUCKET_CACHE cache,
+which must update them atomically, and each spend or refund is one write that also
+renews the bucket's timeout:
+- RedisCache: INCRBY and EXPIRE in one MULTI/EXEC. Every worker shares the buckets.
+- LocMemCache: a get and set under a process-wide lock. Every worker process has
+  its own buckets, so the effective rate is the configured one times the workers.
+With any other backend, or none, requests are not throttled (transactions.checks
+warns). DRF turns a refusal into `429 Too Many Requests` with a `Retry-After` header.
+DRF asks every throttle, so a refused request gives back the tokens the other
+buckets took and the later ones take none.
+"""
+import threading
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.cache.backends.redis import RedisCache
+from rest_framework.settings import api_settings
+from rest_framework.throttling import SimpleRateThrottle
+
+MICROSECONDS = 1_000_000
+BUCKET_CACHE = 'throttle'
+
+# Serialises bucket updates in this process's LocMemCache
+local_bucket_lock = threading.Lock()
+
+
+def endpoint_name(request, view):
+    basename = getattr(view, 'basename', None)
+    action = getattr(view, 'action', None)
+    if basename and action:
+        return f'{basename}.{action}'
+    match = getattr(request, 'resolver_match', None)
+    return match.url_name if match is not None and match.url_name else view.__class__.__name__
+
+
+def bucket_cache():
+    """The cache holding the buckets, or None if it is missing or cannot update them atomically"""
+    if BUCKET_CACHE not in settings.CACHES:
+        return None
+    cache = caches[BUCKET_CACHE]
+    return cache if isinstance(cache, (RedisCache, LocMemCache)) else None
+
+
+def request_cost(request, view):
+    return api_settings.user_settings.get('THROTTLE_COSTS', {}).get(endpoint_name(request, view), 1)
+
+
+class TokenBucketThrottle(SimpleRateThrottle):
+    """Base class: subclasses pick the scope and the bucket key"""
+    cache_format = 'throttle:%(scope)s:%(ident)s'
+
+    def allow_request(self, request, view):
+        self.wait_seconds = None
+        self.cache = bucket_cache()
+        if self.cache is None or self.rate is None or getattr(request, 'token_bucket_refused', False):
+            return True
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+
+        spent = request.__dict__.setdefault('token_bucket_spent', [])
+        delta = self.spend(request_cost(request, view))
+        if delta is not None:
+            spent.append((self, self.key, delta))
+            return True
+        request.token_bucket_refused = True
+        for throttle, key, refund in spent:
+            throttle.advance(key, -refund)
+        return False
+
+    def advance(self, key, delta):
+        """
+        Add `delta` to the bucket at `key` (a missing bucket counts as 0) and renew its
+        timeout, in one atomic write; returns the new arrival time. Spends never push the
+        arrival time more than the bucket's capacity (`duration`) ahead, so the timeout
+        outlives it.
+        """
+        timeout = self.duration + 1
+        if isinstance(self.cache, RedisCache):
+            # Django's incr() cannot set a timeout, so talk to the client behind it
+            key = self.cache.make_and_validate_key(key)
+            client = self.cache._cache.get_client(key, write=True)
+            arrival, _ = client.pipeline().incrby(key, delta).expire(key, timeout).execute()
+            return arrival
+        with local_bucket_lock:
+            arrival = self.cache.get(key, 0) + delta
+            self.cache.set(key, arrival, timeout)
+        return arrival
+
+    def spend(self, cost):
+        """
+        Take `cost` tokens from the bucket and return the amount its arrival time
+        moved, or leave the bucket untouched and return None.
+        """
+        interval = self.duration * MICROSECONDS / self.num_requests  # refill time of one token
+        capacity = self.duration * MICROSECONDS
+        # A request costing more than the bucket holds would never pass; it empties a full one
+        delta = min(round(cost * interval), capacity)
+        now = int(self.timer() * MICROSECONDS)
+
+        arrival = self.advance(self.key, delta)
+        if arrival - delta < now:
+            # The bucket was full (or missing): start from now. Two requests racing here
+            # can each spend from a full bucket once, which only errs on the generous side.
+            arrival = now + delta
+            self.cache.set(self.key, arrival, self.duration + 1)
+
+        if arrival - now > capacity:
+            self.advance(self.key, -delta)
+            self.wait_seconds = (arrival - now - capacity) / MICROSECONDS
+            return None
+        return delta
+
+    def get_cache_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            ident = request.user.pk
+        else:
+            ident = self.get_ident(request)
+        return self.cache_format % {'scope': self.scope, 'ident': ident}
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class UserTokenBucketThrottle(TokenBucketThrottle):
+    scope = 'user'
+
+    def allow_request(self, request, view):
+        if not request.user or not request.user.is_authenticated:
+            self.scope = 'anon'
+            self.rate = self.get_rate()
+            self.num_requests, self.duration = self.parse_rate(self.rate)
+        return super().allow_request(request, view)
+
+    def get_rate(self):
+        # Unconfigured means unthrottled rather than ImproperlyConfigured
+        return self.THROTTLE_RATES.get(self.scope)
+
+
+class EndpointTokenBucketThrottle(TokenBucketThrottle):
+    def __init__(self):
+        # The rate depends on the endpoint, so it is looked up per request
+        pass
+
+    def allow_request(self, request, view):
+        self.scope = endpoint_name(request, view)
+        self.rate = self.THROTTLE_RATES.get(self.scope)
+        self.num_requests, self.duration = self.parse_rate(self.rate)
+        return super().allow_request(request, view)
@@ -1,19 +1,39 @@
+import copy
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.fields import IntegerField
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
-from transactions.models import Transaction
+from rest_framework.permissions import SAFE_METHODS, IsAuthenticated
+from products.catalog import product_catalog
+from products.models import Product
+from transactions.concurrency import HistoryConflict, versioned_write
+from transactions.costing import CostDelta, preview_costs, query_unit_costs
+from transactions.encoders import TransactionRowEncoder, to_cents
+from transactions.models import OpeningBalance, Transaction, TransactionChange
+from transactions.renderers import TRANSACTION_RENDERERS
+from transactions.replicas import mark_write
+from transactions.sharding import shard_for_user, sharding_enabled
 from transactions.serializers import TransactionCreateSerializer, TransactionListSerializer, TransactionUpdateSerializer
+from transactions.signals import log_cost_changes
 
 
 class TransactionViewSet(viewsets.ModelViewSet):
     """ViewSet for handling purchase and sale transactions"""
     permission_classes = [IsAuthenticated]
     http_method_names = ['get', 'post', 'put', 'patch', 'delete']
+    renderer_classes = TRANSACTION_RENDERERS
+    CHANGES_PAGE_SIZE = 500
+    BULK_MAX_ITEMS = 500
+    BULK_UPDATE_FIELDS = ['transaction_type', 'product', 'quantity', 'unit_price', 'total_price', 'transaction_datetime']
 
     def get_queryset(self):
-        """Return transactions for the authenticated user"""
-        return Transaction.objects.filter(user=self.request.user).order_by('transaction_datetime')
+        """Return transactions for the authenticated user; safe requests may read a replica"""
+        replica = self.request.method in SAFE_METHODS
+        # Ties broken by id: FIFO consumes lots in this order
+        return Transaction.objects.for_user(self.request.user, replica=replica).order_by('transaction_datetime', 'id')
 
     def get_serializer_class(self):
         """Use different serializers for different actions"""
@@ -23,39 +43,208 @@ class TransactionViewSet(viewsets.ModelViewSet):
             return TransactionUpdateSerializer
         return TransactionListSerializer
 
+    def wants_compact(self):
+        """MessagePack clients get the compact schema (integer cents, epoch microseconds)"""
+        return getattr(self.request.accepted_renderer, 'format', None) == 'msgpack'
+
+    def encoder(self):
+        return TransactionRowEncoder(self.request.user.id, self.request.user.cost_method)
+
+    def rows_response(self, key, queryset, transaction_type=None):
+        """Encode `queryset` under `key` with its count, in the schema the client negotiated"""
+        rows, count = self.encode_fetched(*self.encoder().fetch(queryset), transaction_type=transaction_type)
+        return Response({'count': count, key: rows}, status=status.HTTP_200_OK)
+
+    def encode_fetched(self, rows, costs, transaction_type=None):
+        """Encode fetched rows in the negotiated schema, returning (data, row count)"""
+        encoder = self.encoder()
+        if self.wants_compact() and self.request.query_params.get('columnar') in ('1', 'true'):
+            data = encoder.format_compact(rows, costs, transaction_type, columnar=True)
+            return data, len(data['id'])
+        elif self.wants_compact():
+            data = encoder.format_compact(rows, costs, transaction_type)
+        else:
+            data = encoder.format_rows(rows, costs, transaction_type)
+        return data, len(data)
+
+    def encode_instance(self, transaction):
+        if self.wants_compact():
+            return self.encoder().encode_instance_compact(transaction)
+        return TransactionListSerializer(transaction).data
+
+    def cost_delta(self):
+        """Return a CostDelta when the client asked for `?affected_costs=1`, otherwise None"""
+        if self.request.query_params.get('affected_costs') in ('1', 'true'):
+            return CostDelta(self.get_queryset(), self.request.user.id, self.request.user.cost_method)
+        return None
+
+    def encode_changes(self, changes):
+        if self.wants_compact():
+            return [{'id': change['id'], 'cost': to_cents(change['cost'])} for change in changes]
+        return changes
+
+    def conflict_response(self):
+        return Response(
+            {'error': 'This product history is being changed by another request. Please retry.'},
+            status=status.HTTP_409_CONFLICT
+        )
+
+    def bulk_ids(self, items, id_of):
+        """Return the ids of a bulk request's `items` and None, or None and an error response"""
+        if not isinstance(items, list) or not items:
+            return None, Response({'error': 'Expected a non-empty list'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > self.BULK_MAX_ITEMS:
+            return None, Response(
+                {'error': f'At most {self.BULK_MAX_ITEMS} transactions per request'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            ids = [int(id_of(item)) for item in items]
+        except (KeyError, TypeError, ValueError):
+            return None, Response({'error': 'Every item needs an integer id'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(set(ids)) != len(ids):
+            return None, Response({'error': 'Duplicate ids'}, status=status.HTTP_400_BAD_REQUEST)
+        return ids, None
+
+    def bulk_instances(self, ids):
+        """The user's transactions with these ids, in the given order; raises NotFound for missing ones"""
+        found = self.get_queryset().in_bulk(ids)
+        missing = [pk for pk in ids if pk not in found]
+        if missing:
+            raise NotFound({'error': f"Transactions not found: {', '.join(map(str, missing))}"})
+        return [found[pk] for pk in ids]
+
+    def bulk_serializers(self, items, ids):
+        """Validate every change against its transaction; returns (serializers, errors by id)"""
+        context = self.get_serializer_context()
+        serializers, errors = [], {}
+        for item, instance in zip(items, self.bulk_instances(ids)):
+            changes = {field: value for field, value in item.items() if field != 'id'}
+            serializer = TransactionUpdateSerializer(instance, data=changes, partial=True, context=context)
+            if serializer.is_valid():
+                serializers.append(serializer)
+            else:
+                errors[instance.pk] = serializer.errors
+        return serializers, errors
+
+    def retrieve(self, request, *args, **kwargs):
+        """Retrieve a single transaction"""
+        return Response(self.encode_instance(self.get_object()), status=status.HTTP_200_OK)
+
+    def requested_product_id(self, data, default=None):
+        """
+        The product a write names (else `default`), to pick the histories to version
+        before validating; None when it is not an integer, which validation reports.
+        """
+        value = data.get('product_id', default) if isinstance(data, dict) else default
+        try:
+            return IntegerField().to_internal_value(value)
+        except ValidationError:
+            return None
+
     def create(self, request, *args, **kwargs):
         """Create a new transaction (purchase or sale)"""
-        serializer = self.get_serializer(data=request.data)
-        if serializer.is_valid():
-            transaction = serializer.save()
-            return Response(
-                {
-                    'message': 'Transaction recorded successfully',
-                    'transaction': TransactionListSerializer(transaction).data
-                },
-                status=status.HTTP_201_CREATED
-            )
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        product_id = self.requested_product_id(request.data)
+        if product_id is None:
+            serializer = self.get_serializer(data=request.data)
+            serializer.is_valid()
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        def record(attempt):
+            # Validate once the version is read: the history (or its closed period) may have moved on
+            current = self.get_serializer(data=request.data)
+            current.is_valid(raise_exception=True)
+            delta = self.cost_delta()
+            if delta is not None:
+                data = current.validated_data
+                delta.track(data['transaction_type'], data['product_id'], data['transaction_datetime'])
+                delta.begin()
+
+            transaction = current.save()
+            response_data = {
+                'message': 'Transaction recorded successfully',
+                'transaction': self.encode_instance(transaction)
+            }
+            if delta is not None:
+                response_data['affected_costs'] = self.encode_changes(delta.changes(exclude={transaction.id}))
+            return response_data
+
+        try:
+            response_data = versioned_write(request.user, [product_id], record)
+        except HistoryConflict:
+            return self.conflict_response()
+        return Response(response_data, status=status.HTTP_201_CREATED)
 
     def update(self, request, *args, **kwargs):
         """Update a transaction"""
         instance = self.get_object()
-        serializer = self.get_serializer(instance, data=request.data, partial=kwargs.get('partial', False))
-        if serializer.is_valid():
-            transaction = serializer.save()
+        partial = kwargs.get('partial', False)
+        product_ids = {instance.product_id, self.requested_product_id(request.data, instance.product_id)}
+
+        def record(attempt):
+            # Load and validate once the versions are read: the transaction may have
+            # been changed, closed into an opening balance or purged since `instance`
+            current = self.get_serializer(self.get_object(), data=request.data, partial=partial)
+            current.is_valid(raise_exception=True)
+            if current.instance.product_id not in product_ids:
+                raise HistoryConflict('Transaction moved to another product')
+            original = current.instance
+            delta = self.cost_delta()
+            if delta is not None:
+                # Both the old and the new state can move other costs
+                data = current.validated_data
+                delta.track(original.transaction_type, original.product_id, original.transaction_datetime)
+                delta.track(
+                    data.get('transaction_type', original.transaction_type),
+                    data.get('product_id', original.product_id),
+                    data.get('transaction_datetime', original.transaction_datetime),
+                )
+                delta.begin()
+
+            transaction = current.save()
+            response_data = {
+                'message': 'Transaction updated successfully',
+                'transaction': self.encode_instance(transaction)
+            }
+            if delta is not None:
+                response_data['affected_costs'] = self.encode_changes(delta.changes(exclude={transaction.id}))
+            return response_data
+
+        try:
+            response_data = versioned_write(request.user, product_ids - {None}, record)
+        except HistoryConflict:
+            return self.conflict_response()
+        return Response(response_data, status=status.HTTP_200_OK)
+
+    def destroy(self, request, *args, **kwargs):
+        """Delete a transaction"""
+        product_id = self.get_object().product_id
+
+        def remove(attempt):
+            # Load once the version is read, as in update
+            current = self.get_object()
+            if current.product_id != product_id:
+                raise HistoryConflict('Transaction moved to another product')
+            delta = self.cost_delta()
+            if delta is not None:
+                delta.track(current.transaction_type, current.product_id, current.transaction_datetime)
+                delta.begin()
+            current.delete()
+            return delta.changes() if delta is not None else None
+
+        try:
+            changes = versioned_write(request.user, [product_id], remove)
+        except HistoryConflict:
+            return self.conflict_response()
+        if changes is not None:
+            # 204 responses cannot carry a body, so reply 200 when costs were requested
             return Response(
                 {
-                    'message': 'Transaction updated successfully',
-                    'transaction': TransactionListSerializer(transaction).data
+                    'message': 'Transaction deleted successfully',
+                    'affected_costs': self.encode_changes(changes)
                 },
                 status=status.HTTP_200_OK
             )
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-
-    def destroy(self, request, *args, **kwargs):
-        """Delete a transaction"""
-        instance = self.get_object()
-        instance.delete()
         return Response(
             {'message': 'Transaction deleted successfully'},
             status=status.HTTP_204_NO_CONTENT
@@ -63,38 +252,307 @@ class TransactionViewSet(viewsets.ModelViewSet):
 
     def list(self, request, *args, **kwargs):
         """Retrieve all transactions for the user"""
-        queryset = self.get_queryset()
-        serializer = self.get_serializer(queryset, many=True)
+        return self.rows_response('transactions', self.get_queryset())
+
+    @action(detail=False, methods=['get'])
+    def purchases(self, request):
+        """Retrieve all purchase transactions"""
+        return self.rows_response('purchases', self.get_queryset().filter(transaction_type='purchase'))
+
+    @action(detail=False, methods=['get'])
+    def sales(self, request):
+        """Retrieve all sale transactions with costing information"""
+        # Sale costs depend on earlier purchases, so encode the full history and keep sales
+        return self.rows_response('sales', self.get_queryset(), transaction_type='sale')
+
+    @action(detail=False, methods=['get'])
+    def changes(self, request):
+        """
+        Incremental sync: everything that changed after the `since` cursor.
+        Changed transactions are returned in full; deleted ones as tombstone ids.
+        With sharding the cursor is `<shard>:<id>`; a cursor from another shard
+        (the user was moved) restarts the feed with `reset` set, and clients
+        should drop their local copy before applying it.
+        """
+        shard = shard_for_user(request.user)
+        alias, _, position = request.query_params.get('since', '0').rpartition(':')
+        reset = bool(alias) and alias != shard
+        try:
+            since = 0 if reset else int(position)
+            limit = min(max(int(request.query_params.get('limit', self.CHANGES_PAGE_SIZE)), 1), self.CHANGES_PAGE_SIZE)
+        except ValueError:
+            return Response({'error': 'since and limit must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Read the log and the transactions from the same database (replicas can lag differently)
+        history = self.get_queryset()
+        entries = list(
+            TransactionChange.objects.using(history.db).filter(user=request.user, id__gt=since)
+            .order_by('id').values_list('id', 'transaction_id')[:limit + 1]
+        )
+        has_more = len(entries) > limit
+        entries = entries[:limit]
+        changed_ids = {transaction_id for _, transaction_id in entries}
+
+        rows, costs = self.encoder().fetch_ids(history, changed_ids)
+        data, count = self.encode_fetched(rows, costs)
+        deleted = sorted(changed_ids.difference(row[0] for row in rows))
+        cursor = entries[-1][0] if entries else since
         return Response(
             {
-                'count': queryset.count(),
-                'transactions': serializer.data
+                'cursor': f'{shard}:{cursor}' if sharding_enabled() else cursor,
+                'reset': reset,
+                'has_more': has_more,
+                'count': count,
+                'changes': data,
+                'deleted': deleted
             },
             status=status.HTTP_200_OK
         )
 
-    @action(detail=False, methods=['get'])
-    def purchases(self, request):
-        """Retrieve all purchase transactions"""
-        queryset = self.get_queryset().filter(transaction_type='purchase')
-        serializer = self.get_serializer(queryset, many=True)
+    @action(detail=False, methods=['post'])
+    def preview(self, request):
+        """
+        What-if for a proposed write, without committing it:
+        `{"operation": "create", "transaction": {...}}`,
+        `{"operation": "update", "id": 1, "transaction": {...changes}}` or
+        `{"operation": "delete", "id": 1}`. The write is validated as the real endpoint
+        would, then only the suffix of each touched history is priced with and without
+        it, in memory. Nothing is saved, logged or versioned.
+        """
+        data = request.data if isinstance(request.data, dict) else {}
+        operation = data.get('operation')
+        if operation not in ('create', 'update', 'delete'):
+            return Response({'error': 'operation must be create, update or delete'}, status=status.HTTP_400_BAD_REQUEST)
+
+        removed = added = None
+        if operation == 'create':
+            serializer = TransactionCreateSerializer(data=data.get('transaction'), context=self.get_serializer_context())
+            if not serializer.is_valid():
+                return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+            added = Transaction(user=request.user, **serializer.validated_data)
+        else:
+            ids, error = self.bulk_ids([data], lambda item: item['id'])
+            if error is not None:
+                return error
+            removed = self.bulk_instances(ids)[0]
+        if operation == 'update':
+            serializer = TransactionUpdateSerializer(
+                removed, data=data.get('transaction'), partial=True, context=self.get_serializer_context()
+            )
+            if not serializer.is_valid():
+                return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+            added = serializer.apply(copy.copy(removed), dict(serializer.validated_data))
+
+        before, after = preview_costs(self.get_queryset(), request.user.id, removed, added, request.user.cost_method)
+        proposed_id = removed.pk if removed is not None else None
         return Response(
             {
-                'count': queryset.count(),
-                'purchases': serializer.data
+                'operation': operation,
+                'transaction': {
+                    'id': proposed_id,
+                    'cost_before': self.encode_cost(before.get(proposed_id)),
+                    'cost_after': self.encode_cost(after.get(proposed_id)),
+                },
+                'affected_costs': [
+                    {'id': pk, 'cost_before': self.encode_cost(cost), 'cost_after': self.encode_cost(after[pk])}
+                    for pk, cost in before.items()
+                    if pk != proposed_id and after[pk] != cost
+                ]
             },
             status=status.HTTP_200_OK
         )
 
-    @action(detail=False, methods=['get'])
-    def sales(self, request):
-        """Retrieve all sale transactions with costing information"""
-        queryset = self.get_queryset().filter(transaction_type='sale')
-        serializer = self.get_serializer(queryset, many=True)
+    def encode_cost(self, cost):
+        if cost is None:
+            return None
+        return to_cents(cost) if self.wants_compact() else float(cost)
+
+    @action(detail=False, methods=['patch'])
+    def bulk(self, request):
+        """
+        Update many transactions at once: `{"transactions": [{"id": 1, "quantity": 5}, ...]}`.
+        Every change is validated first and nothing is applied if one fails. The rest
+        runs in one database transaction with a single bulk UPDATE, and each affected
+        (user, product) history logs its cost changes once, from the earliest touched purchase.
+        """
+        items = request.data.get('transactions') if isinstance(request.data, dict) else None
+        ids, error = self.bulk_ids(items, lambda item: item['id'])
+        if error is not None:
+            return error
+        product_ids = set()
+        for item, instance in zip(items, self.bulk_instances(ids)):
+            product_ids.update({instance.product_id, self.requested_product_id(item, instance.product_id)})
+
+        def record(attempt):
+            # Load and validate once the versions are read, as in update
+            current, errors = self.bulk_serializers(items, ids)
+            if errors:
+                raise ValidationError({'errors': errors})
+            if any(serializer.instance.product_id not in product_ids for serializer in current):
+                raise HistoryConflict('Transaction moved to another product')
+            delta = self.cost_delta()
+            states = []
+            instances = []
+            for serializer in current:
+                instance = serializer.instance
+                states.append((instance.transaction_type, instance.product_id, instance.transaction_datetime))
+                serializer.apply(instance, serializer.validated_data)
+                instance.total_price = instance.quantity * instance.unit_price
+                states.append((instance.transaction_type, instance.product_id, instance.transaction_datetime))
+                instances.append(instance)
+            if delta is not None:
+                for state in states:
+                    delta.track(*state)
+                delta.begin()
+
+            # bulk_update skips save() and its signals, so log the changes here, once per history
+            using = shard_for_user(request.user)
+            Transaction.objects.using(using).bulk_update(instances, self.BULK_UPDATE_FIELDS)
+            TransactionChange.objects.using(using).bulk_create([
+                TransactionChange(user_id=request.user.id, transaction_id=pk, operation='update') for pk in ids
+            ])
+            log_cost_changes(request.user.id, states, using, exclude=set(ids), cost_method=request.user.cost_method)
+            for instance in instances:
+                instance.remember_loaded_state()
+            return delta.changes(exclude=set(ids)) if delta is not None else None
+
+        try:
+            changes = versioned_write(request.user, product_ids - {None}, record)
+        except HistoryConflict:
+            return self.conflict_response()
+        mark_write(request.user.id)
+
+        rows, costs = self.encoder().fetch_ids(self.get_queryset(), ids)
+        data, count = self.encode_fetched(rows, costs)
+        response_data = {
+            'message': f'{count} transactions updated successfully',
+            'transactions': data
+        }
+        if changes is not None:
+            response_data['affected_costs'] = self.encode_changes(changes)
+        return Response(response_data, status=status.HTTP_200_OK)
+
+    @bulk.mapping.delete
+    def bulk_destroy(self, request):
+        """
+        Delete many transactions at once: `{"ids": [1, 2, ...]}`, in one database
+        transaction with a single DELETE. Like `bulk`, cost changes are logged once per history.
+        """
+        items = request.data.get('ids') if isinstance(request.data, dict) else None
+        ids, error = self.bulk_ids(items, lambda item: item)
+        if error is not None:
+            return error
+        product_ids = {instance.product_id for instance in self.bulk_instances(ids)}
+
+        def remove(attempt):
+            instances = self.bulk_instances(ids)
+            if any(instance.product_id not in product_ids for instance in instances):
+                raise HistoryConflict('Transaction moved to another product')
+            states = [(instance.transaction_type, instance.product_id, instance.transaction_datetime) for instance in instances]
+            delta = self.cost_delta()
+            if delta is not None:
+                for state in states:
+                    delta.track(*state)
+                delta.begin()
+
+            # Raw delete: skip the collector and the per-row signals, log the changes once per history
+            using = shard_for_user(request.user)
+            Transaction.objects.using(using).filter(user_id=request.user.id, id__in=ids).raw_delete()
+            TransactionChange.objects.using(using).bulk_create([
+                TransactionChange(user_id=request.user.id, transaction_id=pk, operation='delete') for pk in ids
+            ])
+            log_cost_changes(request.user.id, states, using, cost_method=request.user.cost_method)
+            return delta.changes() if delta is not None else None
+
+        try:
+            changes = versioned_write(request.user, product_ids, remove)
+        except HistoryConflict:
+            return self.conflict_response()
+        mark_write(request.user.id)
+        if changes is not None:
+            return Response(
+                {
+                    'message': f'{len(ids)} transactions deleted successfully',
+                    'affected_costs': self.encode_changes(changes)
+                },
+                status=status.HTTP_200_OK
+            )
+        return Response(
+            {'message': f'{len(ids)} transactions deleted successfully'},
+            status=status.HTTP_204_NO_CONTENT
+        )
+
+
+class CostViewSet(viewsets.ViewSet):
+    """Costs at arbitrary moments of the authenticated user's histories"""
+    permission_classes = [IsAuthenticated]
+    QUERY_MAX_ITEMS = 10000
+
+    @action(detail=False, methods=['post'])
+    def query(self, request):
+        """
+        Unit costs at points in time: `{"queries": [{"product_id": 1, "as_of": "<ISO 8601>"}, ...]}`.
+        Each answer is the cost of one unit sold at `as_of`, priced by the history's
+        engine from every transaction up to and including `as_of`. Answers keep the
+        input order; each product's history is read once for the whole batch.
+        """
+        items = request.data.get('queries') if isinstance(request.data, dict) else None
+        if not isinstance(items, list) or not items:
+            return Response({'error': 'Expected a non-empty list'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > self.QUERY_MAX_ITEMS:
+            return Response(
+                {'error': f'At most {self.QUERY_MAX_ITEMS} queries per request'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        history = Transaction.objects.for_user(request.user, replica=True)
+        queries, errors = self.parse_queries(items, history.db)
+        if errors:
+            return Response({'errors': errors}, status=status.HTTP_400_BAD_REQUEST)
+
+        costs = query_unit_costs(history, request.user.id, queries, request.user.cost_method)
+        format_datetime = TransactionRowEncoder().format_datetime
         return Response(
             {
-                'count': queryset.count(),
-                'sales': serializer.data
+                'count': len(queries),
+                'results': [
+                    {'product_id': product_id, 'as_of': format_datetime(as_of), 'unit_cost': float(cost)}
+                    for (product_id, as_of), cost in zip(queries, costs)
+                ]
             },
             status=status.HTTP_200_OK
         )
+
+    def parse_queries(self, items, using):
+        """(product_id, as_of) pairs and the errors by index; closed periods cannot be queried"""
+        closed = dict(
+            OpeningBalance.objects.using(using).filter(user_id=self.request.user.id)
+            .values_list('product_id', 'closing_datetime')
+        )
+        known = {}
+        queries, errors = [], {}
+        for index, item in enumerate(items):
+            try:
+                product_id = int(item['product_id'])
+                as_of = parse_datetime(item['as_of'])
+            except (KeyError, TypeError, ValueError):
+                as_of = None
+            if as_of is None:
+                errors[index] = {'non_field_errors': ['Expected {"product_id": <integer>, "as_of": <ISO 8601 datetime>}.']}
+                continue
+            if product_id not in known:
+                try:
+                    product_catalog.get(product_id)
+                    known[product_id] = True
+                except Product.DoesNotExist:
+                    known[product_id] = False
+            if not known[product_id]:
+                errors[index] = {'product_id': ['Product not found.']}
+                continue
+            if timezone.is_naive(as_of):
+                as_of = timezone.make_aware(as_of)
+            if product_id in closed and as_of < closed[product_id]:
+                errors[index] = {'as_of': ['Falls in a closed period.']}
+                continue
+            queries.append((product_id, as_of))
+        return queries, errors
@@ -0,0 +1,19 @@
+# Generated by Django 6.0.2 on 2026-10-19 18:10
+
+import products.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_user_cost_method'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='user',
+            name='cost_method',
+            field=models.CharField(blank=True, choices=products.models.cost_method_choices, default='', max_length=16),
+        ),
+    ]
@@ -1,10 +1,16 @@
 from django.db import models
 from django.contrib.auth.models import AbstractUser
+from products.models import cost_method_choices
 
 
 class User(AbstractUser):
     """Custom user model extending Django's AbstractUser"""
     email = models.EmailField(unique=True)
+    # Transaction shard override; blank means placement by hash of the user id
+    shard = models.CharField(max_length=64, blank=True, default='')
+    # Cost engine for this user's histories (a COST_ENGINES key), unless the product sets one;
+    # blank means DEFAULT_COST_METHOD
+    cost_method = models.CharField(max_length=16, blank=True, default='', choices=cost_method_choices)
 
     def __str__(self):
         return self.username